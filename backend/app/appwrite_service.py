@@ -1,55 +1,310 @@
-from appwrite.client import Client
-from appwrite.services.databases import Databases
 from appwrite.exception import AppwriteException
+from app.circuit_breaker import CircuitBreaker
 from app.config import settings
-from typing import List, Dict, Any, Optional
+from app.executor import appwrite_executor, sqlite_executor
+from app.local_store import LocalConversationStore
+from app.metrics import (
+    FALLBACKS, LOCAL_STORE_ERRORS, UPSTREAM_CALL_SECONDS, UPSTREAM_ERRORS, WRITE_BEHIND_DEAD_LETTERS
+)
+from app.session_cache import SessionCache
+from app.sqlite_store import SqliteConversationStore
+from app.write_behind import PartialFlush, WriteBehindQueue
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+import asyncio
+import base64
+import gzip
+import json
+import sqlite3
+import time
 import uuid
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _rejected(error: Exception) -> bool:
+    """Client errors that retrying the same request cannot fix"""
+    return (isinstance(error, AppwriteException) and bool(error.code)
+            and 400 <= error.code < 500 and error.code not in (408, 429))
+
+def _to_plain(result: Any) -> Any:
+    """Turn SDK response models into the plain dicts older SDK versions returned.
+
+    Newer appwrite SDKs return pydantic models with custom attributes nested
+    under `data`; callers here index documents by attribute name.
+    """
+    if hasattr(result, "model_dump"):
+        result = result.model_dump(by_alias=True)
+    if not isinstance(result, dict):
+        return result
+    if isinstance(result.get("data"), dict) and "$id" in result:
+        result = {**result.pop("data"), **result}
+    if isinstance(result.get("documents"), list):
+        result["documents"] = [_to_plain(document) for document in result["documents"]]
+    if isinstance(result.get("total"), float):
+        result["total"] = int(result["total"])
+    return result
+
+def pack_messages(messages: List[Dict[str, Any]]) -> str:
+    """Gzip a batch of messages as JSON lines, base64-encoded to fit a string attribute"""
+    fields = ("id", "session_id", "role", "content", "timestamp")
+    lines = "\n".join(json.dumps({key: message.get(key) for key in fields}) for message in messages)
+    return base64.b64encode(gzip.compress(lines.encode("utf-8"))).decode("ascii")
+
+def unpack_messages(data: str) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in gzip.decompress(base64.b64decode(data)).decode("utf-8").splitlines()]
+
+def _new_conversation(session_id: str) -> Dict[str, Any]:
+    """An unsaved conversation, returned when the local store cannot create one"""
+    now = datetime.now().isoformat()
+    return {"session_id": session_id, "created_at": now, "updated_at": now}
+
 class AppwriteService:
     def __init__(self):
         self.use_mock = True  # Start in mock mode for demo
-        self.mock_data = {}  # In-memory storage for demo
+        # The SDK client and its connection pool are created by start()
+        self.configured = (settings.appwrite_api_key != "demo_api_key" and
+                           settings.appwrite_project_id != "demo_project")
+        self.http_pool = None
+        self._started = False
+        # Upstream failures trip the breaker; the local store serves requests until it recovers
+        self.breaker = CircuitBreaker(
+            "appwrite",
+            failure_rate=settings.breaker_failure_rate,
+            minimum_calls=settings.breaker_minimum_calls,
+            window_seconds=settings.breaker_window_seconds,
+            backoff_seconds=settings.breaker_backoff_seconds,
+            max_backoff_seconds=settings.breaker_max_backoff_seconds,
+            probe_timeout_seconds=settings.appwrite_timeout_seconds
+        )
+        self.breaker.add_listener(self._on_breaker_change)
+        # Writes that went to the local store while Appwrite was down, replayed once it recovers
+        self._unsynced_messages: List[Dict[str, Any]] = []
+        self._unsynced_updates: Dict[str, Dict[str, Any]] = {}
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._prune_task: Optional[asyncio.Task] = None
+        # Local storage for demo mode and for fallback when Appwrite is unavailable;
+        # the SQLite backend is shared by all worker processes on the host
+        if settings.local_store_backend == "sqlite":
+            self.local_store = SqliteConversationStore(settings.local_store_path)
+        else:
+            self.local_store = LocalConversationStore(
+                max_bytes=settings.local_store_max_mb * 1024 * 1024,
+                idle_seconds=settings.local_store_idle_seconds,
+                spill_dir=settings.local_store_spill_dir
+            )
+        
+        # Hot sessions are served from memory instead of re-reading Appwrite every turn
+        self.session_cache = SessionCache(
+            max_sessions=settings.session_cache_size,
+            ttl_seconds=settings.session_cache_ttl_seconds,
+            window=settings.session_cache_window,
+            version_check_seconds=settings.session_cache_version_check_seconds,
+            versions=self.local_store if isinstance(self.local_store, SqliteConversationStore) else None
+        )
         
+        # Message writes and timestamp bumps are batched off the request path
+        self.write_behind = None
+        if settings.appwrite_write_behind:
+            self.write_behind = WriteBehindQueue(
+                self._flush_writes,
+                batch_size=settings.appwrite_flush_batch_size,
+                flush_interval=settings.appwrite_flush_interval_seconds,
+                max_attempts=settings.appwrite_flush_max_attempts,
+                dead_letter=self._dead_letter
+            )
+        
+    async def start(self, warmup: bool = True):
+        """Create the Appwrite client and open its first pooled connection.
+
+        Kept out of __init__ so importing the app stays fast: the SDK import
+        runs in a worker thread while the server is already accepting
+        connections. Safe to call more than once.
+        """
+        if self._started:
+            return
+        self._started = True
+        if isinstance(self.local_store, SqliteConversationStore) and settings.local_store_idle_seconds:
+            self._prune_task = asyncio.get_running_loop().create_task(self._prune_local_store())
         # Only try to initialize Appwrite if API key looks valid
-        if (settings.appwrite_api_key != "demo_api_key" and 
-            settings.appwrite_project_id != "demo_project"):
+        if not self.configured:
+            logger.info("Using demo/mock mode for Appwrite (no real API keys configured)")
+            return
+        await appwrite_executor.run(self._configure)
+        if warmup and not self.use_mock:
             try:
-                # Initialize Appwrite client
-                self.client = Client()
-                self.client.set_endpoint(settings.appwrite_endpoint)
-                self.client.set_project(settings.appwrite_project_id)
-                self.client.set_key(settings.appwrite_api_key)
-                
-                # Initialize database service
-                self.databases = Databases(self.client)
-                self.use_mock = False
-                logger.info("Appwrite client initialized successfully")
+                await self.probe()
             except Exception as e:
-                logger.warning(f"Could not initialize Appwrite client: {str(e)}. Using mock mode.")
-                self.use_mock = True
-        else:
-            logger.info("Using demo/mock mode for Appwrite (no real API keys configured)")
+                # Not a health signal: the first real call will open the connection instead
+                logger.warning(f"Appwrite warm-up call failed: {str(e)}")
+    
+    async def probe(self, timeout: Optional[float] = None):
+        """One cheap Appwrite read (a single conversation) that raises if the API is unreachable"""
+        from appwrite.query import Query
+        await appwrite_executor.run(
+            self.databases.list_documents,
+            timeout=timeout or settings.appwrite_timeout_seconds,
+            database_id=settings.appwrite_database_id,
+            collection_id=settings.appwrite_conversations_collection_id,
+            queries=[Query.limit(1)]
+        )
+    
+    def _configure(self):
+        """Import the SDK and create the pooled client (blocking)"""
+        try:
+            from appwrite.services.databases import Databases
+            from app.http_pool import HttpPool, PooledClient
+            
+            # Initialize Appwrite client; its calls share a pool of keep-alive connections
+            self.http_pool = HttpPool(
+                "appwrite",
+                pool_size=settings.appwrite_http_pool_size or settings.appwrite_pool_size,
+                read_retries=settings.appwrite_read_retries,
+                backoff_seconds=settings.appwrite_retry_backoff_seconds,
+                timeout=settings.appwrite_timeout_seconds
+            )
+            self.client = PooledClient(self.http_pool)
+            self.client.set_endpoint(settings.appwrite_endpoint)
+            self.client.set_project(settings.appwrite_project_id)
+            self.client.set_key(settings.appwrite_api_key)
+            
+            # Initialize database service
+            self.databases = Databases(self.client)
+            self.use_mock = False
+            logger.info("Appwrite client initialized successfully")
+        except Exception as e:
+            logger.warning(f"Could not initialize Appwrite client: {str(e)}. Using mock mode.")
+            self.use_mock = True
+    
+    async def _call(self, func, **kwargs):
+        """Run a blocking Appwrite SDK call in the worker pool with a per-call timeout"""
+        operation = getattr(func, "__name__", "call")
+        start = time.perf_counter()
+        try:
+            result = await appwrite_executor.run(
+                func,
+                timeout=settings.appwrite_timeout_seconds,
+                **kwargs
+            )
+        except AppwriteException as e:
+            # Client errors such as 404/409 still prove Appwrite is reachable
+            if e.code and 400 <= e.code < 500 and e.code != 429:
+                self.breaker.record_success()
+            else:
+                self._record_failure(operation)
+            raise
+        except Exception:
+            self._record_failure(operation)
+            raise
+        finally:
+            UPSTREAM_CALL_SECONDS.labels("appwrite", operation).observe(time.perf_counter() - start)
+        self.breaker.record_success()
+        return _to_plain(result)
+    
+    def _record_failure(self, operation: str):
+        # Request-path callers fall back to local storage on these errors
+        UPSTREAM_ERRORS.labels("appwrite", operation).inc()
+        FALLBACKS.labels("appwrite").inc()
+        self.breaker.record_failure()
+    
+    def _use_local(self, probe: bool = True) -> bool:
+        """Serve from the local store in demo mode or while the Appwrite breaker is open.
         
+        Callers that only queue a write pass probe=False: they leave the
+        half-open probe slot to the flush that actually calls Appwrite.
+        """
+        if self.use_mock:
+            return True
+        if self.breaker.allow_request() if probe else not self.breaker.rejecting():
+            return False
+        FALLBACKS.labels("appwrite").inc()
+        return True
+    
+    async def _write_local(self, messages: List[Dict[str, Any]], updates: Dict[str, Dict[str, Any]],
+                           replay: bool = True):
+        """Keep writes in the local store; outside demo mode they are replayed to Appwrite once it recovers"""
+        # Journaled first, so a write the local store could not take still reaches Appwrite later
+        if replay and not self.use_mock:
+            self._unsynced_messages.extend(messages)
+            for session_id, fields in updates.items():
+                self._unsynced_updates.setdefault(session_id, {}).update(fields)
+        for message in messages:
+            await self._local("add_message", message)
+        for session_id, fields in updates.items():
+            await self._local("update_conversation", session_id, fields)
+    
+    async def _prune_local_store(self, interval: float = 60.0):
+        """Drop idle sessions and version counters from the shared SQLite store, off the request path"""
+        while True:
+            await asyncio.sleep(interval)
+            await self._local("prune", settings.local_store_idle_seconds)
+    
+    async def _local(self, operation: str, *args, default: Any = None) -> Any:
+        """Call the local store, returning `default` if it fails.
+        
+        The SQLite store is called from a worker thread, since a write may wait
+        up to its busy timeout for another worker's lock. When it gives up the
+        turn carries on without local storage rather than failing.
+        """
+        method = getattr(self.local_store, operation)
+        try:
+            if isinstance(self.local_store, SqliteConversationStore):
+                return await sqlite_executor.run(method, *args)
+            return method(*args)
+        except sqlite3.Error as e:
+            logger.error(f"Local store {operation} failed: {str(e)}")
+            LOCAL_STORE_ERRORS.labels(operation).inc()
+            return default
+    
+    def _on_breaker_change(self, name: str, old_state: str, new_state: str):
+        if new_state != CircuitBreaker.CLOSED or not (self._unsynced_messages or self._unsynced_updates):
+            return
+        if self._reconcile_task is None or self._reconcile_task.done():
+            try:
+                self._reconcile_task = asyncio.get_running_loop().create_task(self.reconcile())
+            except RuntimeError:
+                pass  # No event loop in this thread; the next close replays instead
+    
+    async def reconcile(self):
+        """Replay writes kept in the local store while Appwrite was unavailable"""
+        messages, self._unsynced_messages = self._unsynced_messages, []
+        updates, self._unsynced_updates = self._unsynced_updates, {}
+        if not messages and not updates:
+            return
+        # Bump each session to its newest replayed message, unless a later update says otherwise
+        for message in messages:
+            updates[message["session_id"]] = {"updated_at": message["timestamp"], **updates.get(message["session_id"], {})}
+        logger.info(f"Replaying {len(messages)} messages and {len(updates)} conversation updates to Appwrite")
+        try:
+            await self._flush_writes(messages, updates)
+        except PartialFlush as e:
+            logger.error(f"Replay to Appwrite incomplete, will retry {len(e.messages)} messages: {str(e)}")
+            self._unsynced_messages = e.messages + self._unsynced_messages
+            for session_id, fields in e.updates.items():
+                self._unsynced_updates[session_id] = {**fields, **self._unsynced_updates.get(session_id, {})}
+        except Exception as e:
+            logger.error(f"Replay to Appwrite failed, will retry: {str(e)}")
+            self._unsynced_messages = messages + self._unsynced_messages
+            for session_id, fields in updates.items():
+                self._unsynced_updates[session_id] = {**fields, **self._unsynced_updates.get(session_id, {})}
+    
+    def _cache_usable(self) -> bool:
+        # While degraded, writes land in the local store, so the cached Appwrite view would go stale
+        return not self.use_mock and self.breaker.state == CircuitBreaker.CLOSED
+
     async def create_conversation(self, session_id: str) -> Dict[str, Any]:
         """Create a new conversation in Appwrite or mock storage"""
-        if self.use_mock:
-            if session_id not in self.mock_data:
-                self.mock_data[session_id] = {
-                    "conversation": {
-                        "session_id": session_id,
-                        "created_at": datetime.now().isoformat(),
-                        "updated_at": datetime.now().isoformat()
-                    },
-                    "messages": []
-                }
-            return self.mock_data[session_id]["conversation"]
+        cached = self.session_cache.get_conversation(session_id) if self._cache_usable() else None
+        if cached is not None:
+            return cached
+        
+        if self._use_local():
+            return await self._local("create_conversation", session_id, default=_new_conversation(session_id))
         
+        version = await self.session_cache.load_version(session_id)
         try:
-            return self.databases.create_document(
+            conversation = await self._call(
+                self.databases.create_document,
                 database_id=settings.appwrite_database_id,
                 collection_id=settings.appwrite_conversations_collection_id,
                 document_id=session_id,
@@ -59,48 +314,57 @@ class AppwriteService:
                     "updated_at": datetime.now().isoformat()
                 }
             )
+            # A brand-new conversation has no history to fetch
+            self.session_cache.put_conversation(session_id, conversation, version)
+            self.session_cache.put_messages(session_id, [], complete=True, version=version)
+            return conversation
         except AppwriteException as e:
             if e.code == 409:  # Document already exists
                 return await self.get_conversation(session_id)
             logger.error(f"Appwrite error creating conversation: {str(e)}")
-            # Fallback to mock
-            self.use_mock = True
-            return await self.create_conversation(session_id)
+            # Fallback to local storage
+            return await self._local("create_conversation", session_id, default=_new_conversation(session_id))
         except Exception as e:
             logger.error(f"Error creating conversation: {str(e)}")
-            # Fallback to mock
-            self.use_mock = True
-            return await self.create_conversation(session_id)
+            # Fallback to local storage
+            return await self._local("create_conversation", session_id, default=_new_conversation(session_id))
     
     async def get_conversation(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get conversation by session ID"""
-        if self.use_mock:
-            if session_id in self.mock_data:
-                return self.mock_data[session_id]["conversation"]
-            return None
+        cached = self.session_cache.get_conversation(session_id) if self._cache_usable() else None
+        if cached is not None:
+            return cached
         
+        if self._use_local():
+            return await self._local("get_conversation", session_id)
+        
+        version = await self.session_cache.load_version(session_id)
         try:
-            return self.databases.get_document(
+            conversation = await self._call(
+                self.databases.get_document,
                 database_id=settings.appwrite_database_id,
                 collection_id=settings.appwrite_conversations_collection_id,
                 document_id=session_id
             )
+            if self.write_behind is not None:
+                conversation.update(self.write_behind.pending_conversation_fields(session_id))
+            self.session_cache.put_conversation(session_id, conversation, version)
+            return conversation
         except AppwriteException as e:
             if e.code == 404:
                 return None
             logger.error(f"Appwrite error getting conversation: {str(e)}")
-            # Fallback to mock
-            self.use_mock = True
-            return await self.get_conversation(session_id)
+            # Fallback to local storage
+            return await self._local("get_conversation", session_id)
         except Exception as e:
             logger.error(f"Error getting conversation: {str(e)}")
-            # Fallback to mock
-            self.use_mock = True
-            return await self.get_conversation(session_id)
+            # Fallback to local storage
+            return await self._local("get_conversation", session_id)
     
-    async def add_message(self, session_id: str, role: str, content: str) -> Dict[str, Any]:
-        """Add a message to a conversation"""
-        message_id = str(uuid.uuid4())
+    async def add_message(self, session_id: str, role: str, content: str,
+                          message_id: Optional[str] = None) -> Dict[str, Any]:
+        """Add a message to a conversation; `message_id` lets the caller know the ID before it is stored"""
+        message_id = message_id or str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
         
         message_data = {
@@ -111,16 +375,19 @@ class AppwriteService:
             "timestamp": timestamp
         }
         
-        if self.use_mock:
-            if session_id not in self.mock_data:
-                await self.create_conversation(session_id)
-            self.mock_data[session_id]["messages"].append(message_data)
-            await self.update_conversation_timestamp(session_id)
+        if self._use_local(probe=self.write_behind is None):
+            await self._write_local([message_data], {})
+            return message_data
+        
+        if self.write_behind is not None:
+            await self.write_behind.add_message(session_id, message_data, timestamp)
+            self._cache_message(session_id, message_data)
             return message_data
         
         try:
             # Create message document
-            message = self.databases.create_document(
+            message = await self._call(
+                self.databases.create_document,
                 database_id=settings.appwrite_database_id,
                 collection_id=settings.appwrite_messages_collection_id,
                 document_id=message_id,
@@ -130,66 +397,529 @@ class AppwriteService:
             # Update conversation timestamp
             await self.update_conversation_timestamp(session_id)
             
+            self._cache_message(session_id, message_data)
+            await self.session_cache.record_write(session_id)
             return message
         except Exception as e:
             logger.error(f"Error adding message: {str(e)}")
-            # Fallback to mock
-            self.use_mock = True
-            return await self.add_message(session_id, role, content)
+            # Fallback to local storage
+            await self._write_local([message_data], {})
+            return message_data
     
-    async def get_conversation_messages(self, session_id: str) -> List[Dict[str, Any]]:
-        """Get all messages for a conversation"""
-        if self.use_mock:
-            if session_id in self.mock_data:
-                return self.mock_data[session_id]["messages"]
-            return []
+    async def get_conversation_messages(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get the most recent `limit` messages (all when None) in chronological order"""
+        cached = self.session_cache.get_messages(session_id, limit) if self._cache_usable() else None
+        if cached is not None:
+            return cached
+        
+        if self._use_local():
+            return await self._local("get_messages", session_id, limit, default=[])
         
+        version = await self.session_cache.load_version(session_id)
         try:
             from appwrite.query import Query
             
-            result = self.databases.list_documents(
+            queries = [
+                Query.equal("session_id", session_id),
+                Query.order_desc("timestamp")
+            ]
+            if limit:
+                # Only the newest window is read, however long the conversation is
+                queries.append(Query.limit(limit))
+            
+            result = await self._call(
+                self.databases.list_documents,
                 database_id=settings.appwrite_database_id,
                 collection_id=settings.appwrite_messages_collection_id,
-                queries=[
-                    Query.equal("session_id", session_id),
-                    Query.order_desc("timestamp")
-                ]
+                queries=queries
             )
             
             # Reverse to get chronological order
             messages = result['documents']
             messages.reverse()
-            return messages
+            # Fewer documents than requested means this is the whole conversation
+            complete = not limit or len(result['documents']) < limit
+            messages = self._merge_pending(session_id, messages)
+            self.session_cache.put_messages(session_id, messages, complete, version)
+            return messages[-limit:] if limit else messages
         except Exception as e:
             logger.error(f"Error getting messages: {str(e)}")
-            # Fallback to mock
-            self.use_mock = True
-            return await self.get_conversation_messages(session_id)
+            # Fallback to local storage
+            return await self._local("get_messages", session_id, limit, default=[])
+    
+    async def get_messages_page(self, session_id: str, limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get up to `limit` messages after the `cursor` message ID in chronological order.
+        
+        Returns the messages and a `next_cursor` to pass back for the following
+        page, or None once the end of the conversation is reached. Raises
+        ValueError for a cursor that does not belong to the conversation.
+        """
+        if self._use_local():
+            return await self._local("get_messages_page", session_id, limit, cursor,
+                                     default={"messages": [], "next_cursor": None})
+        
+        pending = self.write_behind.pending_messages(session_id) if self.write_behind else []
+        pending_ids = [m["id"] for m in pending]
+        if cursor in pending_ids:
+            # Everything stored was already returned; continue inside the queued writes
+            page = pending[pending_ids.index(cursor) + 1:][:limit]
+            has_more = pending_ids.index(cursor) + 1 + limit < len(pending)
+            return {"messages": page, "next_cursor": page[-1]["id"] if has_more else None}
+        
+        try:
+            from appwrite.query import Query
+            
+            # One extra document tells us whether another page exists
+            queries = [
+                Query.equal("session_id", session_id),
+                Query.order_asc("timestamp"),
+                Query.limit(limit + 1)
+            ]
+            if cursor:
+                queries.append(Query.cursor_after(cursor))
+            
+            result = await self._call(
+                self.databases.list_documents,
+                database_id=settings.appwrite_database_id,
+                collection_id=settings.appwrite_messages_collection_id,
+                queries=queries
+            )
+        except AppwriteException as e:
+            if cursor and e.code in (400, 404):
+                raise ValueError(f"Unknown cursor: {cursor}")
+            logger.error(f"Appwrite error getting messages page: {str(e)}")
+            # Fallback to local storage
+            return await self._local("get_messages_page", session_id, limit, cursor,
+                                     default={"messages": [], "next_cursor": None})
+        except Exception as e:
+            logger.error(f"Error getting messages page: {str(e)}")
+            # Fallback to local storage
+            return await self._local("get_messages_page", session_id, limit, cursor,
+                                     default={"messages": [], "next_cursor": None})
+        
+        messages = result['documents']
+        if len(messages) > limit:
+            return {"messages": messages[:limit], "next_cursor": messages[limit - 1]["id"]}
+        
+        # Last stored page: top it up with queued writes that are not readable yet
+        stored_ids = {m.get("id") for m in messages}
+        unstored = [m for m in pending if m["id"] not in stored_ids]
+        page = messages + unstored[:limit - len(messages)]
+        has_more = len(messages) + len(unstored) > limit
+        return {"messages": page, "next_cursor": page[-1]["id"] if has_more else None}
+    
+    async def list_conversations(self, limit: int, cursor: Optional[str] = None,
+                                 updated_after: Optional[str] = None,
+                                 updated_before: Optional[str] = None) -> Dict[str, Any]:
+        """Get up to `limit` conversations after the `cursor` session ID, oldest first.
+        
+        Conversations are ordered by `created_at`, which never changes, so
+        paging stays stable while sessions are being updated; `updated_after`
+        (inclusive) and `updated_before` (exclusive) filter on `updated_at`.
+        Raises ValueError for an unknown cursor.
+        """
+        if self._use_local():
+            return await self._local("list_conversations", limit, cursor, updated_after, updated_before,
+                                     default={"conversations": [], "next_cursor": None})
+        
+        try:
+            from appwrite.query import Query
+            
+            # One extra document tells us whether another page exists
+            queries = [Query.order_asc("created_at"), Query.limit(limit + 1)]
+            if updated_after:
+                queries.append(Query.greater_than_equal("updated_at", updated_after))
+            if updated_before:
+                queries.append(Query.less_than("updated_at", updated_before))
+            if cursor:
+                queries.append(Query.cursor_after(cursor))
+            
+            result = await self._call(
+                self.databases.list_documents,
+                database_id=settings.appwrite_database_id,
+                collection_id=settings.appwrite_conversations_collection_id,
+                queries=queries
+            )
+        except AppwriteException as e:
+            if cursor and e.code in (400, 404):
+                raise ValueError(f"Unknown cursor: {cursor}")
+            logger.error(f"Appwrite error listing conversations: {str(e)}")
+            # Fallback to local storage
+            return await self._local("list_conversations", limit, cursor, updated_after, updated_before,
+                                     default={"conversations": [], "next_cursor": None})
+        except Exception as e:
+            logger.error(f"Error listing conversations: {str(e)}")
+            # Fallback to local storage
+            return await self._local("list_conversations", limit, cursor, updated_after, updated_before,
+                                     default={"conversations": [], "next_cursor": None})
+        
+        conversations = result['documents'][:limit]
+        if self.write_behind is not None:
+            for conversation in conversations:
+                conversation.update(self.write_behind.pending_conversation_fields(conversation["$id"]))
+        has_more = len(result['documents']) > limit
+        return {
+            "conversations": conversations,
+            "next_cursor": conversations[-1]["$id"] if has_more else None
+        }
+    
+    async def export_conversations(self, updated_after: Optional[str] = None,
+                                   updated_before: Optional[str] = None,
+                                   page_size: int = 100) -> AsyncIterator[Dict[str, Any]]:
+        """Yield matching conversations, each followed by its messages, one page at a time.
+        
+        Records are dicts with a `type` of "conversation" or "message".
+        Messages moved to archives by the retention job come first. At most
+        one page of conversations, one page of messages and one session's
+        archived messages are held at once, however large the export is.
+        """
+        cursor = None
+        while True:
+            page = await self.list_conversations(page_size, cursor, updated_after, updated_before)
+            for conversation in page["conversations"]:
+                session_id = conversation["session_id"]
+                yield {"type": "conversation", **conversation}
+                archived = await self.get_archived_messages(session_id, page_size) if not self._use_local() else []
+                for message in archived:
+                    yield {"type": "message", **message}
+                # A batch interrupted between archiving and deleting is in both places
+                archived_ids = {message["id"] for message in archived}
+                message_cursor = None
+                while True:
+                    messages = await self.get_messages_page(session_id, page_size, message_cursor)
+                    for message in messages["messages"]:
+                        if message.get("id") in archived_ids:
+                            continue
+                        yield {"type": "message", **message}
+                    message_cursor = messages["next_cursor"]
+                    if message_cursor is None:
+                        break
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return
     
     async def update_conversation_timestamp(self, session_id: str):
         """Update the last updated timestamp of a conversation"""
-        if self.use_mock:
-            if session_id in self.mock_data:
-                self.mock_data[session_id]["conversation"]["updated_at"] = datetime.now().isoformat()
+        if self._use_local():
+            await self._write_local([], {session_id: {"updated_at": datetime.now().isoformat()}})
             return
         
         try:
-            self.databases.update_document(
+            updated_at = datetime.now().isoformat()
+            await self._call(
+                self.databases.update_document,
                 database_id=settings.appwrite_database_id,
                 collection_id=settings.appwrite_conversations_collection_id,
                 document_id=session_id,
                 data={
-                    "updated_at": datetime.now().isoformat()
+                    "updated_at": updated_at
                 }
             )
-        except AppwriteException:
+            self.session_cache.touch(session_id, updated_at)
+        except AppwriteException as e:
+            if e.code != 404:
+                logger.error(f"Appwrite error updating conversation timestamp: {str(e)}")
+                return
             # If conversation doesn't exist, create it
             await self.create_conversation(session_id)
         except Exception as e:
             logger.error(f"Error updating conversation timestamp: {str(e)}")
-            # Fallback to mock
-            self.use_mock = True
-            await self.update_conversation_timestamp(session_id)
+            # Fallback to local storage
+            await self._write_local([], {session_id: {"updated_at": datetime.now().isoformat()}})
+
+    async def update_conversation_summary(self, session_id: str, summary: str, summarized_through: Optional[str]):
+        """Store the rolling summary of turns that no longer fit in the prompt"""
+        fields = {"summary": summary, "summarized_through": summarized_through}
+        if self._use_local(probe=self.write_behind is None):
+            await self._write_local([], {session_id: fields})
+            return
+        
+        self.session_cache.update_conversation(session_id, fields)
+        if self.write_behind is not None:
+            self.write_behind.update_conversation(session_id, fields)
+            return
+        
+        try:
+            await self._write_conversation_fields(session_id, fields)
+            await self.session_cache.record_write(session_id)
+        except Exception as e:
+            logger.error(f"Error updating conversation summary: {str(e)}")
+            # Fallback to local storage
+            await self._write_local([], {session_id: fields})
+
+    # Maintenance primitives for the retention job. They talk to Appwrite only
+    # (the local store has its own eviction) and raise instead of falling back.
+    
+    async def list_conversations_created_after(self, created_after: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        """Up to `limit` conversations created after `created_after` (from the start when None), oldest first.
+        
+        Unlike a document cursor, a timestamp stays valid when the
+        conversation it came from has been deleted.
+        """
+        from appwrite.query import Query
+        
+        queries = [Query.order_asc("created_at"), Query.limit(limit)]
+        if created_after:
+            queries.append(Query.greater_than("created_at", created_after))
+        result = await self._call(
+            self.databases.list_documents,
+            database_id=settings.appwrite_database_id,
+            collection_id=settings.appwrite_conversations_collection_id,
+            queries=queries
+        )
+        return result['documents']
+    
+    async def list_session_messages(self, session_id: str, limit: int, before: Optional[str] = None,
+                                    newest_first: bool = False) -> List[Dict[str, Any]]:
+        """Up to `limit` stored messages of a session, optionally only those with a timestamp before `before`"""
+        from appwrite.query import Query
+        
+        queries = [
+            Query.equal("session_id", session_id),
+            Query.order_desc("timestamp") if newest_first else Query.order_asc("timestamp"),
+            Query.limit(limit)
+        ]
+        if before:
+            queries.append(Query.less_than("timestamp", before))
+        result = await self._call(
+            self.databases.list_documents,
+            database_id=settings.appwrite_database_id,
+            collection_id=settings.appwrite_messages_collection_id,
+            queries=queries
+        )
+        return result['documents']
+    
+    async def get_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """A stored message, or None once it was deleted"""
+        try:
+            return await self._call(
+                self.databases.get_document,
+                database_id=settings.appwrite_database_id,
+                collection_id=settings.appwrite_messages_collection_id,
+                document_id=message_id
+            )
+        except AppwriteException as e:
+            if e.code == 404:
+                return None
+            raise
+    
+    async def create_archive(self, session_id: str, messages: List[Dict[str, Any]]) -> str:
+        """Store a batch of a session's messages as one compressed archive document.
+        
+        The ID is derived from the session and the batch's first message, so
+        archiving the same batch again (after a crash, or from another
+        worker) finds the existing document instead of duplicating it.
+        """
+        archive_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{session_id}/{messages[0]['id']}"))
+        try:
+            await self._call(
+                self.databases.create_document,
+                database_id=settings.appwrite_database_id,
+                collection_id=settings.appwrite_archives_collection_id,
+                document_id=archive_id,
+                data={
+                    "session_id": session_id,
+                    "first_timestamp": messages[0]["timestamp"],
+                    "last_timestamp": messages[-1]["timestamp"],
+                    "message_count": len(messages),
+                    "data": pack_messages(messages)
+                }
+            )
+        except AppwriteException as e:
+            if e.code != 409:
+                raise
+        return archive_id
+    
+    async def list_archives(self, session_id: str, limit: int, cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A session's archive documents, oldest first"""
+        from appwrite.query import Query
+        
+        queries = [
+            Query.equal("session_id", session_id),
+            Query.order_asc("first_timestamp"),
+            Query.limit(limit)
+        ]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        result = await self._call(
+            self.databases.list_documents,
+            database_id=settings.appwrite_database_id,
+            collection_id=settings.appwrite_archives_collection_id,
+            queries=queries
+        )
+        return result['documents']
+    
+    async def get_archived_messages(self, session_id: str, page_size: int = 100) -> List[Dict[str, Any]]:
+        """Every archived message of a session in chronological order, each once"""
+        messages: Dict[str, Dict[str, Any]] = {}
+        cursor = None
+        while True:
+            archives = await self.list_archives(session_id, page_size, cursor)
+            for archive in archives:
+                for message in unpack_messages(archive["data"]):
+                    messages.setdefault(message["id"], message)
+            if len(archives) < page_size:
+                break
+            cursor = archives[-1]["$id"]
+        return sorted(messages.values(), key=lambda m: m["timestamp"])
+    
+    async def delete_messages(self, message_ids: List[str]):
+        """Delete message documents in one bulk request"""
+        from appwrite.query import Query
+        
+        await self._call(
+            self.databases.delete_documents,
+            database_id=settings.appwrite_database_id,
+            collection_id=settings.appwrite_messages_collection_id,
+            queries=[Query.equal("$id", message_ids), Query.limit(len(message_ids))]
+        )
+    
+    async def delete_archive(self, archive_id: str):
+        await self._delete_document(settings.appwrite_archives_collection_id, archive_id)
+    
+    async def delete_conversation(self, session_id: str):
+        """Delete the conversation document; its messages and archives are deleted by the caller"""
+        await self._delete_document(settings.appwrite_conversations_collection_id, session_id)
+        self.session_cache.invalidate(session_id)
+        await self.session_cache.record_write(session_id)
+    
+    async def _delete_document(self, collection_id: str, document_id: str):
+        try:
+            await self._call(
+                self.databases.delete_document,
+                database_id=settings.appwrite_database_id,
+                collection_id=collection_id,
+                document_id=document_id
+            )
+        except AppwriteException as e:
+            if e.code != 404:  # Already deleted
+                raise
+
+    def _cache_message(self, session_id: str, message: Dict[str, Any]):
+        """Write a new message through to the session cache"""
+        self.session_cache.append_message(session_id, message)
+        self.session_cache.touch(session_id, message["timestamp"])
+    
+    def _merge_pending(self, session_id: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Append queued writes that Appwrite does not return yet (read-your-writes)"""
+        if self.write_behind is None:
+            return messages
+        pending = self.write_behind.pending_messages(session_id)
+        if not pending:
+            return messages
+        stored_ids = {m.get("id") for m in messages}
+        return messages + [m for m in pending if m["id"] not in stored_ids]
+    
+    async def _flush_writes(self, messages: List[Dict[str, Any]], conversation_updates: Dict[str, Dict[str, Any]]):
+        """Persist a write-behind batch: message documents first, then one conversation update per session"""
+        if self._use_local():
+            # Appwrite is unavailable, so keep these with the rest of the fallback data
+            await self._write_local(messages, conversation_updates)
+            return
+        
+        failed = await self._create_message_documents(messages) if messages else []
+        update_items = list(conversation_updates.items())
+        results = await asyncio.gather(*(
+            self._write_conversation_fields(session_id, fields)
+            for session_id, fields in update_items
+        ), return_exceptions=True)
+        failed_updates = [(item, e) for item, e in zip(update_items, results) if isinstance(e, Exception)]
+        
+        # Appwrite will never take these as they are, so retrying would only hold up the queue
+        rejected = [(message, e) for message, e in failed if _rejected(e)]
+        rejected_updates = [(item, e) for item, e in failed_updates if _rejected(e)]
+        if rejected or rejected_updates:
+            error = (rejected or rejected_updates)[0][1]
+            logger.error(f"Appwrite rejected {len(rejected)} messages and {len(rejected_updates)} "
+                         f"conversation updates, keeping them in the local store: {str(error)}")
+            await self._dead_letter([m for m, _ in rejected], dict(item for item, _ in rejected_updates), "rejected")
+        
+        # Other workers' caches of these sessions are stale now that the batch is readable
+        for session_id in set(conversation_updates).union(m["session_id"] for m in messages):
+            await self.session_cache.record_write(session_id)
+        
+        retry = [(message, e) for message, e in failed if not _rejected(e)]
+        retry_updates = [(item, e) for item, e in failed_updates if not _rejected(e)]
+        if retry or retry_updates:
+            raise PartialFlush(
+                [m for m, _ in retry], dict(item for item, _ in retry_updates), (retry or retry_updates)[0][1]
+            )
+    
+    async def _create_message_documents(self, messages: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Exception]]:
+        """Create message documents in one bulk request.
+        
+        If the bulk request fails, each message is written on its own so one
+        bad document cannot fail the rest. Returns the messages that could not
+        be written, with their errors.
+        """
+        try:
+            await self._call(
+                self.databases.create_documents,
+                database_id=settings.appwrite_database_id,
+                collection_id=settings.appwrite_messages_collection_id,
+                documents=[dict(message, **{"$id": message["id"]}) for message in messages]
+            )
+            return []
+        except Exception as e:
+            logger.warning(f"Bulk message write failed, retrying individually: {str(e)}")
+        
+        async def create_one(message: Dict[str, Any]):
+            try:
+                await self._call(
+                    self.databases.create_document,
+                    database_id=settings.appwrite_database_id,
+                    collection_id=settings.appwrite_messages_collection_id,
+                    document_id=message["id"],
+                    data=message
+                )
+            except AppwriteException as e:
+                if e.code != 409:  # Already written by an earlier attempt
+                    raise
+        
+        results = await asyncio.gather(*(create_one(message) for message in messages), return_exceptions=True)
+        return [(message, e) for message, e in zip(messages, results) if isinstance(e, Exception)]
+    
+    async def _dead_letter(self, messages: List[Dict[str, Any]], updates: Dict[str, Dict[str, Any]], reason: str):
+        """Keep writes Appwrite did not take in the local store, so the conversation is not lost"""
+        # Rejected writes would only be rejected again; the others are replayed after recovery
+        await self._write_local(messages, updates, replay=reason != "rejected")
+        WRITE_BEHIND_DEAD_LETTERS.labels(reason).inc(len(messages))
+    
+    async def _write_conversation_fields(self, session_id: str, fields: Dict[str, Any]):
+        try:
+            await self._call(
+                self.databases.update_document,
+                database_id=settings.appwrite_database_id,
+                collection_id=settings.appwrite_conversations_collection_id,
+                document_id=session_id,
+                data=fields
+            )
+        except AppwriteException as e:
+            if e.code != 404:
+                raise
+            # If conversation doesn't exist, create it and apply the update
+            await self.create_conversation(session_id)
+            await self._call(
+                self.databases.update_document,
+                database_id=settings.appwrite_database_id,
+                collection_id=settings.appwrite_conversations_collection_id,
+                document_id=session_id,
+                data=fields
+            )
+    
+    async def close(self):
+        """Flush queued writes; called on application shutdown"""
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            try:
+                await self._prune_task
+            except asyncio.CancelledError:
+                pass
+            self._prune_task = None
+        if self._reconcile_task is not None:
+            await self._reconcile_task
+        if self.write_behind is not None:
+            await self.write_behind.close()
 
 # Global instance
 appwrite_service = AppwriteService()
\ No newline at end of file
@@ -0,0 +1,130 @@
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker shared by the upstream services.
+
+    While closed, calls go through and outcomes are tracked over a sliding
+    window. Once at least `minimum_calls` have been seen and the failure rate
+    reaches `failure_rate`, the breaker opens and callers should use their
+    fallback. After a backoff it lets a single probe through (half-open): a
+    success closes it again, a failure re-opens it with the backoff doubled,
+    up to `max_backoff`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_rate: float = 0.5, minimum_calls: int = 5,
+                 window_seconds: float = 30.0, backoff_seconds: float = 1.0,
+                 max_backoff_seconds: float = 60.0, probe_timeout_seconds: float = 30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.probe_timeout_seconds = probe_timeout_seconds
+        self.state = self.CLOSED
+        self.successes = 0
+        self.failures = 0
+        self.rejections = 0
+        self.transitions: Dict[str, int] = {self.CLOSED: 0, self.OPEN: 0, self.HALF_OPEN: 0}
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._window_failures = 0
+        self._current_backoff = backoff_seconds
+        self._open_until = 0.0
+        self._probe_started: Optional[float] = None
+        self._listeners: List[Callable[[str, str, str], Any]] = []
+
+    def add_listener(self, listener: Callable[[str, str, str], Any]):
+        """Register a callback invoked as listener(name, old_state, new_state)"""
+        self._listeners.append(listener)
+
+    def allow_request(self) -> bool:
+        """Return True if the caller may try the upstream service now"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now < self._open_until:
+                self.rejections += 1
+                return False
+            self._transition(self.HALF_OPEN)
+        # Half-open: one probe at a time; a probe that never reported back is replaced
+        if self._probe_started is not None and now - self._probe_started < self.probe_timeout_seconds:
+            self.rejections += 1
+            return False
+        self._probe_started = now
+        return True
+
+    def rejecting(self) -> bool:
+        """True while open and still backing off; unlike allow_request() this does not take the probe slot"""
+        return self.state == self.OPEN and time.monotonic() < self._open_until
+
+    def record_success(self):
+        self.successes += 1
+        if self.state == self.HALF_OPEN:
+            self._current_backoff = self.backoff_seconds
+            self._transition(self.CLOSED)
+            return
+        self._record(False)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            # The probe failed: back off for longer before the next one
+            self._current_backoff = min(self._current_backoff * 2, self.max_backoff_seconds)
+            self._open()
+            return
+        if self.state == self.OPEN:
+            return
+        self._record(True)
+        calls = len(self._outcomes)
+        if calls >= self.minimum_calls and self._window_failures / calls >= self.failure_rate:
+            self._open()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejections": self.rejections,
+            "opened": self.transitions[self.OPEN],
+            "backoff_seconds": self._current_backoff,
+        }
+
+    def _record(self, failed: bool):
+        now = time.monotonic()
+        self._outcomes.append((now, failed))
+        self._window_failures += failed
+        horizon = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._window_failures -= self._outcomes.popleft()[1]
+
+    def _open(self):
+        self._open_until = time.monotonic() + self._current_backoff
+        self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        old_state = self.state
+        self.state = state
+        self.transitions[state] += 1
+        self._probe_started = None
+        if state != self.HALF_OPEN:
+            self._outcomes.clear()
+            self._window_failures = 0
+        if state == self.OPEN:
+            logger.warning(f"Circuit breaker '{self.name}' opened for {self._current_backoff:.1f}s (was {old_state})")
+        else:
+            logger.info(f"Circuit breaker '{self.name}' {old_state} -> {state}")
+        for listener in self._listeners:
+            try:
+                listener(self.name, old_state, state)
+            except Exception as e:
+                logger.error(f"Circuit breaker listener failed: {str(e)}")
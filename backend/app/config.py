@@ -4,6 +4,7 @@ from typing import Optional
 class Settings(BaseSettings):
     # Gemini API Configuration
     gemini_api_key: str = "demo_key_for_testing"
+    gemini_api_endpoint: Optional[str] = None  # e.g. a proxy or local test server; uses the REST transport
     
     # Appwrite Configuration
     appwrite_project_id: str = "demo_project"
@@ -12,6 +13,118 @@ class Settings(BaseSettings):
     appwrite_database_id: str = "main"
     appwrite_conversations_collection_id: str = "conversations"
     appwrite_messages_collection_id: str = "messages"
+    appwrite_archives_collection_id: str = "archives"  # Compressed batches of old messages (retention job)
+    
+    # Concurrency Configuration
+    gemini_pool_size: int = 16  # Worker threads for blocking Gemini SDK calls
+    appwrite_pool_size: int = 32  # Worker threads for blocking Appwrite SDK calls
+    retrieval_pool_size: int = 4  # Worker threads for knowledge-base searches
+    gemini_timeout_seconds: float = 30.0
+    appwrite_timeout_seconds: float = 10.0
+    appwrite_http_pool_size: Optional[int] = None  # Keep-alive connections to Appwrite; defaults to appwrite_pool_size
+    appwrite_read_retries: int = 2  # Retries of idempotent Appwrite reads on connection errors and 429/5xx
+    appwrite_retry_backoff_seconds: float = 0.1
+    
+    # Deadline and Hedging Configuration
+    chat_deadline_seconds: float = 60.0  # Budget per chat turn; clients may ask for less with X-Request-Timeout; 0 disables
+    gemini_hedge_enabled: bool = False  # Send a backup request when generate_content is slower than usual
+    gemini_hedge_quantile: float = 0.95  # Hedge calls slower than this quantile of recent latencies
+    gemini_hedge_budget_ratio: float = 0.05  # Hedges allowed per primary call
+    
+    # Prompt Prefix Configuration (the static start of every prompt)
+    prompt_preamble_path: Optional[str] = None  # Fixed policies or FAQ text sent after the system prompt on every turn
+    gemini_context_cache_enabled: bool = False  # Keep the prefix in Gemini cached content instead of resending it
+    gemini_context_cache_model: str = "gemini-1.5-flash-002"  # Cached content needs an explicit model version
+    gemini_context_cache_ttl_seconds: float = 3600.0
+    
+    # LLM Scheduler Configuration (admission control for Gemini calls)
+    llm_max_concurrency: int = 8  # Gemini calls running at once
+    llm_tokens_per_minute: int = 0  # Estimated token budget per minute; 0 disables rate limiting
+    llm_output_token_reserve: int = 256  # Tokens reserved per call for the response until usage is known
+    llm_max_queue: int = 100  # Calls waiting for a slot before new ones get 503
+    llm_max_queue_per_session: int = 2  # Calls one session may have waiting before it gets 429
+    llm_max_wait_seconds: float = 10.0  # Queued calls are rejected with 503 after this long
+    
+    # Batch Configuration (POST /api/chat/batch)
+    batch_max_items: int = 1000
+    batch_concurrency: int = 8  # Sessions processed at once per batch; Gemini calls still go through the scheduler
+    batch_admission_retries: int = 3  # Times an item waits out Retry-After before being reported busy
+    
+    # Export Configuration (GET /api/chat/export)
+    export_page_size: int = 100  # Documents read per Appwrite request and NDJSON lines per chunk
+    
+    # Idempotency Configuration (Idempotency-Key header on chat requests)
+    idempotency_max_keys: int = 10000  # Completed responses kept per worker for replay
+    idempotency_ttl_seconds: float = 86400.0
+    
+    # Circuit Breaker Configuration (shared by Gemini and Appwrite)
+    breaker_failure_rate: float = 0.5  # Open when this share of recent calls fails
+    breaker_minimum_calls: int = 5
+    breaker_window_seconds: float = 30.0
+    breaker_backoff_seconds: float = 1.0  # First open period; doubles after each failed probe
+    breaker_max_backoff_seconds: float = 60.0
+    
+    # Conversation Configuration
+    history_window: int = 10  # Most recent messages sent to the model verbatim
+    prompt_token_budget: int = 3000  # Estimated input tokens per Gemini call
+    summary_token_budget: int = 400  # Cap for the rolling summary of older turns
+    summary_fold_margin: int = 4  # Extra messages fetched so turns are summarized before leaving the window
+    
+    # Knowledge Base Configuration (retrieval is disabled when no folder is set)
+    knowledge_base_dir: Optional[str] = None  # Folder of .md/.txt support documents
+    knowledge_index_dir: Optional[str] = None  # Defaults to <knowledge_base_dir>/.index
+    embedding_dim: int = 256
+    retrieval_top_k: int = 3  # Passages added to each prompt
+    retrieval_min_score: float = 0.1  # Cosine similarity below which passages are ignored
+    
+    # Intent Fast Path Configuration (templated answers for trivial messages)
+    intents_enabled: bool = True
+    intents_path: Optional[str] = None  # JSON list of intents; replaces the built-in greeting/thanks/goodbye set
+    intent_min_confidence: float = 0.75  # Share of the message an intent must cover to be answered
+    
+    # Response Cache Configuration
+    response_cache_size: int = 1000  # Cached answers to first-turn questions; 0 disables
+    response_cache_ttl_seconds: float = 600.0
+    
+    # Session Cache Configuration
+    session_cache_size: int = 10000  # Sessions kept in memory per worker
+    session_cache_ttl_seconds: float = 300.0
+    session_cache_window: int = 20  # Recent messages cached per session
+    session_cache_version_check_seconds: float = 1.0  # How often a cached session is checked for other workers' writes (sqlite)
+    
+    # Local Store Configuration (demo mode and Appwrite fallback)
+    local_store_backend: str = "memory"  # "memory" (per worker) or "sqlite" (shared by all workers on the host)
+    local_store_path: str = "data/conversations.db"  # SQLite file for the sqlite backend
+    local_store_max_mb: int = 256
+    local_store_idle_seconds: float = 3600.0  # Evict (sqlite: prune) sessions idle for longer than this
+    local_store_spill_dir: Optional[str] = None  # Spill evicted sessions here instead of dropping them
+    local_store_pool_size: int = 4  # Worker threads for SQLite store calls, which may wait on other workers' locks
+    
+    # Persistence Configuration
+    appwrite_write_behind: bool = True  # Batch message writes off the request path
+    appwrite_flush_batch_size: int = 50
+    appwrite_flush_interval_seconds: float = 0.5
+    appwrite_flush_max_attempts: int = 5  # Then the write is kept in the local store instead
+    
+    # Retention Configuration
+    retention_enabled: bool = False  # Background job that archives old turns and deletes inactive sessions
+    retention_message_max_age_days: float = 30.0  # Archive messages older than this (0 to keep them)
+    retention_session_inactive_days: float = 365.0  # Delete sessions idle for longer than this (0 to keep them)
+    retention_keep_recent_messages: int = 40  # Never archive a session's newest messages
+    retention_batch_size: int = 100  # Messages per archive document
+    retention_sessions_per_run: int = 50
+    retention_interval_seconds: float = 60.0  # Pause between runs
+    retention_calls_per_second: float = 5.0  # Appwrite calls the job may make per second
+    retention_lease_seconds: float = 300.0  # One worker per host runs the job; another takes over after this without renewal
+    
+    # Startup Configuration
+    startup_warmup: bool = True  # Open upstream connections (and the prompt cache) before serving chat
+    startup_wait_seconds: float = 10.0  # How long a chat request waits for startup before a 503
+    ready_probe_interval_seconds: float = 15.0  # Background upstream checks reported by /api/ready
+    ready_probe_timeout_seconds: float = 5.0
+    
+    # Observability Configuration
+    metrics_enabled: bool = True  # Collect per-stage timings and upstream counters for /api/metrics
     
     # Application Configuration
     environment: str = "development"
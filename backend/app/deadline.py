@@ -0,0 +1,27 @@
+from contextvars import ContextVar
+from typing import Optional, Tuple
+import time
+
+# Absolute time.monotonic() by which the current request must be answered
+deadline_var: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its upstream work finished"""
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without one"""
+    deadline = deadline_var.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def bounded_timeout(timeout: float) -> Tuple[float, bool]:
+    """Cap a per-call timeout by the request deadline.
+
+    Returns the timeout and whether the deadline, not `timeout`, is the
+    limit; raises DeadlineExceeded once no time is left.
+    """
+    left = remaining()
+    if left is None or left >= timeout:
+        return timeout, False
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left, True
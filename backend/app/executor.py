@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from typing import Any, Callable, Optional
+import asyncio
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BlockingExecutor:
+    """Bounded thread pool that runs blocking SDK calls off the event loop"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.in_flight = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        # Threads are created on first use so importing the module stays cheap
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=f"{self.name}-io"
+            )
+        return self._pool
+
+    async def run(self, func: Callable[..., Any], *args, timeout: Optional[float] = None,
+                  on_done: Optional[Callable[[], Any]] = None, **kwargs) -> Any:
+        """Run a blocking callable in the pool, raising asyncio.TimeoutError after `timeout` seconds.
+
+        A call that already started keeps running in its thread after a
+        timeout or cancellation; `on_done` is called on the event loop once it
+        has really finished, or was dropped before starting.
+        """
+        loop = asyncio.get_running_loop()
+        call = self._get_pool().submit(functools.partial(func, *args, **kwargs))
+        if on_done is not None:
+            call.add_done_callback(lambda _: _call_soon(loop, on_done))
+        future = asyncio.wrap_future(call, loop=loop)
+        self.in_flight += 1
+        try:
+            if timeout is None:
+                return await future
+            # Cancelling the wrapper also drops the call if it is still queued
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self, wait: bool = False):
+        """Release the worker threads; queued calls that have not started are cancelled"""
+        if self._pool is not None:
+            logger.info(f"Shutting down {self.name} executor")
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+def _call_soon(loop: asyncio.AbstractEventLoop, callback: Callable[[], Any]):
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        pass  # The loop already closed at shutdown
+
+# Separate pools so a slow LLM backlog never starves persistence calls
+gemini_executor = BlockingExecutor("gemini", settings.gemini_pool_size)
+appwrite_executor = BlockingExecutor("appwrite", settings.appwrite_pool_size)
+retrieval_executor = BlockingExecutor("retrieval", settings.retrieval_pool_size)
+# Every SQLite store call, since a write may wait on another worker's lock
+sqlite_executor = BlockingExecutor("sqlite", settings.local_store_pool_size)
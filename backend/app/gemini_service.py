@@ -1,55 +1,81 @@
-import google.generativeai as genai
+from app.circuit_breaker import CircuitBreaker
 from app.config import settings
-from typing import List, Dict, Any
+from app.deadline import DeadlineExceeded, bounded_timeout, remaining
+from app.executor import gemini_executor, retrieval_executor
+from app.hedging import HedgePolicy
+from app.llm_scheduler import AdmissionRejected, LLMScheduler
+from app.metrics import FALLBACKS, GEMINI_HEDGES, GEMINI_TOKENS, UPSTREAM_CALL_SECONDS, UPSTREAM_ERRORS
+from app.prompt_builder import ContextPlan, PromptBuilder, context_token_limit, estimate_tokens, format_context
+from app.prompt_cache import ContextCache, StaticPrefix
+from app.response_cache import ResponseCache, normalize_message
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+import asyncio
+import datetime
 import logging
+import re
+import time
 
 logger = logging.getLogger(__name__)
 
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    }
+]
+
 class GeminiService:
     def __init__(self):
         self.use_mock = True  # Start in mock mode for demo
-        
-        # Only try to initialize Gemini if API key looks valid  
-        if settings.gemini_api_key != "demo_key_for_testing":
-            try:
-                # Configure Gemini API
-                genai.configure(api_key=settings.gemini_api_key)
-                
-                # Initialize the model
-                self.model = genai.GenerativeModel(
-                    model_name="gemini-1.5-flash",
-                    generation_config={
-                        "temperature": 0.7,
-                        "top_p": 0.8,
-                        "top_k": 40,
-                        "max_output_tokens": 1024,
-                    },
-                    safety_settings=[
-                        {
-                            "category": "HARM_CATEGORY_HARASSMENT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_HATE_SPEECH",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        }
-                    ]
-                )
-                self.use_mock = False
-                logger.info("Gemini API configured successfully")
-            except Exception as e:
-                logger.warning(f"Could not configure Gemini API: {str(e)}. Using mock responses.")
-                self.use_mock = True
-        else:
-            logger.info("Using demo/mock mode for Gemini (no real API key configured)")
+        # Upstream failures trip the breaker; mock responses are served until it recovers
+        self.breaker = CircuitBreaker(
+            "gemini",
+            failure_rate=settings.breaker_failure_rate,
+            minimum_calls=settings.breaker_minimum_calls,
+            window_seconds=settings.breaker_window_seconds,
+            backoff_seconds=settings.breaker_backoff_seconds,
+            max_backoff_seconds=settings.breaker_max_backoff_seconds,
+            probe_timeout_seconds=settings.gemini_timeout_seconds
+        )
+        # Caps concurrent calls and token rate, queueing the excess fairly across sessions
+        self.scheduler = LLMScheduler(
+            "gemini",
+            max_concurrency=settings.llm_max_concurrency,
+            tokens_per_minute=settings.llm_tokens_per_minute,
+            max_queue=settings.llm_max_queue,
+            max_queue_per_session=settings.llm_max_queue_per_session,
+            max_wait_seconds=settings.llm_max_wait_seconds
+        )
+        # Backup requests for the slowest generate_content calls, within a small call budget
+        self.hedge_policy: Optional[HedgePolicy] = None
+        if settings.gemini_hedge_enabled:
+            self.hedge_policy = HedgePolicy(
+                quantile=settings.gemini_hedge_quantile,
+                budget_ratio=settings.gemini_hedge_budget_ratio
+            )
+        # The SDK is imported and configured by start(); mock responses are served until then
+        self.configured = settings.gemini_api_key != "demo_key_for_testing"
+        self.model = None
+        self._started = False
         
         # System prompt for customer support agent
         self.system_prompt = """You are a helpful AI customer support agent. Your role is to:
@@ -62,35 +88,353 @@ class GeminiService:
 6. If you don't know something, admit it and offer to escalate to a human agent
 
 Always maintain a helpful and positive tone. Focus on solving the customer's problem efficiently."""
-
-    async def generate_response(self, user_message: str, conversation_history: List[Dict[str, Any]] = None) -> str:
-        """Generate a response using Gemini API with conversation context"""
-        if self.use_mock:
-            return self._generate_mock_response(user_message, conversation_history)
         
+        # Fixed knowledge (policies, FAQ) sent on every turn right after the system prompt
+        self.preamble = ""
+        if settings.prompt_preamble_path:
+            try:
+                with open(settings.prompt_preamble_path, "r", encoding="utf-8") as f:
+                    self.preamble = f.read().strip()
+            except Exception as e:
+                logger.warning(f"Could not load prompt preamble: {str(e)}. Continuing without it.")
+        self._prefix = StaticPrefix(self.system_prompt, self.preamble)
+        if estimate_tokens(self._prefix.text) > settings.prompt_token_budget // 2:
+            logger.warning("The system prompt and preamble take over half of PROMPT_TOKEN_BUDGET, "
+                           "leaving little room for conversation history")
+        
+        # The prefix is kept upstream as cached content so turns only send what changes;
+        # created by start() once the SDK is configured
+        self.context_cache: Optional[ContextCache] = None
+        
+        self.prompt_builder = PromptBuilder(
+            token_budget=settings.prompt_token_budget,
+            summary_token_budget=settings.summary_token_budget,
+            max_messages=settings.history_window
+        )
+        
+        # Answers to history-less questions, keyed on the normalized message and prompt version
+        self.response_cache = ResponseCache(
+            max_entries=settings.response_cache_size,
+            ttl_seconds=settings.response_cache_ttl_seconds
+        )
+        
+        # Retrieval over local support documents (a KnowledgeBase), loaded by start() when a
+        # knowledge base folder is configured; its module pulls in numpy, so it is imported there
+        self.knowledge_base = None
+
+    async def start(self, warmup: bool = True):
+        """Configure the Gemini SDK, load the knowledge base and warm up the model connection.
+
+        Kept out of __init__ so importing the app stays fast: the SDK import and
+        the index load run in worker threads, side by side, while the server is
+        already accepting connections. Safe to call more than once.
+        """
+        if self._started:
+            return
+        self._started = True
+        steps = []
+        if self.configured:
+            steps.append(gemini_executor.run(self._configure))
+        else:
+            logger.info("Using demo/mock mode for Gemini (no real API key configured)")
+        if settings.knowledge_base_dir:
+            steps.append(retrieval_executor.run(self._load_knowledge_base))
+        await asyncio.gather(*steps)
+        if warmup and not self.use_mock:
+            await self._warm_up()
+
+    def _configure(self):
+        """Import and configure the Gemini SDK and create the model (blocking)"""
         try:
-            # Build conversation context
-            context_messages = []
+            import google.generativeai as genai
+            from google.generativeai import caching
             
-            # Add system prompt
-            context_messages.append(f"System: {self.system_prompt}")
+            # Configure Gemini API
+            options = {}
+            if settings.gemini_api_endpoint:
+                # A custom host (proxy, local fake server) is reached over plain REST
+                options["transport"] = "rest"
+                options["client_options"] = {"api_endpoint": settings.gemini_api_endpoint}
+            genai.configure(api_key=settings.gemini_api_key, **options)
             
-            # Add conversation history if available
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # Last 10 messages for context
-                    role = "User" if msg.get("role") == "user" else "Assistant"
-                    content = msg.get("content", "")
-                    context_messages.append(f"{role}: {content}")
-            
-            # Add current user message
-            context_messages.append(f"User: {user_message}")
-            context_messages.append("Assistant:")
+            # Initialize the model
+            self.model = genai.GenerativeModel(
+                model_name="gemini-1.5-flash",
+                generation_config=GENERATION_CONFIG,
+                safety_settings=SAFETY_SETTINGS
+            )
+            if settings.gemini_context_cache_enabled:
+                self.context_cache = ContextCache(
+                    self._create_cached_model,
+                    caching.CachedContent.delete,
+                    ttl_seconds=settings.gemini_context_cache_ttl_seconds
+                )
+            self.use_mock = False
+            logger.info("Gemini API configured successfully")
+        except Exception as e:
+            logger.warning(f"Could not configure Gemini API: {str(e)}. Using mock responses.")
+            self.use_mock = True
+
+    def _load_knowledge_base(self):
+        """Open the knowledge base index and sync it with the documents folder (blocking)"""
+        try:
+            from app.knowledge_base import KnowledgeBase
             
-            # Create the full prompt
-            full_prompt = "\n".join(context_messages)
+            knowledge_base = KnowledgeBase(
+                settings.knowledge_base_dir,
+                settings.knowledge_index_dir,
+                dim=settings.embedding_dim
+            )
+            knowledge_base.sync()
+            self.knowledge_base = knowledge_base
+        except Exception as e:
+            logger.warning(f"Could not load knowledge base: {str(e)}. Continuing without retrieval.")
+            self.knowledge_base = None
+
+    async def probe(self, timeout: Optional[float] = None):
+        """One cheap Gemini call (a token count, no generation) that raises if the API is unreachable"""
+        await gemini_executor.run(
+            self.model.count_tokens,
+            "ping",
+            timeout=timeout or settings.gemini_timeout_seconds
+        )
+
+    async def _warm_up(self):
+        """Open the upstream connection and create the prefix's cached content before the first turn"""
+        try:
+            await self.probe()
+        except Exception as e:
+            # Not a health signal: the first real call will open the connection instead
+            logger.warning(f"Gemini warm-up call failed: {str(e)}")
+        if self.context_cache is not None:
+            self.context_cache.model_for(self.static_prefix())
+            await self.context_cache.wait_refreshed()
+
+    def _use_fallback(self) -> bool:
+        """Serve mock responses in demo mode or while the Gemini breaker is open"""
+        if self.use_mock:
+            return True
+        if self.breaker.allow_request():
+            return False
+        FALLBACKS.labels("gemini").inc()
+        return True
+
+    def check_admission(self, session_id: str):
+        """Raise AdmissionRejected if a Gemini call for this session would be turned away right now"""
+        if not self.use_mock:
+            self.scheduler.check(session_id)
+
+    def _token_cost(self, prompt: str) -> int:
+        return estimate_tokens(prompt) + settings.llm_output_token_reserve
+
+    async def _generate_content(self, prompt: str, session_id: Optional[str] = None, model=None):
+        """Call the blocking Gemini SDK in the worker pool once admitted, within the call timeout and request deadline"""
+        session_id = session_id or "anonymous"
+        model = model if model is not None else self.model
+        cost = self._token_cost(prompt)
+        grant = await self.scheduler.acquire(session_id, cost, timeout=remaining())
+        response = None
+        limited = False
+        start = time.perf_counter()
+        try:
+            timeout, limited = bounded_timeout(settings.gemini_timeout_seconds)
+            if self.hedge_policy is not None:
+                response = await self._hedged_generate(model, prompt, timeout, session_id, cost)
+            else:
+                response = await gemini_executor.run(
+                    model.generate_content,
+                    prompt,
+                    timeout=timeout
+                )
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            UPSTREAM_ERRORS.labels("gemini", "generate_content").inc()
+            if limited and isinstance(e, asyncio.TimeoutError):
+                # The caller ran out of time, which says nothing about Gemini's health
+                raise DeadlineExceeded("Request deadline exceeded waiting for Gemini") from e
+            self.breaker.record_failure()
+            raise
+        finally:
+            UPSTREAM_CALL_SECONDS.labels("gemini", "generate_content").observe(time.perf_counter() - start)
+            if response is None:
+                # Failed or cancelled: free the slot, the token reservation stays spent
+                self.scheduler.release(grant)
+        self.breaker.record_success()
+        self.scheduler.release(grant, self._record_tokens(prompt, response))
+        return response
+
+    async def _hedged_generate(self, model, prompt: str, timeout: float, session_id: str, cost: int):
+        """Run generate_content, sending one backup request if it is slower than the hedge delay.
+
+        The first successful response wins. The loser is cancelled; its SDK call
+        still runs to completion in its worker thread, but its result is ignored.
+        Grants are interchangeable, so the caller's grant goes with the winner
+        and the hedge's grant is held until every call has really finished.
+        """
+        policy = self.hedge_policy
+        policy.record_primary()
+        start = time.perf_counter()
+        hedge_grant = None
+        calls_running = 0
+        
+        def call_finished():
+            nonlocal calls_running, hedge_grant
+            calls_running -= 1
+            if calls_running == 0 and hedge_grant is not None:
+                self.scheduler.release(hedge_grant)
+                hedge_grant = None
+        
+        def attempt(call_timeout: float) -> asyncio.Future:
+            nonlocal calls_running
+            calls_running += 1
+            return asyncio.ensure_future(gemini_executor.run(
+                model.generate_content, prompt, timeout=call_timeout, on_done=call_finished
+            ))
+        
+        primary = attempt(timeout)
+        attempts = {primary}
+        try:
+            delay = policy.delay()
+            if delay is not None and delay < timeout:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                # Hedges never queue: they only use a free slot, and only within the budget
+                if not done and policy.try_spend():
+                    hedge_grant = self.scheduler.try_acquire(session_id, cost)
+                    if hedge_grant is None:
+                        policy.refund()
+                    else:
+                        GEMINI_HEDGES.labels("sent").inc()
+                        attempts.add(attempt(timeout - delay))
+            error = None
+            while attempts:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is None:
+                        policy.observe(time.perf_counter() - start)
+                        if finished is not primary:
+                            policy.hedge_wins += 1
+                            GEMINI_HEDGES.labels("won").inc()
+                        return finished.result()
+                    error = error or finished.exception()
+            raise error
+        finally:
+            for pending in attempts:
+                pending.cancel()
+
+    def _record_tokens(self, prompt: str, response, text: Optional[str] = None) -> int:
+        """Record token counts, preferring the usage Gemini reports over the local estimate; returns the total"""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt)
+        cached_tokens = getattr(usage, "cached_content_token_count", None)
+        response_tokens = getattr(usage, "candidates_token_count", None)
+        if response_tokens is None:
+            if text is None:
+                try:
+                    text = response.text or ""
+                except Exception:
+                    text = ""
+            response_tokens = estimate_tokens(text)
+        GEMINI_TOKENS.labels("prompt").observe(prompt_tokens)
+        if cached_tokens:
+            GEMINI_TOKENS.labels("cached").observe(cached_tokens)
+        GEMINI_TOKENS.labels("response").observe(response_tokens)
+        return prompt_tokens + response_tokens
+
+    def static_prefix(self) -> StaticPrefix:
+        """The pre-built prompt prefix; rebuilt only when the system prompt or preamble changes"""
+        if not self._prefix.matches(self.system_prompt, self.preamble):
+            self._prefix = StaticPrefix(self.system_prompt, self.preamble)
+        return self._prefix
+
+    def _create_cached_model(self, prefix: StaticPrefix, ttl_seconds: float):
+        """Create cached content holding the prefix and a model bound to it (blocking)"""
+        import google.generativeai as genai
+        from google.generativeai import caching
+        content = caching.CachedContent.create(
+            model=settings.gemini_context_cache_model,
+            display_name=f"support-prefix-{prefix.version}",
+            system_instruction=prefix.instruction,
+            ttl=datetime.timedelta(seconds=ttl_seconds)
+        )
+        model = genai.GenerativeModel.from_cached_content(
+            content,
+            generation_config=GENERATION_CONFIG,
+            safety_settings=SAFETY_SETTINGS
+        )
+        return model, content
+
+    def _target_model(self) -> Tuple[Any, bool]:
+        """The model to call and whether it already holds the static prefix as cached content"""
+        if self.context_cache is not None:
+            model = self.context_cache.model_for(self.static_prefix())
+            if model is not None:
+                return model, True
+        return self.model, False
+
+    def plan_context(self, user_message: str, conversation_history: List[Dict[str, Any]],
+                     conversation: Optional[Dict[str, Any]] = None) -> ContextPlan:
+        """Choose the history sent verbatim and fold older turns into the conversation summary"""
+        conversation = conversation or {}
+        return self.prompt_builder.plan(
+            self.static_prefix().text,
+            user_message,
+            conversation_history,
+            summary=conversation.get("summary") or "",
+            summarized_through=conversation.get("summarized_through"),
+            # Retrieval runs alongside planning, so leave room for a full set of passages
+            context_tokens=context_token_limit(settings.retrieval_top_k) if self.knowledge_base is not None else 0
+        )
+
+    async def get_relevant_context(self, user_message: str) -> str:
+        """Return the knowledge-base passages most relevant to the message, formatted for the prompt"""
+        if self.knowledge_base is None:
+            return ""
+        try:
+            passages = await retrieval_executor.run(
+                self.knowledge_base.search,
+                user_message,
+                settings.retrieval_top_k,
+                settings.retrieval_min_score
+            )
+        except Exception as e:
+            logger.error(f"Knowledge base search failed: {str(e)}")
+            return ""
+        return format_context(passages)
+
+    def _build_prompt(self, user_message: str, conversation_history: List[Dict[str, Any]] = None,
+                      summary: str = "", context: str = "", prefix_cached: bool = False) -> str:
+        """Build the full prompt with system instructions, knowledge, summary and recent context within the token budget"""
+        return self.prompt_builder.build(
+            self.static_prefix().text,
+            user_message,
+            conversation_history or [],
+            summary,
+            context,
+            prefix_cached
+        )
+
+    def _build_simple_prompt(self, user_message: str, context: str = "", prefix_cached: bool = False) -> str:
+        """Build a prompt without conversation context"""
+        parts = [] if prefix_cached else [self.static_prefix().text]
+        if context:
+            parts.append(f"Relevant knowledge base articles:\n{context}")
+        parts.append(f"User: {user_message}\nAssistant:")
+        return "\n\n".join(parts)
+
+    async def generate_response(self, user_message: str, conversation_history: List[Dict[str, Any]] = None,
+                                summary: str = "", session_id: Optional[str] = None) -> str:
+        """Generate a response using Gemini API with conversation context"""
+        if self._use_fallback():
+            return self._generate_mock_response(user_message, conversation_history)
+        
+        try:
+            context = await self.get_relevant_context(user_message)
+            model, prefix_cached = self._target_model()
+            full_prompt = self._build_prompt(user_message, conversation_history, summary, context, prefix_cached)
             
             # Generate response
-            response = self.model.generate_content(full_prompt)
+            response = await self._generate_content(full_prompt, session_id, model)
             
             if response and response.text:
                 return response.text.strip()
@@ -98,35 +442,159 @@ Always maintain a helpful and positive tone. Focus on solving the customer's pro
                 logger.warning("Empty response from Gemini API")
                 return "I apologize, but I'm having trouble generating a response right now. Could you please try again or rephrase your question?"
                 
+        except (AdmissionRejected, DeadlineExceeded):
+            # Overload and timeouts are reported to the client rather than masked with a mock answer
+            raise
         except Exception as e:
             logger.error(f"Error generating Gemini response: {str(e)}")
+            FALLBACKS.labels("gemini").inc()
             
             # Fallback to mock
-            self.use_mock = True
             return self._generate_mock_response(user_message, conversation_history)
 
-    async def generate_simple_response(self, user_message: str) -> str:
+    def _cache_key(self, user_message: str) -> str:
+        # Re-indexing the knowledge base changes the answers, so its version is part of the key
+        kb_version = self.knowledge_base.version if self.knowledge_base is not None else ""
+        return f"{self.static_prefix().version}:{kb_version}:{normalize_message(user_message)}"
+    
+    async def _generate_simple_text(self, user_message: str, session_id: Optional[str] = None) -> Optional[str]:
+        """Call Gemini for a context-free answer; None when the response is empty"""
+        context = await self.get_relevant_context(user_message)
+        model, prefix_cached = self._target_model()
+        prompt = self._build_simple_prompt(user_message, context, prefix_cached)
+        
+        response = await self._generate_content(prompt, session_id, model)
+        
+        if response and response.text:
+            return response.text.strip()
+        return None
+    
+    async def generate_simple_response(self, user_message: str, session_id: Optional[str] = None) -> str:
         """Generate a simple response without conversation context"""
-        if self.use_mock:
+        cache_key = self._cache_key(user_message)
+        # A cached answer beats a mock one even while the breaker is open
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        if self._use_fallback():
             return self._generate_mock_simple_response(user_message)
         
         try:
-            # Create a simple prompt
-            prompt = f"{self.system_prompt}\n\nUser: {user_message}\nAssistant:"
+            # Identical questions arriving together share one upstream call
+            text = await self.response_cache.get_or_compute(
+                cache_key,
+                lambda: self._generate_simple_text(user_message, session_id)
+            )
             
-            response = self.model.generate_content(prompt)
-            
-            if response and response.text:
-                return response.text.strip()
+            if text:
+                return text
             else:
                 return "Thank you for your message. How can I help you today?"
                 
+        except (AdmissionRejected, DeadlineExceeded):
+            raise
         except Exception as e:
             logger.error(f"Error in simple Gemini response: {str(e)}")
+            FALLBACKS.labels("gemini").inc()
             # Fallback to mock
-            self.use_mock = True
             return self._generate_mock_simple_response(user_message)
     
+    async def stream_response(self, user_message: str, conversation_history: List[Dict[str, Any]] = None,
+                              summary: str = "", session_id: Optional[str] = None) -> AsyncIterator[str]:
+        """Yield response text chunks as Gemini streams them back"""
+        cache_key = None
+        if not (conversation_history or summary):
+            cache_key = self._cache_key(user_message)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        if not self._use_fallback():
+            yielded = False
+            parts = []
+            last_chunk = None
+            grant = None
+            used_tokens = None
+            limited = False
+            # Only time spent waiting on Gemini counts, not time the client takes to read
+            upstream_seconds = 0.0
+            try:
+                context = await self.get_relevant_context(user_message)
+                model, prefix_cached = self._target_model()
+                if cache_key is None:
+                    prompt = self._build_prompt(user_message, conversation_history, summary, context, prefix_cached)
+                else:
+                    prompt = self._build_simple_prompt(user_message, context, prefix_cached)
+                # The slot is held until the stream ends, since Gemini is busy for all of it
+                grant = await self.scheduler.acquire(
+                    session_id or "anonymous",
+                    self._token_cost(prompt),
+                    timeout=remaining()
+                )
+                start = time.perf_counter()
+                timeout, limited = bounded_timeout(settings.gemini_timeout_seconds)
+                response = await gemini_executor.run(
+                    model.generate_content,
+                    prompt,
+                    stream=True,
+                    timeout=timeout
+                )
+                chunks = iter(response)
+                while True:
+                    # Each chunk is pulled in the worker pool since iteration blocks on the network
+                    timeout, limited = bounded_timeout(settings.gemini_timeout_seconds)
+                    chunk = await gemini_executor.run(
+                        next,
+                        chunks,
+                        None,
+                        timeout=timeout
+                    )
+                    upstream_seconds += time.perf_counter() - start
+                    if chunk is None:
+                        break
+                    last_chunk = chunk
+                    text = chunk.text
+                    if text:
+                        if not yielded:
+                            UPSTREAM_CALL_SECONDS.labels("gemini", "stream_first_chunk").observe(upstream_seconds)
+                        yielded = True
+                        parts.append(text)
+                        yield text
+                    start = time.perf_counter()
+                UPSTREAM_CALL_SECONDS.labels("gemini", "stream_content").observe(upstream_seconds)
+                used_tokens = self._record_tokens(prompt, last_chunk, "".join(parts))
+                self.breaker.record_success()
+                if not yielded:
+                    logger.warning("Empty streamed response from Gemini API")
+                    yield "I apologize, but I'm having trouble generating a response right now. Could you please try again or rephrase your question?"
+                elif cache_key is not None:
+                    self.response_cache.put(cache_key, "".join(parts).strip())
+                return
+            except (AdmissionRejected, DeadlineExceeded):
+                raise
+            except Exception as e:
+                logger.error(f"Error streaming Gemini response: {str(e)}")
+                UPSTREAM_ERRORS.labels("gemini", "stream_content").inc()
+                if limited and isinstance(e, asyncio.TimeoutError):
+                    raise DeadlineExceeded("Request deadline exceeded waiting for Gemini") from e
+                self.breaker.record_failure()
+                if yielded:
+                    # Part of the answer already reached the client, so end the stream here
+                    return
+                FALLBACKS.labels("gemini").inc()
+            finally:
+                if grant is not None:
+                    self.scheduler.release(grant, used_tokens)
+        
+        if conversation_history:
+            text = self._generate_mock_response(user_message, conversation_history)
+        else:
+            text = self._generate_mock_simple_response(user_message)
+        for word in re.findall(r"\S+\s*", text):
+            yield word
+
     def _generate_mock_response(self, user_message: str, conversation_history: List[Dict[str, Any]] = None) -> str:
         """Generate a mock response for testing/demo purposes"""
         mock_responses = [
@@ -0,0 +1,71 @@
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+class HedgePolicy:
+    """When to send a backup request for a slow upstream call, and how many.
+
+    The hedge delay is the `quantile` of the last `window` call latencies, so
+    only the slowest few percent of calls are hedged. Each primary call earns
+    `budget_ratio` of a hedge credit (capped at `max_credits`) and each hedge
+    spends one, which keeps extra upstream calls at most about `budget_ratio`
+    of the total even when the upstream is slow across the board.
+    """
+
+    def __init__(self, quantile: float = 0.95, budget_ratio: float = 0.05, window: int = 200,
+                 min_samples: int = 20, min_delay_seconds: float = 0.05, max_credits: float = 10.0):
+        self.quantile = quantile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self.max_credits = max_credits
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._delay: Optional[float] = None
+        self._credits = 0.0
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.skipped = 0
+
+    def observe(self, seconds: float):
+        """Record the latency of a completed call"""
+        self._latencies.append(seconds)
+        self._delay = None
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None until enough latencies were seen"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        if self._delay is None:
+            ordered = sorted(self._latencies)
+            index = min(len(ordered) - 1, int(self.quantile * len(ordered)))
+            self._delay = max(self.min_delay_seconds, ordered[index])
+        return self._delay
+
+    def record_primary(self):
+        self.primaries += 1
+        self._credits = min(self.max_credits, self._credits + self.budget_ratio)
+
+    def try_spend(self) -> bool:
+        """Take a hedge credit if one is available"""
+        if self._credits < 1.0:
+            self.skipped += 1
+            return False
+        self._credits -= 1.0
+        self.hedges += 1
+        return True
+
+    def refund(self):
+        """Return a credit for a hedge that could not be sent"""
+        self._credits += 1.0
+        self.hedges -= 1
+        self.skipped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "delay_seconds": self.delay(),
+            "primaries": self.primaries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "skipped": self.skipped,
+            "hedge_ratio": round(self.hedges / self.primaries, 4) if self.primaries else 0.0,
+        }
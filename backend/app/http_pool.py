@@ -0,0 +1,162 @@
+from appwrite.client import Client
+from appwrite.encoders.value_class_encoder import ValueClassEncoder
+from appwrite.exception import AppwriteException
+from appwrite.input_file import InputFile
+from app.metrics import HTTP_POOL_SATURATED
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Optional
+from urllib3.util.retry import Retry
+import json
+import logging
+import requests
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Safe to repeat: the request has no side effects
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+class HttpPool:
+    """Keep-alive requests session with a bounded connection pool, shared by all worker threads.
+
+    Connections are reused across calls instead of paying TCP/TLS setup every
+    time. At most `pool_size` connections per host are open; a request that
+    finds them all busy waits for one (and is counted as saturated), so size
+    the pool to the number of threads making calls. Idempotent requests are
+    retried up to `read_retries` times on connection errors and retryable
+    statuses, with jittered exponential backoff that honours Retry-After.
+    Failed connection attempts are retried for any method, since nothing was
+    sent.
+    """
+
+    def __init__(self, name: str, pool_size: int = 10, read_retries: int = 2,
+                 backoff_seconds: float = 0.1, timeout: Optional[float] = None):
+        self.name = name
+        self.pool_size = pool_size
+        self.timeout = timeout
+        retry = Retry(
+            total=read_retries,
+            connect=read_retries,
+            read=read_retries,
+            status=read_retries,
+            other=0,
+            allowed_methods=IDEMPOTENT_METHODS,
+            status_forcelist=RETRY_STATUSES,
+            backoff_factor=backoff_seconds,
+            backoff_jitter=backoff_seconds,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.requests = 0
+        self.saturated = 0
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        with self._lock:
+            if self.in_use >= self.pool_size:
+                self.saturated += 1
+                HTTP_POOL_SATURATED.labels(self.name).inc()
+            self.in_use += 1
+            self.requests += 1
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            with self._lock:
+                self.in_use -= 1
+
+    def connections_opened(self) -> int:
+        """Connections created so far; stays near `pool_size` while connections are being reused"""
+        pools = self.adapter.poolmanager.pools
+        total = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.pool_size,
+            "in_use": self.in_use,
+            "requests": self.requests,
+            "saturated": self.saturated,
+            "connections_opened": self.connections_opened(),
+        }
+
+    def close(self):
+        self.session.close()
+
+class PooledClient(Client):
+    """Appwrite client that sends its requests through an `HttpPool`.
+
+    The SDK's own `call` goes through `requests.request`, which opens a new
+    connection per call. This is the same request and error handling, sent
+    through the shared pool instead. It relies on the client internals of
+    the SDK major version pinned in requirements.txt.
+    """
+
+    def __init__(self, pool: HttpPool):
+        super().__init__()
+        self.pool = pool
+
+    def call(self, method, path='', headers=None, params=None, response_type='json'):
+        headers = {**self._global_headers, **(headers or {})}
+        params = params or {}
+        data = {}
+        files = {}
+        stringify = False
+
+        if method != 'get':
+            data = params
+            params = {}
+
+        if headers['content-type'].startswith('application/json'):
+            data = json.dumps(data, cls=ValueClassEncoder)
+
+        if headers['content-type'].startswith('multipart/form-data'):
+            del headers['content-type']
+            stringify = True
+            for key in data.copy():
+                if isinstance(data[key], InputFile):
+                    files[key] = (data[key].filename, data[key].data)
+                    del data[key]
+            data = self.flatten(data, stringify=stringify)
+
+        response = None
+        try:
+            response = self.pool.request(
+                method.upper(),
+                self._endpoint + path,
+                params=self.flatten(params, stringify=stringify),
+                data=data,
+                files=files,
+                headers=headers,
+                verify=(not self._self_signed),
+                allow_redirects=response_type != 'location'
+            )
+            response.raise_for_status()
+
+            warnings = response.headers.get('x-appwrite-warning')
+            if warnings:
+                for warning in warnings.split(';'):
+                    logger.warning(f"Appwrite: {warning}")
+
+            if response_type == 'location':
+                return response.headers.get('Location')
+            if response.headers['Content-Type'].startswith('application/json'):
+                return response.json()
+            return response.content
+        except Exception as e:
+            if response is None:
+                raise AppwriteException(e)
+            if response.headers.get('Content-Type', '').startswith('application/json'):
+                body = response.json()
+                raise AppwriteException(body['message'], response.status_code, body.get('type'), response.text)
+            raise AppwriteException(response.text, response.status_code, None, response.text)
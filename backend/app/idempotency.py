@@ -0,0 +1,134 @@
+from app.config import settings
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import time
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different request"""
+
+def request_fingerprint(*parts: Optional[str]) -> str:
+    """Hash of the request fields a retry must repeat unchanged"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class _Record:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires_at: Optional[float] = None  # Set once the result is stored
+
+class IdempotencyStore:
+    """Bounded TTL store of results keyed by client-supplied idempotency keys.
+
+    The first request for a key claims it and runs; retries arriving while it
+    runs wait for the same result, and later ones get the stored result for
+    `ttl_seconds`, so a retried submission never repeats its side effects.
+    Failures are not stored: the key is released and the next retry runs
+    again. Only completed results count towards `max_keys`; the oldest are
+    dropped first.
+    """
+
+    def __init__(self, max_keys: int = 10000, ttl_seconds: float = 86400.0):
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self._records: "OrderedDict[str, _Record]" = OrderedDict()
+        self._completed = 0
+        self._tasks = set()  # Strong references so running computations are not garbage collected
+        self.replays = 0
+        self.joins = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def claim(self, key: str, fingerprint: str) -> Tuple[asyncio.Future, bool]:
+        """Return the key's result future and whether the caller owns (must produce) it.
+
+        Raises IdempotencyConflict when the key was used with another fingerprint.
+        """
+        record = self._records.get(key)
+        if record is not None and record.expires_at is not None and record.expires_at <= time.monotonic():
+            self._drop(key)
+            self.evictions += 1
+            record = None
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                raise IdempotencyConflict(f"Idempotency key {key} was used for a different request")
+            if record.future.done():
+                self.replays += 1
+            else:
+                self.joins += 1
+            return record.future, False
+        record = _Record(fingerprint, asyncio.get_running_loop().create_future())
+        self._records[key] = record
+        return record.future, True
+
+    def complete(self, key: str, result: Any):
+        """Store the owner's result and wake the requests waiting for it"""
+        record = self._records.get(key)
+        if record is None or record.future.done():
+            return
+        record.future.set_result(result)
+        record.expires_at = time.monotonic() + self.ttl_seconds
+        self._records.move_to_end(key)
+        self._completed += 1
+        while self._completed > self.max_keys:
+            oldest = next(k for k, r in self._records.items() if r.expires_at is not None)
+            self._drop(oldest)
+            self.evictions += 1
+
+    def fail(self, key: str, error: BaseException):
+        """Release the key so the next retry runs again; requests already waiting get `error`"""
+        record = self._records.get(key)
+        if record is None or record.future.done():
+            return
+        del self._records[key]
+        if isinstance(error, asyncio.CancelledError):
+            record.future.cancel()
+            return
+        record.future.set_exception(error)
+        # Mark the exception as retrieved in case nobody was waiting
+        record.future.exception()
+
+    async def run(self, key: str, fingerprint: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return the key's result and whether it was produced by an earlier request.
+
+        The computation runs in its own task, so a client that disconnects
+        does not abort it and its retry can pick up the result.
+        """
+        future, owner = self.claim(key, fingerprint)
+        if owner:
+            async def produce():
+                try:
+                    self.complete(key, await compute())
+                except BaseException as e:
+                    self.fail(key, e)
+
+            task = asyncio.get_running_loop().create_task(produce())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(future), not owner
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._records),
+            "in_flight": len(self._records) - self._completed,
+            "replays": self.replays,
+            "joins": self.joins,
+            "evictions": self.evictions,
+        }
+
+    def _drop(self, key: str):
+        record = self._records.pop(key)
+        if record.expires_at is not None:
+            self._completed -= 1
+
+# Global instance
+idempotency_store = IdempotencyStore(settings.idempotency_max_keys, settings.idempotency_ttl_seconds)
@@ -0,0 +1,188 @@
+from app.config import settings
+from app.metrics import FAST_PATH_RESPONSES
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+
+# Answered without the model; a message must consist (almost) only of one of these phrases.
+# Order status has no order system to query, so it points to where the status is shown.
+DEFAULT_INTENTS: List[Dict[str, Any]] = [
+    {
+        "name": "greeting",
+        "patterns": [
+            r"\b(hi|hello|hey|hiya|greetings|good (morning|afternoon|evening))\b( there| team| all)?",
+        ],
+        "answer": "Hello! How can I help you today?",
+    },
+    {
+        "name": "thanks",
+        "patterns": [
+            r"\b(thanks?|thank you|thx|ty|cheers|much appreciated)\b( (so|very) much| a lot| again)?",
+        ],
+        "exclude": [r"\b(no|nope|not)\b"],
+        "answer": "You're welcome! Is there anything else I can help you with?",
+        "skip_after_question": True,
+    },
+    {
+        "name": "goodbye",
+        "patterns": [r"\b(bye|goodbye|see you|see ya|have a (good|nice|great) (day|one))\b"],
+        "answer": "Thanks for contacting us. Have a great day!",
+    },
+    {
+        "name": "acknowledgement",
+        "patterns": [r"\b(ok|okay|k|great|perfect|got it|cool|sounds good|that helps|awesome)\b"],
+        "exclude": [r"\b(no|nope|not)\b"],
+        "answer": "Glad I could help! Let me know if there's anything else you need.",
+        "skip_after_question": True,
+    },
+    {
+        "name": "order_status",
+        "patterns": [
+            r"\b((can|could) you |please )?(where is|where's|track|check on|status of) (my )?"
+            r"order( number| no\.?)? ?#?(?P<order_id>\d{3,})\b( for me)?( please)?",
+            r"\border( number| no\.?)? ?#?(?P<order_id>\d{3,}) (status|update|tracking)\b( please)?",
+        ],
+        "answer": ("You can see the status of order {order_id}, with its tracking link once it has shipped, "
+                   "under Orders in your account. If it is late or something looks wrong, tell me what "
+                   "happened and I'll look into it."),
+    },
+]
+
+class Intent:
+    """A templated answer for messages matching one of its patterns and none of its `exclude` patterns"""
+    __slots__ = ("name", "patterns", "exclude", "answer", "min_confidence", "skip_after_question")
+
+    def __init__(self, name: str, patterns: List[str], answer: str, min_confidence: Optional[float] = None,
+                 exclude: Optional[List[str]] = None, skip_after_question: bool = False):
+        self.name = name
+        self.patterns = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+        self.exclude = [re.compile(pattern, re.IGNORECASE) for pattern in exclude or []]
+        self.answer = answer
+        self.min_confidence = min_confidence
+        # "ok" or "thanks" answering the assistant's question is a reply, not a closing remark
+        self.skip_after_question = skip_after_question
+
+class IntentMatch:
+    __slots__ = ("intent", "answer", "confidence")
+
+    def __init__(self, intent: str, answer: str, confidence: float):
+        self.intent = intent
+        self.answer = answer
+        self.confidence = confidence
+
+class IntentRouter:
+    """Pre-LLM routing stage that answers trivial messages from templates.
+
+    Patterns are compiled once. A message's confidence for an intent is the
+    share of its word characters covered by that intent's matches, so "thanks!"
+    is answered but "thanks, but my order is still missing" is not. The best
+    intent is used when its confidence reaches the intent's `min_confidence`
+    (default `min_confidence`); otherwise the message falls through to the
+    model. Named groups in a pattern fill `{placeholders}` in the answer.
+    Intents marked `skip_after_question` are not used while the assistant's
+    last message was a question. An intent replaces an earlier one with the
+    same name, so `DEFAULT_INTENTS + [...]` can override a built-in.
+    """
+
+    def __init__(self, intents: List[Dict[str, Any]], min_confidence: float = 0.75):
+        self.min_confidence = min_confidence
+        by_name: Dict[str, Intent] = {}
+        for i in intents:
+            by_name[i["name"]] = Intent(i["name"], i["patterns"], i["answer"], i.get("min_confidence"),
+                                        i.get("exclude"), i.get("skip_after_question", False))
+        self.intents = list(by_name.values())
+        self.routed = 0
+        self.absorbed: Dict[str, int] = {}
+
+    @classmethod
+    def from_file(cls, path: str, min_confidence: float = 0.75) -> "IntentRouter":
+        """Load intents from a JSON list of {name, patterns, answer, min_confidence?, exclude?, skip_after_question?}"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), min_confidence)
+
+    def match(self, message: str, after_question: bool = False) -> Optional[IntentMatch]:
+        """Return the templated answer for the message, or None to fall through to the model"""
+        self.routed += 1
+        best = self._best(message)
+        if best is None:
+            return None
+        confidence, intent, groups = best
+        if after_question and intent.skip_after_question:
+            return None
+        try:
+            answer = intent.answer.format(**groups)
+        except (KeyError, IndexError, ValueError) as e:
+            logger.warning(f"Could not fill the answer template of intent {intent.name}: {str(e)}")
+            return None
+        self.absorbed[intent.name] = self.absorbed.get(intent.name, 0) + 1
+        FAST_PATH_RESPONSES.labels(intent.name).inc()
+        return IntentMatch(intent.name, answer, confidence)
+
+    def depends_on_history(self, message: str) -> bool:
+        """Whether the answer for the message depends on `after_question`, so callers only look it up then"""
+        best = self._best(message)
+        return best is not None and best[1].skip_after_question
+
+    def absorbed_fraction(self) -> float:
+        return sum(self.absorbed.values()) / self.routed if self.routed else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routed": self.routed,
+            "absorbed": dict(self.absorbed),
+            "absorbed_fraction": round(self.absorbed_fraction(), 4),
+        }
+
+    def _best(self, message: str) -> Optional[Tuple[float, Intent, Dict[str, str]]]:
+        """The most confident intent that reaches its threshold, with its named groups"""
+        words = sum(len(word) for word in _WORD_RE.findall(message))
+        if not words:
+            return None
+        best: Optional[Tuple[float, Intent, Dict[str, str]]] = None
+        for intent in self.intents:
+            if any(pattern.search(message) for pattern in intent.exclude):
+                continue
+            covered, groups = self._coverage(intent, message)
+            confidence = covered / words
+            if best is None or confidence > best[0]:
+                best = (confidence, intent, groups)
+        if best is None:
+            return None
+        confidence, intent, _ = best
+        threshold = intent.min_confidence if intent.min_confidence is not None else self.min_confidence
+        return best if confidence >= threshold else None
+
+    def _coverage(self, intent: Intent, message: str) -> Tuple[int, Dict[str, str]]:
+        """Word characters covered by the intent's (non-overlapping) matches, and their named groups"""
+        spans: List[Tuple[int, int]] = []
+        groups: Dict[str, str] = {}
+        for pattern in intent.patterns:
+            for found in pattern.finditer(message):
+                if found.end() > found.start():
+                    spans.append(found.span())
+                    groups.update({k: v for k, v in found.groupdict().items() if v is not None})
+        covered, end = 0, 0
+        for start, stop in sorted(spans):
+            start = max(start, end)
+            if stop > start:
+                covered += sum(len(word) for word in _WORD_RE.findall(message[start:stop]))
+                end = stop
+        return covered, groups
+
+def _load_router() -> Optional[IntentRouter]:
+    if not settings.intents_enabled:
+        return None
+    if settings.intents_path:
+        try:
+            return IntentRouter.from_file(settings.intents_path, settings.intent_min_confidence)
+        except Exception as e:
+            logger.warning(f"Could not load intents from {settings.intents_path}: {str(e)}. Using the built-in intents.")
+    return IntentRouter(DEFAULT_INTENTS, settings.intent_min_confidence)
+
+# Global instance; None when the fast path is disabled
+intent_router = _load_router()
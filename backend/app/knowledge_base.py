@@ -0,0 +1,278 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_EXTENSIONS = (".md", ".txt")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can could did do does for from had has have how i if in into is it its "
+    "me my of on or our so that the their them then there these they this to was we were what when where "
+    "which who why will with would you your".split()
+)
+
+def _tokens(text: str) -> List[str]:
+    """Lowercased words without stopwords, with common suffixes stripped"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        for suffix in ("ing", "ed", "es", "s"):
+            if len(token) > len(suffix) + 3 and token.endswith(suffix):
+                token = token[:-len(suffix)]
+                break
+        tokens.append(token)
+    return tokens
+
+class HashingEmbedder:
+    """Local embedding: signed feature hashing of word stems and stem bigrams, L2-normalized.
+
+    It needs no model download or network call and is stable across processes,
+    so vectors can be precomputed and stored on disk.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = _tokens(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            h = zlib.crc32(feature.encode())
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_many(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        matrix = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            matrix[i] = self.embed(text)
+        return matrix
+
+def chunk_text(text: str, chunk_chars: int = 800) -> List[str]:
+    """Pack paragraphs into chunks of about `chunk_chars`; long paragraphs are split on sentences"""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = re.sub(r"\s+", " ", paragraph).strip()
+        if len(paragraph) <= chunk_chars:
+            if paragraph:
+                pieces.append(paragraph)
+            continue
+        pieces.extend(s for s in re.split(r"(?<=[.!?])\s+", paragraph) if s)
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > chunk_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {piece}" if current else piece
+        while len(current) > chunk_chars:
+            chunks.append(current[:chunk_chars])
+            current = current[chunk_chars:]
+    if current:
+        chunks.append(current)
+    return chunks
+
+class KnowledgeBase:
+    """Retrieval over a folder of support documents backed by a memory-mapped vector index.
+
+    `sync` chunks and embeds new or changed files only; vectors of unchanged
+    files are copied over from the previous index. Vectors live in a flat
+    float32 file that is memory-mapped for search, so the index is shared with
+    the page cache instead of being loaded per worker. The file is stored
+    dimension-major: a short query only has a few non-zero dimensions, and the
+    exact top-k is computed from just those rows of the matrix. Query
+    embeddings are kept in a small LRU cache.
+    """
+
+    def __init__(self, docs_dir: str, index_dir: Optional[str] = None, dim: int = 256,
+                 chunk_chars: int = 800, query_cache_size: int = 1024):
+        self.docs_dir = docs_dir
+        self.index_dir = index_dir or os.path.join(docs_dir, ".index")
+        self.embedder = HashingEmbedder(dim)
+        self.chunk_chars = chunk_chars
+        self.query_cache_size = query_cache_size
+        self.version = ""
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._chunks: List[Tuple[str, str]] = []  # (source, text) per index row
+        self._vectors: Optional[np.ndarray] = None  # dim x chunks
+        # Searches run on several retrieval threads at once
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.query_cache_hits = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.index_dir, "vectors.f32")
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.index_dir, "manifest.json")
+
+    def sync(self) -> Dict[str, int]:
+        """Bring the index up to date with the documents folder; returns what changed"""
+        current = self._scan()
+        changes = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        files, chunks, blocks = {}, [], []
+        rows = 0
+        for path, (mtime_ns, size) in sorted(current.items()):
+            old = self._files.get(path)
+            if old is not None and old["mtime_ns"] == mtime_ns and old["size"] == size:
+                block = self._rows(old)
+                texts = [text for _, text in self._chunks[old["start"]:old["start"] + old["count"]]]
+                digest = old["digest"]
+                changes["unchanged"] += 1
+            else:
+                with open(os.path.join(self.docs_dir, path), encoding="utf-8", errors="replace") as f:
+                    content = f.read()
+                digest = hashlib.sha1(content.encode()).hexdigest()
+                if old is not None and old["digest"] == digest:
+                    # Touched but not edited: keep the vectors
+                    block = self._rows(old)
+                    texts = [text for _, text in self._chunks[old["start"]:old["start"] + old["count"]]]
+                    changes["unchanged"] += 1
+                else:
+                    texts = chunk_text(content, self.chunk_chars)
+                    block = self.embedder.embed_many(texts)
+                    changes["updated" if old is not None else "added"] += 1
+            files[path] = {"mtime_ns": mtime_ns, "size": size, "digest": digest,
+                           "start": rows, "count": len(texts)}
+            chunks.extend((path, text) for text in texts)
+            blocks.append(block)
+            rows += len(texts)
+        changes["removed"] = len(set(self._files) - set(current))
+
+        if changes["added"] or changes["updated"] or changes["removed"] or not os.path.exists(self._manifest_path):
+            matrix = np.concatenate(blocks) if blocks else np.zeros((0, self.embedder.dim), dtype=np.float32)
+            self._write(files, chunks, matrix)
+            self._load()
+            logger.info(f"Knowledge base index updated: {changes}")
+        return changes
+
+    def search(self, query: str, top_k: int = 3, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """Return the `top_k` chunks most similar to `query` (cosine similarity)"""
+        # Take both together so a concurrent sync cannot pair new rows with old texts
+        vectors, chunks = self._vectors, self._chunks
+        if vectors is None or not chunks or top_k <= 0:
+            return []
+        query_vector = self._embed_query(query)
+        dims = np.flatnonzero(query_vector)
+        if not len(dims):
+            return []
+        # Only the query's non-zero dimensions contribute, so only those rows are read
+        scores = query_vector[dims] @ vectors[dims]
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        results = []
+        for row in best:
+            score = float(scores[row])
+            if score < min_score:
+                break
+            source, text = chunks[row]
+            results.append({"source": source, "text": text, "score": round(score, 4)})
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self._files),
+            "chunks": len(self._chunks),
+            "dim": self.embedder.dim,
+            "query_cache_size": len(self._query_cache),
+            "query_cache_hits": self.query_cache_hits,
+        }
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        key = re.sub(r"\s+", " ", query.lower()).strip()
+        with self._query_cache_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                self.query_cache_hits += 1
+                return vector
+        vector = self.embedder.embed(key)
+        with self._query_cache_lock:
+            self._query_cache[key] = vector
+            if len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        found = {}
+        for root, dirs, names in os.walk(self.docs_dir):
+            # Skip the index folder and other hidden directories
+            dirs[:] = [d for d in dirs if not d.startswith(".")
+                       and os.path.abspath(os.path.join(root, d)) != os.path.abspath(self.index_dir)]
+            for name in names:
+                if name.lower().endswith(DOCUMENT_EXTENSIONS):
+                    full = os.path.join(root, name)
+                    stat = os.stat(full)
+                    found[os.path.relpath(full, self.docs_dir)] = (stat.st_mtime_ns, stat.st_size)
+        return found
+
+    def _rows(self, entry: Dict[str, Any]) -> np.ndarray:
+        if not entry["count"]:
+            return np.zeros((0, self.embedder.dim), dtype=np.float32)
+        return np.array(self._vectors[:, entry["start"]:entry["start"] + entry["count"]].T)
+
+    def _write(self, files: Dict[str, Dict[str, Any]], chunks: List[Tuple[str, str]], matrix: np.ndarray):
+        os.makedirs(self.index_dir, exist_ok=True)
+        # Write to temporary files first so readers never see a half-written index
+        np.ascontiguousarray(matrix.T, dtype=np.float32).tofile(self._vectors_path + ".tmp")
+        manifest = {"dim": self.embedder.dim, "files": files, "chunks": chunks}
+        with open(self._manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        self._vectors = None  # Release the old mapping before replacing the file
+        os.replace(self._vectors_path + ".tmp", self._vectors_path)
+        os.replace(self._manifest_path + ".tmp", self._manifest_path)
+
+    def _load(self):
+        if not os.path.exists(self._manifest_path):
+            return
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read knowledge base index, it will be rebuilt: {str(e)}")
+            return
+        if manifest.get("dim") != self.embedder.dim:
+            logger.info("Knowledge base index was built with another embedding size, it will be rebuilt")
+            return
+        chunks = [tuple(chunk) for chunk in manifest["chunks"]]
+        vectors = None
+        if chunks:
+            vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                shape=(self.embedder.dim, len(chunks)))
+        self._files = manifest["files"]
+        self._vectors, self._chunks = vectors, chunks
+        digests = "".join(f"{path}:{entry['digest']}" for path, entry in sorted(self._files.items()))
+        self.version = hashlib.sha1(digests.encode()).hexdigest()[:12]
+        with self._query_cache_lock:
+            self._query_cache.clear()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or incrementally update the knowledge base index")
+    parser.add_argument("docs_dir")
+    parser.add_argument("--index-dir")
+    parser.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    knowledge_base = KnowledgeBase(args.docs_dir, args.index_dir, dim=args.dim)
+    print(json.dumps({**knowledge_base.sync(), **knowledge_base.stats()}))
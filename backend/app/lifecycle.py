@@ -0,0 +1,95 @@
+from app.appwrite_service import appwrite_service
+from app.config import settings
+from app.gemini_service import gemini_service
+from fastapi import HTTPException
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class ServiceStartup:
+    """Starts the upstream services in the background once the server is listening.
+
+    uvicorn only accepts connections after the lifespan's startup half returns,
+    so the slow part (SDK imports, client set-up, warm-up calls) runs as a task
+    instead of there. Routes that need the services wait for it through
+    `require_ready`; health and metrics answer straight away.
+    """
+
+    def __init__(self, warmup: bool = True):
+        self.warmup = warmup
+        self.durations: Dict[str, float] = {}
+        self.ready_after: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = 0.0
+
+    def begin(self) -> asyncio.Task:
+        """Start the services in the background; later calls return the same task"""
+        if self._task is None:
+            self._started_at = time.perf_counter()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    async def _run(self):
+        await asyncio.gather(
+            self._start("gemini", gemini_service.start),
+            self._start("appwrite", appwrite_service.start)
+        )
+        self.ready_after = time.perf_counter() - self._started_at
+        logger.info(f"Services ready {self.ready_after:.2f}s after startup began")
+
+    async def _start(self, name: str, start):
+        began = time.perf_counter()
+        try:
+            await start(warmup=self.warmup)
+        except Exception as e:
+            # The service stays in mock mode, as when its keys are missing
+            logger.error(f"Could not start {name} service: {str(e)}")
+        finally:
+            self.durations[name] = time.perf_counter() - began
+
+    @property
+    def ready(self) -> bool:
+        """Startup has finished, or was never begun (no lifespan, as under a bare test client)"""
+        return self._task is None or self._task.done()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait up to `timeout` seconds (forever if None) for startup to finish; False if it is still running"""
+        if self.ready:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def stop(self):
+        """Cancel startup if the app shuts down before it finished"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "ready_after_seconds": self.ready_after,
+            "durations": dict(self.durations),
+        }
+
+async def require_ready():
+    """Route dependency that holds requests until the services have started, then gives up with a 503"""
+    if not await startup.wait(settings.startup_wait_seconds):
+        logger.warning("Request rejected: services are still starting")
+        raise HTTPException(
+            status_code=503,
+            detail="The assistant is starting up. Please retry shortly.",
+            headers={"Retry-After": "1"}
+        )
+
+# Global instance
+startup = ServiceStartup(warmup=settings.startup_warmup)
@@ -0,0 +1,223 @@
+from app.deadline import DeadlineExceeded
+from app.metrics import LLM_QUEUE_WAIT_SECONDS, LLM_REJECTIONS
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+import asyncio
+import math
+import time
+
+class AdmissionRejected(Exception):
+    """An LLM call was not admitted; carries the HTTP status and how long to wait before retrying"""
+
+    def __init__(self, reason: str, status_code: int, retry_after: float):
+        super().__init__(f"LLM call rejected ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+class Grant:
+    """A running LLM call holding one concurrency slot and a token reservation"""
+    __slots__ = ("session_id", "cost", "started")
+
+    def __init__(self, session_id: str, cost: int):
+        self.session_id = session_id
+        self.cost = cost
+        self.started = time.monotonic()
+
+class _Waiter:
+    __slots__ = ("session_id", "cost", "future", "enqueued", "grant")
+
+    def __init__(self, session_id: str, cost: int, future: asyncio.Future):
+        self.session_id = session_id
+        self.cost = cost
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.grant: Optional[Grant] = None
+
+class LLMScheduler:
+    """Admission control and fair queueing for upstream LLM calls.
+
+    At most `max_concurrency` calls run at once and, when `tokens_per_minute`
+    is set, admitted calls draw their estimated tokens from a bucket refilled
+    at that rate. Calls that cannot start wait in per-session FIFO queues that
+    are served round-robin, so one busy session cannot starve the others.
+    Waiting is bounded: a full queue (`max_queue`) is rejected with 503, a
+    session with `max_queue_per_session` calls already waiting with 429, and a
+    call still queued after `max_wait_seconds` with 503.
+
+    All methods must be called from the event loop.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, tokens_per_minute: int = 0,
+                 max_queue: int = 100, max_queue_per_session: int = 2, max_wait_seconds: float = 10.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self.max_queue_per_session = max_queue_per_session
+        self.max_wait_seconds = max_wait_seconds
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        # A full minute of budget may be spent in a burst, like per-minute upstream quotas
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._service_seconds = 1.0  # Moving average of call duration, for Retry-After
+
+    @property
+    def rate_limited(self) -> bool:
+        return self.tokens_per_minute > 0
+
+    def check(self, session_id: str):
+        """Raise AdmissionRejected now if a call for this session would be turned away"""
+        if self.queued == 0 and self.active < self.max_concurrency:
+            return
+        if self.queued >= self.max_queue:
+            self._reject("queue_full", 503)
+        queue = self._queues.get(session_id)
+        if queue is not None and len(queue) >= self.max_queue_per_session:
+            self._reject("session_limit", 429)
+
+    def try_acquire(self, session_id: str, cost: int) -> Optional[Grant]:
+        """Start a call only if a slot and tokens are free right now, without queueing"""
+        if self.rate_limited:
+            cost = min(cost, self.tokens_per_minute)
+        if self.queued == 0 and self.active < self.max_concurrency and self._take_tokens(cost):
+            return self._start(session_id, cost, 0.0)
+        return None
+
+    async def acquire(self, session_id: str, cost: int, timeout: Optional[float] = None) -> Grant:
+        """Wait for a slot and `cost` tokens, or raise AdmissionRejected.
+
+        `timeout` shortens the wait below `max_wait_seconds`, e.g. to a request
+        deadline; running out of it raises DeadlineExceeded instead.
+        """
+        self.check(session_id)
+        if self.rate_limited:
+            cost = min(cost, self.tokens_per_minute)
+        if self.queued == 0 and self.active < self.max_concurrency and self._take_tokens(cost):
+            return self._start(session_id, cost, 0.0)
+
+        waiter = _Waiter(session_id, cost, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(session_id, deque()).append(waiter)
+        self.queued += 1
+        self._dispatch()
+        caller_limited = timeout is not None and timeout < self.max_wait_seconds
+        try:
+            max_wait = self.max_wait_seconds if not caller_limited else max(0.0, timeout)
+            return await asyncio.wait_for(asyncio.shield(waiter.future), max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            if waiter.grant is not None:
+                return waiter.grant
+            if caller_limited:
+                # The caller's own deadline passed; the queue did not exceed its limit
+                self._count_rejection("request_deadline")
+                raise DeadlineExceeded("Request deadline exceeded waiting for an LLM slot")
+            self._reject("deadline", 503)
+        except asyncio.CancelledError:
+            # The caller went away; give back a slot granted in the meantime
+            self._abandon(waiter)
+            if waiter.grant is not None:
+                self.release(waiter.grant)
+            raise
+
+    def release(self, grant: Grant, used_tokens: Optional[int] = None):
+        """Free the grant's slot; `used_tokens` corrects the reservation once actual usage is known"""
+        self.active -= 1
+        duration = time.monotonic() - grant.started
+        self._service_seconds = 0.9 * self._service_seconds + 0.1 * duration
+        if self.rate_limited and used_tokens is not None:
+            # Over-use leaves the bucket in debt, which delays the next admissions
+            self._refill()
+            self._tokens = min(float(self.tokens_per_minute), self._tokens + grant.cost - used_tokens)
+        self._dispatch()
+
+    def retry_after(self) -> float:
+        """Estimated seconds until a new call could start"""
+        drain = (self.queued + 1) * self._service_seconds / self.max_concurrency
+        if self.rate_limited and self._tokens < 0:
+            drain = max(drain, -self._tokens / (self.tokens_per_minute / 60))
+        return drain
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "sessions_waiting": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "tokens_available": round(self._tokens) if self.rate_limited else None,
+        }
+
+    def _start(self, session_id: str, cost: int, waited: float) -> Grant:
+        self.active += 1
+        self.admitted += 1
+        LLM_QUEUE_WAIT_SECONDS.labels(self.name).observe(waited)
+        return Grant(session_id, cost)
+
+    def _reject(self, reason: str, status_code: int):
+        self._count_rejection(reason)
+        raise AdmissionRejected(reason, status_code, self.retry_after())
+
+    def _count_rejection(self, reason: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        LLM_REJECTIONS.labels(self.name, reason).inc()
+
+    def _dispatch(self):
+        """Start queued calls while slots and tokens allow, one session at a time in rotation"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queues and self.active < self.max_concurrency:
+            session_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if not self._take_tokens(waiter.cost):
+                # Try again once the bucket has refilled enough for the head of the line
+                delay = (waiter.cost - self._tokens) / (self.tokens_per_minute / 60)
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            queue.popleft()
+            self.queued -= 1
+            # Move the session to the back of the rotation
+            del self._queues[session_id]
+            if queue:
+                self._queues[session_id] = queue
+            waiter.grant = self._start(session_id, waiter.cost, time.monotonic() - waiter.enqueued)
+            waiter.future.set_result(waiter.grant)
+
+    def _abandon(self, waiter: _Waiter):
+        """Drop a waiter that gave up before being started"""
+        queue = self._queues.get(waiter.session_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self.queued -= 1
+        if not queue:
+            del self._queues[waiter.session_id]
+        # It may have been the head of the line the refill timer was waiting for
+        self._dispatch()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.tokens_per_minute),
+            self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60
+        )
+        self._refilled_at = now
+
+    def _take_tokens(self, cost: int) -> bool:
+        if not self.rate_limited:
+            return True
+        self._refill()
+        if self._tokens < cost:
+            return False
+        self._tokens -= cost
+        return True
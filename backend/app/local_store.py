@@ -0,0 +1,291 @@
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Rough per-object costs used for the memory cap; exact accounting is not worth the overhead
+_SESSION_OVERHEAD = 600
+_MESSAGE_OVERHEAD = 16 + 1 + 8 + 8  # id bytes, role code, timestamp, list slot
+_EPOCH = datetime(1970, 1, 1)
+
+class _SessionRecord:
+    """One conversation with its messages stored column-wise"""
+    __slots__ = ("session_id", "created_at", "updated_at", "extra", "ids", "roles",
+                 "timestamps", "contents", "last_access", "size")
+
+    def __init__(self, session_id: str, created_at: int):
+        self.session_id = session_id
+        self.created_at = created_at
+        self.updated_at = created_at
+        self.extra: Optional[Dict[str, Any]] = None  # Additional conversation fields
+        self.ids = bytearray()  # 16 raw UUID bytes per message
+        self.roles = array("B")
+        self.timestamps = array("q")  # Microseconds since the epoch, local time
+        self.contents: List[str] = []
+        self.last_access = time.monotonic()
+        self.size = _SESSION_OVERHEAD + sys.getsizeof(session_id)
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+class LocalConversationStore:
+    """Memory-bounded conversation store used in mock and fallback mode.
+
+    Messages are kept as compact columns (raw UUID bytes, interned role codes,
+    integer microsecond timestamps) instead of one dict per message. Sessions idle for longer
+    than `idle_seconds`, or the least recently used ones once `max_bytes` is
+    exceeded, are evicted; with `spill_dir` set they are written to disk and
+    loaded back transparently on the next access.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, idle_seconds: float = 3600.0,
+                 spill_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = spill_dir
+        self.bytes_used = 0
+        self.evictions = 0
+        self.spills = 0
+        self._sessions: "OrderedDict[str, _SessionRecord]" = OrderedDict()
+        self._roles: List[str] = ["user", "assistant", "system"]
+        self._role_codes: Dict[str, int] = {role: i for i, role in enumerate(self._roles)}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._load(session_id) is not None
+
+    def create_conversation(self, session_id: str) -> Dict[str, Any]:
+        """Return the conversation, creating it if needed"""
+        record = self._load(session_id)
+        if record is None:
+            record = _SessionRecord(session_id, _to_micros(datetime.now()))
+            self._sessions[session_id] = record
+            self.bytes_used += record.size
+            self._enforce_limits()
+        return self._conversation_dict(record)
+
+    def get_conversation(self, session_id: str) -> Optional[Dict[str, Any]]:
+        record = self._load(session_id)
+        return self._conversation_dict(record) if record is not None else None
+
+    def update_conversation(self, session_id: str, fields: Dict[str, Any]):
+        """Update conversation fields; timestamps are given as ISO strings"""
+        record = self._load(session_id)
+        if record is None:
+            return
+        for key, value in fields.items():
+            if key == "updated_at":
+                record.updated_at = _to_micros(value)
+            elif key not in ("session_id", "created_at"):
+                if record.extra is None:
+                    record.extra = {}
+                record.extra[key] = value
+
+    def add_message(self, message: Dict[str, Any]):
+        """Append a message dict (id, session_id, role, content, timestamp)"""
+        session_id = message["session_id"]
+        record = self._load(session_id)
+        if record is None:
+            self.create_conversation(session_id)
+            record = self._sessions[session_id]
+        timestamp = _to_micros(message["timestamp"])
+        record.ids += uuid.UUID(message["id"]).bytes
+        record.roles.append(self._role_code(message["role"]))
+        record.timestamps.append(timestamp)
+        record.contents.append(message["content"])
+        record.updated_at = timestamp
+        added = _MESSAGE_OVERHEAD + sys.getsizeof(message["content"])
+        record.size += added
+        self.bytes_used += added
+        self._enforce_limits()
+
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return the newest `limit` messages (all when None) in chronological order"""
+        record = self._load(session_id)
+        if record is None:
+            return []
+        start = max(0, len(record) - limit) if limit else 0
+        return [self._message_dict(record, i) for i in range(start, len(record))]
+
+    def get_messages_page(self, session_id: str, limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Return up to `limit` messages after the `cursor` message ID"""
+        record = self._load(session_id)
+        if record is None:
+            if cursor:
+                raise ValueError(f"Unknown cursor: {cursor}")
+            return {"messages": [], "next_cursor": None}
+        start = 0
+        if cursor:
+            start = self._index_of(record, cursor) + 1
+        end = min(len(record), start + limit)
+        page = [self._message_dict(record, i) for i in range(start, end)]
+        return {"messages": page, "next_cursor": page[-1]["id"] if end < len(record) else None}
+
+    def list_conversations(self, limit: int, cursor: Optional[str] = None,
+                           updated_after: Optional[str] = None,
+                           updated_before: Optional[str] = None) -> Dict[str, Any]:
+        """Return up to `limit` in-memory conversations after the `cursor` session ID, oldest first"""
+        after = _to_micros(updated_after) if updated_after else None
+        before = _to_micros(updated_before) if updated_before else None
+        records = sorted(
+            (r for r in self._sessions.values()
+             if (after is None or r.updated_at >= after) and (before is None or r.updated_at < before)),
+            key=lambda r: (r.created_at, r.session_id)
+        )
+        start = 0
+        if cursor:
+            record = self._sessions.get(cursor)
+            if record is None:
+                raise ValueError(f"Unknown cursor: {cursor}")
+            key = (record.created_at, record.session_id)
+            start = next((i for i, r in enumerate(records) if (r.created_at, r.session_id) > key), len(records))
+        page = [self._conversation_dict(r) for r in records[start:start + limit]]
+        has_more = start + limit < len(records)
+        return {"conversations": page, "next_cursor": page[-1]["session_id"] if has_more else None}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "bytes_used": self.bytes_used,
+            "evictions": self.evictions,
+            "spills": self.spills,
+        }
+
+    def _role_code(self, role: str) -> int:
+        code = self._role_codes.get(role)
+        if code is None:
+            code = len(self._roles)
+            self._roles.append(role)
+            self._role_codes[role] = code
+        return code
+
+    def _index_of(self, record: _SessionRecord, message_id: str) -> int:
+        try:
+            raw = uuid.UUID(message_id).bytes
+        except ValueError:
+            raise ValueError(f"Unknown cursor: {message_id}")
+        position = record.ids.find(raw)
+        # Only 16-byte aligned matches are real message IDs
+        while position != -1 and position % 16:
+            position = record.ids.find(raw, position + 1)
+        if position == -1:
+            raise ValueError(f"Unknown cursor: {message_id}")
+        return position // 16
+
+    def _message_dict(self, record: _SessionRecord, i: int) -> Dict[str, Any]:
+        return {
+            "id": str(uuid.UUID(bytes=bytes(record.ids[i * 16:i * 16 + 16]))),
+            "session_id": record.session_id,
+            "role": self._roles[record.roles[i]],
+            "content": record.contents[i],
+            "timestamp": _from_micros(record.timestamps[i])
+        }
+
+    def _conversation_dict(self, record: _SessionRecord) -> Dict[str, Any]:
+        conversation = {
+            "session_id": record.session_id,
+            "created_at": _from_micros(record.created_at),
+            "updated_at": _from_micros(record.updated_at)
+        }
+        if record.extra:
+            conversation.update(record.extra)
+        return conversation
+
+    def _load(self, session_id: str) -> Optional[_SessionRecord]:
+        record = self._sessions.get(session_id)
+        if record is None and self.spill_dir:
+            record = self._read_spilled(session_id)
+            if record is not None:
+                self._sessions[session_id] = record
+                self.bytes_used += record.size
+        if record is None:
+            return None
+        record.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return record
+
+    def _enforce_limits(self):
+        """Evict idle sessions, then least recently used ones while over the memory cap"""
+        idle_before = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            session_id, record = next(iter(self._sessions.items()))
+            if record.last_access > idle_before and self.bytes_used <= self.max_bytes:
+                break
+            if len(self._sessions) == 1:
+                break  # Never evict the session that is being written
+            self._evict(session_id)
+
+    def _evict(self, session_id: str):
+        record = self._sessions.pop(session_id)
+        self.bytes_used -= record.size
+        self.evictions += 1
+        if self.spill_dir:
+            try:
+                self._write_spilled(record)
+                self.spills += 1
+            except OSError as e:
+                logger.error(f"Could not spill session {session_id} to disk: {str(e)}")
+
+    def _spill_path(self, session_id: str) -> str:
+        name = hashlib.sha1(session_id.encode()).hexdigest()
+        return os.path.join(self.spill_dir, f"{name}.json.gz")
+
+    def _write_spilled(self, record: _SessionRecord):
+        payload = {
+            "session_id": record.session_id,
+            "created_at": record.created_at,
+            "updated_at": record.updated_at,
+            "extra": record.extra,
+            "ids": record.ids.hex(),
+            "roles": [self._roles[code] for code in record.roles],
+            "timestamps": record.timestamps.tolist(),
+            "contents": record.contents
+        }
+        with gzip.open(self._spill_path(record.session_id), "wt", encoding="utf-8") as f:
+            json.dump(payload, f)
+
+    def _read_spilled(self, session_id: str) -> Optional[_SessionRecord]:
+        path = self._spill_path(session_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                payload = json.load(f)
+            os.remove(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read spilled session {session_id}: {str(e)}")
+            return None
+        record = _SessionRecord(session_id, payload["created_at"])
+        record.updated_at = payload["updated_at"]
+        record.extra = payload["extra"]
+        record.ids = bytearray.fromhex(payload["ids"])
+        record.roles = array("B", (self._role_code(role) for role in payload["roles"]))
+        record.timestamps = array("q", payload["timestamps"])
+        record.contents = payload["contents"]
+        record.size += sum(_MESSAGE_OVERHEAD + sys.getsizeof(c) for c in record.contents)
+        return record
+
+def _to_micros(value: Any) -> int:
+    """Convert an ISO timestamp (or datetime) to integer microseconds, losslessly"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+def _from_micros(micros: int) -> str:
+    return (_EPOCH + timedelta(microseconds=micros)).isoformat()
@@ -1,14 +1,51 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routes.chat import router as chat_router
 from routes.health import router as health_router
+from routes.metrics import router as metrics_router
+from app.config import settings
+from app.executor import gemini_executor, appwrite_executor, retrieval_executor, sqlite_executor
+from app.appwrite_service import appwrite_service
+from app.lifecycle import require_ready, startup
+from app.readiness import upstream_probe
+from app.retention import retention_job
+from app.metrics import registry
+from app.request_id import RequestIdMiddleware, install_log_filter
+
+registry.enabled = settings.metrics_enabled
+install_log_filter()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the SDKs and open upstream connections once the server is listening
+    startup.begin()
+    # Background upstream checks behind /api/ready
+    upstream_probe.start()
+    if settings.retention_enabled:
+        retention_job.start()
+    yield
+    await retention_job.stop()
+    await upstream_probe.stop()
+    await startup.stop()
+    # Drain queued writes before the worker threads go away
+    await appwrite_service.close()
+    # Release the SDK worker threads on shutdown
+    gemini_executor.shutdown()
+    appwrite_executor.shutdown()
+    retrieval_executor.shutdown()
+    sqlite_executor.shutdown()
 
 app = FastAPI(
     title="AI Customer Support Agent",
     description="AI-powered customer support agent with contextual memory and RAG",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Tag every request with an ID that shows up in the logs and the X-Request-ID header
+app.add_middleware(RequestIdMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -20,7 +57,9 @@ app.add_middleware(
 
 # Include routers
 app.include_router(health_router, prefix="/api")
-app.include_router(chat_router, prefix="/api")
+# Chat requests wait for the services to start; health and metrics answer right away
+app.include_router(chat_router, prefix="/api", dependencies=[Depends(require_ready)])
+app.include_router(metrics_router, prefix="/api")
 
 @app.get("/")
 async def root():
@@ -0,0 +1,231 @@
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Return the child for these label values, creating it on first use"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child) -> List[str]:
+        raise NotImplementedError
+
+class _CounterChild:
+    __slots__ = ("registry", "value")
+
+    def __init__(self, registry: "MetricsRegistry"):
+        self.registry = registry
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        if self.registry.enabled:
+            self.value += amount
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild(self.registry)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+class _HistogramChild:
+    __slots__ = ("registry", "buckets", "counts", "sum", "count")
+
+    def __init__(self, registry: "MetricsRegistry", buckets: Tuple[float, ...]):
+        self.registry = registry
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        if self.registry.enabled:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str,
+                 labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.registry, self.buckets)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = 'le="' + _format_value(float(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Compute the value at scrape time instead of on the hot path"""
+        self.function = function
+
+    def get(self) -> float:
+        return float(self.function()) if self.function is not None else self.value
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"]
+
+class MetricsRegistry:
+    """Process-wide set of metrics rendered in the Prometheus text exposition format.
+
+    Metrics are updated from the event loop only, so they need no locking. Set
+    `enabled` to False to turn every update into a no-op.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._metrics: List[_Metric] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+registry = MetricsRegistry()
+
+# Hot-path metrics shared by the routes and services
+CHAT_STAGE_SECONDS = registry.histogram(
+    "chat_stage_seconds", "Time spent in each stage of a chat turn", ["endpoint", "stage"]
+)
+UPSTREAM_CALL_SECONDS = registry.histogram(
+    "upstream_call_seconds", "Latency of calls to Gemini and Appwrite", ["service", "operation"]
+)
+UPSTREAM_ERRORS = registry.counter(
+    "upstream_errors", "Failed calls to Gemini and Appwrite", ["service", "operation"]
+)
+FALLBACKS = registry.counter(
+    "fallback_responses", "Requests served by mock replies or local storage instead of upstream", ["service"]
+)
+GEMINI_TOKENS = registry.histogram(
+    "gemini_tokens", "Tokens per Gemini request", ["kind"], buckets=TOKEN_BUCKETS
+)
+LLM_QUEUE_WAIT_SECONDS = registry.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for admission", ["scheduler"]
+)
+LLM_REJECTIONS = registry.counter(
+    "llm_rejections", "LLM calls turned away by admission control", ["scheduler", "reason"]
+)
+GEMINI_HEDGES = registry.counter(
+    "gemini_hedges", "Backup Gemini requests sent for slow calls, and those that finished first", ["outcome"]
+)
+FAST_PATH_RESPONSES = registry.counter(
+    "fast_path_responses", "Messages answered from intent templates without calling the LLM", ["intent"]
+)
+HTTP_POOL_SATURATED = registry.counter(
+    "http_pool_saturated", "HTTP requests that found every pooled connection busy and had to wait", ["client"]
+)
+WRITE_BEHIND_DEAD_LETTERS = registry.counter(
+    "write_behind_dead_letters", "Queued messages kept in the local store after Appwrite would not take them", ["reason"]
+)
+LOCAL_STORE_ERRORS = registry.counter(
+    "local_store_errors", "Local store calls that failed (e.g. SQLite locked too long) and were skipped", ["operation"]
+)
+CACHE_LOOKUPS = registry.counter(
+    "cache_lookups", "Lookups in the in-process caches, by whether they were served", ["cache", "result"]
+)
+CACHE_EVICTIONS = registry.counter(
+    "cache_evictions", "Entries dropped from the in-process caches", ["cache", "reason"]
+)
+RETENTION_ITEMS = registry.counter(
+    "retention_items", "Messages archived and sessions deleted by the retention job", ["action"]
+)
+MOCK_MODE = registry.gauge("mock_mode", "1 when a service runs in demo/mock mode", ["service"])
+BREAKER_STATE = registry.gauge(
+    "circuit_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["service"]
+)
+
+class timed:
+    """Context manager that observes the duration of its block on a histogram child"""
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
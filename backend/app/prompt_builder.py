@@ -0,0 +1,159 @@
+from typing import Any, Dict, List, Optional
+import re
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) that is good enough for budgeting"""
+    return len(text) // 4 + 1
+
+def format_context(passages: List[Dict[str, Any]]) -> str:
+    """Render retrieved knowledge-base passages for the prompt"""
+    return "\n".join(f"[{p['source']}] {p['text']}" for p in passages)
+
+def context_token_limit(top_k: int, chunk_chars: int = 800, source_chars: int = 100) -> int:
+    """Most tokens `format_context` can produce for `top_k` passages, sources up to `source_chars` long"""
+    return top_k * estimate_tokens("x" * (chunk_chars + source_chars + 4))
+
+# Details a customer should never have to repeat; kept in the summary after their turn is dropped
+_FACT_PATTERNS = [
+    ("name", re.compile(r"\b(?i:my name is|call me)\s+([A-Z][\w'-]+(?:\s+[A-Z][\w'-]+)?)")),
+    ("email", re.compile(r"\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b")),
+    ("phone", re.compile(r"(?<![\w#])(?!\d{4}-\d\d-\d\d)\+?\d[\d ().-]{7,}\d\b")),
+    ("order", re.compile(r"(?i)\border\s*(?:number|no\.?|id)?\s*(?:is\s*)?#?\s*([a-z0-9-]*\d[a-z0-9-]*)")),
+    ("reference", re.compile(
+        r"(?i)\b(?:ticket|tracking|account|invoice|reference|case)\s*(?:number|no\.?|id)?\s*(?:is\s*)?#?\s*"
+        r"([a-z0-9-]*\d[a-z0-9-]*)"
+    )),
+]
+_FACTS_PREFIX = "Key facts: "
+
+def extract_facts(text: str) -> List[str]:
+    """Names, contact details and order/ticket numbers mentioned in `text`, as "label: value" strings"""
+    facts = []
+    for label, pattern in _FACT_PATTERNS:
+        for match in pattern.finditer(text):
+            value = match.group(match.lastindex or 0).strip()
+            fact = f"{label}: {value}"
+            if fact not in facts:
+                facts.append(fact)
+    return facts
+
+def _role_label(message: Dict[str, Any]) -> str:
+    return "User" if message.get("role") == "user" else "Assistant"
+
+def _format(message: Dict[str, Any]) -> str:
+    return f"{_role_label(message)}: {message.get('content', '')}"
+
+class ContextPlan:
+    """Which history to send verbatim and the rolling summary covering older turns"""
+    __slots__ = ("history", "summary", "summarized_through", "summary_changed")
+
+    def __init__(self, history: List[Dict[str, Any]], summary: str,
+                 summarized_through: Optional[str], summary_changed: bool):
+        self.history = history
+        self.summary = summary
+        self.summarized_through = summarized_through
+        self.summary_changed = summary_changed
+
+class PromptBuilder:
+    """Assembles prompts within a token budget and folds older turns into a rolling summary.
+
+    The static prefix (system prompt and preamble, pre-formatted by
+    `StaticPrefix`) and the current user message are always sent. The newest
+    history messages are added verbatim while they fit in `token_budget` (and
+    up to `max_messages`); older ones are folded into the conversation
+    summary. Folding keeps the key facts of each turn (names, contact details,
+    order and ticket numbers) in a "Key facts" line, and condenses the turn
+    itself into one line. The summary is capped at `summary_token_budget` by
+    dropping its oldest turn lines first, so facts from early in the
+    conversation outlive the turns that mentioned them. Only messages after
+    `summarized_through` are folded, so each turn does incremental work.
+    """
+
+    def __init__(self, token_budget: int = 3000, summary_token_budget: int = 400,
+                 max_messages: int = 10, summary_line_chars: int = 160):
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+        self.max_messages = max_messages
+        self.summary_line_chars = summary_line_chars
+
+    def plan(self, prefix: str, user_message: str, history: List[Dict[str, Any]],
+             summary: str = "", summarized_through: Optional[str] = None,
+             context_tokens: int = 0) -> ContextPlan:
+        """Split `history` into verbatim context and newly summarized turns.
+
+        `context_tokens` is room kept for retrieved passages, which are not
+        known yet, so `build` never has to drop history the plan kept.
+        """
+        # Skip what the summary already covers
+        ids = [m.get("id") for m in history]
+        if summarized_through in ids:
+            history = history[ids.index(summarized_through) + 1:]
+
+        # Room is reserved for a full summary so the plan still fits after folding
+        available = (self.token_budget - estimate_tokens(prefix) - estimate_tokens(user_message)
+                     - self.summary_token_budget - context_tokens)
+        kept = 0
+        for message in reversed(history):
+            cost = estimate_tokens(_format(message))
+            if kept == self.max_messages or cost > available:
+                break
+            available -= cost
+            kept += 1
+
+        to_fold = history[:len(history) - kept]
+        if not to_fold:
+            return ContextPlan(history, summary, summarized_through, False)
+        summary = self.fold(summary, to_fold)
+        return ContextPlan(history[len(history) - kept:], summary, to_fold[-1].get("id"), True)
+
+    def build(self, prefix: str, user_message: str, history: List[Dict[str, Any]],
+              summary: str = "", context: str = "", prefix_cached: bool = False) -> str:
+        """Assemble the prompt; history beyond the budget is dropped oldest first.
+
+        With `prefix_cached` the model already holds the prefix as cached
+        content, so it is left out but still counts towards the budget.
+        """
+        available = (self.token_budget - estimate_tokens(prefix) - estimate_tokens(user_message)
+                     - estimate_tokens(summary) - estimate_tokens(context))
+        lines = []
+        for message in reversed(history[-self.max_messages:]):
+            line = _format(message)
+            cost = estimate_tokens(line)
+            if cost > available:
+                break
+            available -= cost
+            lines.append(line)
+        lines.reverse()
+
+        parts = [] if prefix_cached else [prefix]
+        if context:
+            parts.append(f"Relevant knowledge base articles:\n{context}")
+        if summary:
+            parts.append(f"Summary of earlier conversation:\n{summary}")
+        parts.extend(lines)
+        parts.append(f"User: {user_message}")
+        parts.append("Assistant:")
+        return "\n".join(parts)
+
+    def fold(self, summary: str, messages: List[Dict[str, Any]]) -> str:
+        """Add the key facts and one condensed line per message to `summary`, within `summary_token_budget`"""
+        lines = summary.splitlines() if summary else []
+        facts = []
+        if lines and lines[0].startswith(_FACTS_PREFIX):
+            facts = lines.pop(0)[len(_FACTS_PREFIX):].split("; ")
+        for message in messages:
+            text = re.sub(r"\s+", " ", message.get("content", "")).strip()
+            facts.extend(fact for fact in extract_facts(text) if fact not in facts)
+            if len(text) > self.summary_line_chars:
+                text = text[:self.summary_line_chars - 3].rstrip() + "..."
+            lines.append(f"- {_role_label(message)}: {text}")
+        # Facts may use up to half the budget, dropping the oldest only past that
+        while len(facts) > 1 and estimate_tokens(_FACTS_PREFIX + "; ".join(facts)) > self.summary_token_budget // 2:
+            facts.pop(0)
+        if facts:
+            lines.insert(0, _FACTS_PREFIX + "; ".join(facts))
+        # Keep the summary bounded by forgetting its oldest turn lines first
+        first_turn = 1 if facts else 0
+        while len(lines) > first_turn + 1 and estimate_tokens("\n".join(lines)) > self.summary_token_budget:
+            lines.pop(first_turn)
+        return "\n".join(lines)
@@ -0,0 +1,137 @@
+from app.config import settings
+from app.executor import gemini_executor
+from app.response_cache import prompt_version
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class StaticPrefix:
+    """The part of every prompt that is the same on every turn, formatted once.
+
+    `instruction` is the system prompt followed by the static knowledge
+    preamble; it becomes the system instruction of upstream cached content.
+    `text` is the same thing as the first lines of a plain-text prompt, used
+    when no upstream cache is available.
+    """
+    __slots__ = ("system_prompt", "preamble", "instruction", "text", "version")
+
+    def __init__(self, system_prompt: str, preamble: str = ""):
+        self.system_prompt = system_prompt
+        self.preamble = preamble
+        self.instruction = f"{system_prompt}\n\n{preamble}" if preamble else system_prompt
+        self.text = f"System: {self.instruction}"
+        self.version = prompt_version(self.instruction)
+
+    def matches(self, system_prompt: str, preamble: str = "") -> bool:
+        return self.system_prompt == system_prompt and self.preamble == preamble
+
+class _CachedContent:
+    __slots__ = ("version", "model", "handle", "expires_at")
+
+    def __init__(self, version: str, model: Any, handle: Any, expires_at: float):
+        self.version = version
+        self.model = model
+        self.handle = handle
+        self.expires_at = expires_at
+
+class ContextCache:
+    """Keeps an upstream cached-content copy of the static prefix.
+
+    `model_for(prefix)` returns a model bound to cached content holding exactly
+    that prefix, or None when there is none; the caller then sends the
+    pre-built prefix text instead. Missing, stale (the prefix changed) or
+    nearly expired content is (re)created in the background, so no request
+    waits for it, and the replaced copy is deleted. A failed creation, e.g. a
+    prefix below the model's minimum cacheable size, is retried after
+    `retry_seconds`.
+
+    `create(prefix, ttl_seconds)` returns the bound model and a handle that is
+    passed to `delete` once the content is replaced; both block and run in the
+    Gemini worker pool.
+    """
+
+    def __init__(self, create: Callable[[StaticPrefix, float], Tuple[Any, Any]],
+                 delete: Optional[Callable[[Any], None]] = None, ttl_seconds: float = 3600.0,
+                 refresh_margin_seconds: float = 300.0, retry_seconds: float = 600.0):
+        self.create = create
+        self.delete = delete
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = min(refresh_margin_seconds, ttl_seconds / 2)
+        self.retry_seconds = retry_seconds
+        self._content: Optional[_CachedContent] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.creations = 0
+        self.failures = 0
+
+    def model_for(self, prefix: StaticPrefix) -> Optional[Any]:
+        """Model whose cached content holds `prefix`, or None to send the prefix inline"""
+        now = time.monotonic()
+        content = self._content
+        usable = content is not None and content.version == prefix.version and content.expires_at > now
+        if not usable or content.expires_at - self.refresh_margin_seconds <= now:
+            self._refresh(prefix)
+        if usable:
+            self.hits += 1
+            return content.model
+        self.misses += 1
+        return None
+
+    async def wait_refreshed(self):
+        """Wait for a background (re)creation, if one is running"""
+        if self._refreshing is not None:
+            await asyncio.shield(self._refreshing)
+
+    def stats(self) -> Dict[str, Any]:
+        content = self._content
+        lookups = self.hits + self.misses
+        return {
+            "version": content.version if content is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "creations": self.creations,
+            "failures": self.failures,
+        }
+
+    def _refresh(self, prefix: StaticPrefix):
+        if self._refreshing is not None or time.monotonic() < self._retry_at:
+            return
+        self._refreshing = asyncio.get_running_loop().create_task(self._recreate(prefix))
+
+    async def _recreate(self, prefix: StaticPrefix):
+        try:
+            await self._replace(prefix)
+        finally:
+            self._refreshing = None
+
+    async def _replace(self, prefix: StaticPrefix):
+        # The upstream TTL starts during the call, so count it from before the call
+        started = time.monotonic()
+        try:
+            model, handle = await gemini_executor.run(
+                self.create,
+                prefix,
+                self.ttl_seconds,
+                timeout=settings.gemini_timeout_seconds
+            )
+        except Exception as e:
+            self.failures += 1
+            self._retry_at = time.monotonic() + self.retry_seconds
+            logger.warning(f"Could not create cached content for the prompt prefix: {str(e)}. "
+                           f"Sending it inline; retrying in {self.retry_seconds:.0f}s.")
+            return
+        replaced = self._content
+        self._content = _CachedContent(prefix.version, model, handle, started + self.ttl_seconds)
+        self.creations += 1
+        if replaced is not None and self.delete is not None:
+            try:
+                await gemini_executor.run(self.delete, replaced.handle, timeout=settings.gemini_timeout_seconds)
+            except Exception as e:
+                # It expires on its own at the end of its TTL
+                logger.warning(f"Could not delete replaced cached content: {str(e)}")
@@ -0,0 +1,131 @@
+from app.appwrite_service import appwrite_service
+from app.circuit_breaker import CircuitBreaker
+from app.config import settings
+from app.executor import appwrite_executor
+from app.gemini_service import gemini_service
+from app.lifecycle import startup
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class UpstreamProbe:
+    """Checks each upstream on a timer and keeps the latest result for /api/ready.
+
+    The endpoint only reads these results, so however often a load balancer
+    polls it, Gemini and Appwrite see one cheap call per interval per worker.
+    Services in mock mode are not probed.
+
+    Upstream health (probe results and breaker state) is reported but does
+    not decide readiness: an outage affects every worker alike, and taking
+    them all out of rotation would only replace the local-store fallback with
+    errors. A worker is ready once it has started, has the clients it was
+    configured for, and its queues have room.
+    """
+
+    def __init__(self, interval_seconds: float = 15.0, timeout_seconds: float = 5.0):
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Begin probing once the services have started"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        await startup.wait()
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval_seconds)
+
+    async def check(self):
+        """Probe every configured upstream once, side by side"""
+        await asyncio.gather(
+            self._check("gemini", gemini_service),
+            self._check("appwrite", appwrite_service)
+        )
+
+    async def _check(self, name: str, service):
+        if service.use_mock:
+            self.results.pop(name, None)
+            return
+        start = time.perf_counter()
+        error = None
+        try:
+            await service.probe(timeout=self.timeout_seconds)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            logger.warning(f"Readiness probe for {name} failed: {error}")
+        self.results[name] = {
+            "ok": error is None,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "checked_at": datetime.now().isoformat(),
+            "error": error,
+        }
+
+    def report(self) -> Tuple[bool, Dict[str, Any]]:
+        """Whether this worker should get traffic, and the state of each dependency"""
+        dependencies = {
+            "gemini": self._dependency("gemini", gemini_service, _scheduler_saturated(), {
+                "queue_depth": gemini_service.scheduler.queued,
+                "active_calls": gemini_service.scheduler.active,
+            }),
+            "appwrite": self._dependency("appwrite", appwrite_service, _write_behind_saturated(), {
+                "queue_depth": appwrite_service.write_behind.pending_count if appwrite_service.write_behind else 0,
+                "active_calls": appwrite_executor.in_flight,
+            }),
+        }
+        usable = all(not dependency["fallback"] and not dependency["saturated"]
+                     for dependency in dependencies.values())
+        if not startup.ready:
+            status = "starting"
+        elif not usable:
+            status = "degraded"
+        else:
+            status = "ready"
+        return status == "ready", {"status": status, "startup": startup.stats(), "dependencies": dependencies}
+
+    def _dependency(self, name: str, service, saturated: bool, queues: Dict[str, int]) -> Dict[str, Any]:
+        probe = self.results.get(name)
+        # Mock mode with real keys after startup means the client could not be set up
+        fallback = service.configured and service.use_mock and startup.ready
+        return {
+            # Informational: the upstream itself, as seen by the breaker and the last probe
+            "healthy": (not fallback and service.breaker.state != CircuitBreaker.OPEN
+                        and (probe is None or probe["ok"])),
+            "mock": service.use_mock,
+            "fallback": fallback,
+            "saturated": saturated,
+            "breaker": service.breaker.state,
+            **queues,
+            "last_latency_ms": probe["latency_ms"] if probe else None,
+            "probe": probe,
+        }
+
+def _scheduler_saturated() -> bool:
+    scheduler = gemini_service.scheduler
+    return bool(scheduler.max_queue) and scheduler.queued >= scheduler.max_queue
+
+def _write_behind_saturated() -> bool:
+    queue = appwrite_service.write_behind
+    return queue is not None and queue.pending_count >= queue.max_pending
+
+# Global instance
+upstream_probe = UpstreamProbe(
+    interval_seconds=settings.ready_probe_interval_seconds,
+    timeout_seconds=settings.ready_probe_timeout_seconds
+)
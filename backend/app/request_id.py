@@ -0,0 +1,53 @@
+from contextvars import ContextVar
+import logging
+import uuid
+
+HEADER = b"x-request-id"
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request ID to every log record as `request_id`"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class RequestIdMiddleware:
+    """ASGI middleware that tags each request with an ID for logs and the response.
+
+    An incoming `X-Request-ID` header is reused so IDs can be traced across
+    services; otherwise a new one is generated.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == HEADER:
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(HEADER, request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+
+def install_log_filter(fmt: str = "%(levelname)s:%(name)s:[%(request_id)s] %(message)s"):
+    """Show the request ID in every line written by the root logger's handlers"""
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(RequestIdFilter())
+        handler.setFormatter(logging.Formatter(fmt))
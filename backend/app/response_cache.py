@@ -0,0 +1,111 @@
+from app.deadline import DeadlineExceeded, deadline_var, remaining
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import contextvars
+import hashlib
+import re
+import time
+
+def normalize_message(message: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivially different FAQs share a key"""
+    text = re.sub(r"\s+", " ", message.lower()).strip()
+    return text.rstrip(" ?!.")
+
+def prompt_version(system_prompt: str) -> str:
+    """Short fingerprint of the system prompt; changing the prompt invalidates cached answers"""
+    return hashlib.sha256(system_prompt.encode()).hexdigest()[:12]
+
+class ResponseCache:
+    """LRU/TTL cache of model answers with coalescing of concurrent identical requests.
+
+    `get_or_compute` runs at most one upstream call per key at a time; callers
+    arriving while it is running wait for the same result. The call runs in
+    its own task, without the first caller's deadline, so a cancelled or
+    short-deadline caller does not fail the others; each caller waits only
+    until its own deadline. Exceptions and None results are passed through
+    without being cached.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: str):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        """Return the cached answer, joining an in-flight call for `key` or starting one"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            context = contextvars.copy_context()
+            context.run(deadline_var.set, None)
+            task = context.run(asyncio.get_running_loop().create_task, compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        left = remaining()
+        if left is None:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), max(left, 0.0))
+        except asyncio.TimeoutError:
+            if task.done():
+                raise  # The shared call itself timed out
+            raise DeadlineExceeded("Request deadline exceeded waiting for a shared answer") from None
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            # Coalesced requests were served without their own upstream call too
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        if task.cancelled():
+            return
+        # Retrieving the exception here keeps unobserved failures out of the loop's error log
+        if task.exception() is None and task.result() is not None:
+            self.put(key, task.result())
@@ -0,0 +1,230 @@
+from app.appwrite_service import appwrite_service
+from app.circuit_breaker import CircuitBreaker
+from app.config import settings
+from app.executor import appwrite_executor, sqlite_executor
+from app.gemini_service import gemini_service
+from app.lifecycle import startup
+from app.metrics import RETENTION_ITEMS
+from app.sqlite_store import SqliteConversationStore
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+def _older(timestamp: Optional[str], cutoff: str) -> bool:
+    # ISO timestamps compared to the second, whether or not Appwrite added a UTC offset
+    return bool(timestamp) and timestamp[:19] < cutoff[:19]
+
+class RetentionJob:
+    """Keeps the messages collection small by archiving old turns and deleting inactive sessions.
+
+    Each run picks up where the last one stopped and handles the next
+    `sessions_per_run` conversations:
+
+    - a session idle for `session_inactive_days` is deleted with its
+      messages and archives;
+    - otherwise up to `batch_size` of its messages older than
+      `message_max_age_days` are packed into one compressed archive document
+      and deleted. The newest `keep_recent` messages always stay, so chat
+      turns never need the archive. Turns the rolling summary does not cover
+      yet are folded into it first.
+
+    Every Appwrite call is paced to `calls_per_second`, and is held back while
+    live requests are using the Appwrite pool or its breaker is not closed.
+
+    With `lease_path` set, only the worker holding the "retention" lease in
+    that SQLite file runs; the others check again every interval and take
+    over once the lease has not been renewed for `lease_seconds`.
+    """
+
+    def __init__(self, message_max_age_days: float = 30.0, session_inactive_days: float = 365.0,
+                 keep_recent: int = 40, batch_size: int = 100, sessions_per_run: int = 50,
+                 interval_seconds: float = 60.0, calls_per_second: float = 5.0,
+                 lease_path: Optional[str] = None, lease_seconds: float = 300.0):
+        self.message_max_age_days = message_max_age_days
+        self.session_inactive_days = session_inactive_days
+        # Turns still inside the chat history window are never archived
+        self.keep_recent = max(keep_recent, settings.history_window + settings.summary_fold_margin)
+        self.batch_size = batch_size
+        self.sessions_per_run = sessions_per_run
+        self.interval_seconds = interval_seconds
+        self.call_interval = 1.0 / calls_per_second
+        self.archived_messages = 0
+        self.deleted_sessions = 0
+        self.passes = 0
+        self.lease_path = lease_path
+        self.lease_seconds = max(lease_seconds, interval_seconds * 2)
+        self._lease: Optional[SqliteConversationStore] = None
+        self._holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._cursor: Optional[str] = None
+        self._last_call = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Begin running in the background once the services have started"""
+        if self._task is None:
+            if self.lease_path and self._lease is None:
+                self._lease = SqliteConversationStore(self.lease_path)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self._lease is not None:
+                # Let another worker take over without waiting for the lease to expire
+                await sqlite_executor.run(self._lease.release_lease, "retention", self._holder)
+
+    async def _run(self):
+        await startup.wait()
+        while True:
+            try:
+                if await self._renew_lease():
+                    await self.run_once()
+            except Exception as e:
+                logger.error(f"Retention run failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def _renew_lease(self) -> bool:
+        """Whether this worker may run the job now"""
+        if self._lease is None:
+            return True
+        return await sqlite_executor.run(self._lease.acquire_lease, "retention", self._holder, self.lease_seconds)
+
+    async def run_once(self, now: Optional[datetime] = None):
+        """Process the next page of conversations"""
+        if appwrite_service.use_mock:
+            return
+        now = now or datetime.now()
+        await self._pace()
+        # The cursor is the last creation time seen, so deleting that session does not lose our place
+        page = await appwrite_service.list_conversations_created_after(self._cursor, self.sessions_per_run)
+        for conversation in page:
+            # Renewed per session so a long run keeps the lease
+            if not await self._renew_lease():
+                return
+            await self.compact_session(conversation, now)
+            self._cursor = conversation["created_at"]
+        if len(page) < self.sessions_per_run:
+            self._cursor = None
+            self.passes += 1
+
+    async def compact_session(self, conversation: Dict[str, Any], now: datetime):
+        session_id = conversation["session_id"]
+        if self.session_inactive_days:
+            inactive_before = (now - timedelta(days=self.session_inactive_days)).isoformat()
+            if _older(conversation.get("updated_at") or conversation.get("created_at"), inactive_before):
+                await self._delete_session(session_id)
+                return
+        if not self.message_max_age_days:
+            return
+        cutoff = (now - timedelta(days=self.message_max_age_days)).isoformat()
+        if not _older(conversation.get("created_at"), cutoff):
+            return  # Too new to have old turns
+
+        await self._pace()
+        old = await appwrite_service.list_session_messages(session_id, self.batch_size, before=cutoff)
+        if not old:
+            return
+        await self._pace()
+        recent = await appwrite_service.list_session_messages(session_id, self.keep_recent, newest_first=True)
+        if len(recent) < self.keep_recent:
+            return
+        old = [m for m in old if m["timestamp"] < recent[-1]["timestamp"]]
+        if old:
+            await self._archive(conversation, old)
+
+    async def _archive(self, conversation: Dict[str, Any], messages: List[Dict[str, Any]]):
+        session_id = conversation["session_id"]
+        folded = await self._fold(conversation, messages)
+        await self._pace()
+        await appwrite_service.create_archive(session_id, messages)
+        if folded is not None:
+            await self._pace()
+            await appwrite_service.update_conversation_summary(session_id, *folded)
+        await self._pace()
+        await appwrite_service.delete_messages([m["$id"] for m in messages])
+        self.archived_messages += len(messages)
+        RETENTION_ITEMS.labels("archived_messages").inc(len(messages))
+        appwrite_service.session_cache.invalidate(session_id)
+
+    async def _fold(self, conversation: Dict[str, Any],
+                    messages: List[Dict[str, Any]]) -> Optional[Tuple[str, str]]:
+        """The summary extended with the turns it does not cover yet, and its new last message ID"""
+        through = conversation.get("summarized_through")
+        ids = [m.get("id") for m in messages]
+        if through is None:
+            to_fold = messages
+        elif through in ids:
+            to_fold = messages[ids.index(through) + 1:]
+        else:
+            await self._pace()
+            summarized = await appwrite_service.get_message(through)
+            # Gone means an earlier batch archived it, so it is older than all of these
+            to_fold = messages if summarized is None else [
+                m for m in messages if m["timestamp"] > summarized["timestamp"]
+            ]
+        if not to_fold:
+            return None
+        summary = gemini_service.prompt_builder.fold(conversation.get("summary") or "", to_fold)
+        return summary, to_fold[-1]["id"]
+
+    async def _delete_session(self, session_id: str):
+        while True:
+            await self._pace()
+            messages = await appwrite_service.list_session_messages(session_id, self.batch_size)
+            if messages:
+                await self._pace()
+                await appwrite_service.delete_messages([m["$id"] for m in messages])
+            if len(messages) < self.batch_size:
+                break
+        while True:
+            await self._pace()
+            archives = await appwrite_service.list_archives(session_id, self.batch_size)
+            for archive in archives:
+                await self._pace()
+                await appwrite_service.delete_archive(archive["$id"])
+            if len(archives) < self.batch_size:
+                break
+        await self._pace()
+        await appwrite_service.delete_conversation(session_id)
+        self.deleted_sessions += 1
+        RETENTION_ITEMS.labels("deleted_sessions").inc()
+
+    async def _pace(self):
+        """Wait for this call's turn, and until no live request is using Appwrite"""
+        while appwrite_executor.in_flight or appwrite_service.breaker.state != CircuitBreaker.CLOSED:
+            await asyncio.sleep(max(self.call_interval, 0.05))
+        delay = self._last_call + self.call_interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._last_call = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "archived_messages": self.archived_messages,
+            "deleted_sessions": self.deleted_sessions,
+            "passes": self.passes,
+        }
+
+# Global instance
+retention_job = RetentionJob(
+    message_max_age_days=settings.retention_message_max_age_days,
+    session_inactive_days=settings.retention_session_inactive_days,
+    keep_recent=settings.retention_keep_recent_messages,
+    batch_size=settings.retention_batch_size,
+    sessions_per_run=settings.retention_sessions_per_run,
+    interval_seconds=settings.retention_interval_seconds,
+    calls_per_second=settings.retention_calls_per_second,
+    lease_path=settings.local_store_path,
+    lease_seconds=settings.retention_lease_seconds
+)
@@ -0,0 +1,215 @@
+from app.executor import sqlite_executor
+from app.metrics import CACHE_EVICTIONS, CACHE_LOOKUPS
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+_HITS = CACHE_LOOKUPS.labels("session", "hit")
+_MISSES = CACHE_LOOKUPS.labels("session", "miss")
+# Expired: past the TTL; stale: another worker changed the session; capacity: least recently used
+_EVICTIONS = {reason: CACHE_EVICTIONS.labels("session", reason) for reason in ("expired", "stale", "capacity")}
+
+# Version of a session whose counter could not be read; entries loaded at it never match
+_UNKNOWN_VERSION = -1
+
+class _Entry:
+    __slots__ = ("conversation", "messages", "complete", "expires_at", "version", "checked_at")
+
+    def __init__(self, expires_at: float, version: int, checked_at: float):
+        self.conversation: Optional[Dict[str, Any]] = None
+        self.messages: Optional[Deque[Dict[str, Any]]] = None
+        # True when `messages` holds the whole conversation, not just its tail
+        self.complete = False
+        self.expires_at = expires_at
+        self.version = version
+        # When `version` was last compared with the shared counter
+        self.checked_at = checked_at
+
+class SessionCache:
+    """In-process LRU cache of conversation metadata and the newest messages per session.
+
+    Entries expire `ttl_seconds` after they were loaded from Appwrite, so a
+    session served by another worker is never stale for longer than that.
+    Writes made through this worker are applied to the cached window directly.
+    
+    With `versions` (a store shared by all workers, such as
+    `SqliteConversationStore`), workers bump a per-session counter after
+    writing to Appwrite. A lookup compares an entry with the counter at most
+    once per `version_check_seconds` and drops it if it was loaded at an older
+    version, so changes made by other workers show up within that window while
+    a hot session is served without touching the store. Bumps, and the
+    version reads before an Appwrite fetch (`load_version`), run on a worker
+    thread; a version read that finds the store busy counts as a miss.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 300.0, window: int = 20,
+                 versions: Optional[Any] = None, version_check_seconds: float = 1.0):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.window = window
+        self.versions = versions
+        self.version_check_seconds = version_check_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_conversation(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._lookup(session_id)
+        if entry is None or entry.conversation is None:
+            self._miss()
+            return None
+        self._hit()
+        return entry.conversation
+
+    def get_messages(self, session_id: str, limit: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+        """Return the newest `limit` messages (all when None), or None if the window cannot answer"""
+        entry = self._lookup(session_id)
+        if entry is None or entry.messages is None:
+            self._miss()
+            return None
+        if entry.complete or (limit is not None and limit <= len(entry.messages)):
+            self._hit()
+            messages = list(entry.messages)
+            return messages[-limit:] if limit else messages
+        self._miss()
+        return None
+
+    def current_version(self, session_id: str) -> int:
+        """The session's shared version counter (blocking; see load_version)"""
+        if self.versions is None:
+            return 0
+        try:
+            return self.versions.session_version(session_id)
+        except sqlite3.OperationalError:
+            return _UNKNOWN_VERSION
+
+    async def load_version(self, session_id: str) -> int:
+        """Read before fetching from Appwrite and pass to put_*, so a concurrent write invalidates the load"""
+        if self.versions is None:
+            return 0
+        return await sqlite_executor.run(self.current_version, session_id)
+
+    def put_conversation(self, session_id: str, conversation: Dict[str, Any], version: Optional[int] = None):
+        self._entry_for_load(session_id, version).conversation = conversation
+
+    def put_messages(self, session_id: str, messages: List[Dict[str, Any]], complete: bool,
+                     version: Optional[int] = None):
+        """Cache the tail of a fetched history; `complete` means nothing older exists"""
+        entry = self._entry_for_load(session_id, version)
+        entry.messages = deque(messages[-self.window:], maxlen=self.window)
+        entry.complete = complete and len(messages) <= self.window
+
+    def append_message(self, session_id: str, message: Dict[str, Any]):
+        """Write-through for a new message; ignored when the session's window is not cached"""
+        entry = self._entries.get(session_id)
+        if entry is None or entry.messages is None:
+            return
+        if len(entry.messages) == self.window:
+            # The oldest message falls out of the window
+            entry.complete = False
+        entry.messages.append(message)
+
+    def touch(self, session_id: str, updated_at: str):
+        self.update_conversation(session_id, {"updated_at": updated_at})
+
+    def update_conversation(self, session_id: str, fields: Dict[str, Any]):
+        """Write-through for conversation field updates"""
+        entry = self._entries.get(session_id)
+        if entry is not None and entry.conversation is not None:
+            entry.conversation.update(fields)
+
+    async def record_write(self, session_id: str):
+        """Publish that this worker changed the session in Appwrite"""
+        if self.versions is None:
+            return
+        try:
+            previous, version = await sqlite_executor.run(self.versions.bump_session_version, session_id)
+        except sqlite3.Error as e:
+            # Other workers may serve this session stale until their entries expire
+            logger.warning(f"Could not publish session version: {str(e)}")
+            self.invalidate(session_id)
+            return
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            if entry.version == previous:
+                # Only our own write happened since the load, and it was applied here already
+                entry.version = version
+                entry.checked_at = time.monotonic()
+            else:
+                self.invalidate(session_id)
+
+    def invalidate(self, session_id: str):
+        self._entries.pop(session_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _lookup(self, session_id: str) -> Optional[_Entry]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if entry.expires_at <= now:
+            reason = "expired"
+        elif self._changed_elsewhere(session_id, entry, now):
+            reason = "stale"
+        else:
+            self._entries.move_to_end(session_id)
+            return entry
+        del self._entries[session_id]
+        self._evict(reason)
+        return None
+
+    def _changed_elsewhere(self, session_id: str, entry: _Entry, now: float) -> bool:
+        if self.versions is None or now - entry.checked_at < self.version_check_seconds:
+            return False
+        entry.checked_at = now
+        return entry.version != self.current_version(session_id)
+
+    def _entry_for_load(self, session_id: str, version: Optional[int] = None) -> _Entry:
+        entry = self._lookup(session_id)
+        if version is None:
+            version = entry.version if entry is not None else self.current_version(session_id)
+        if entry is not None and entry.version != version:
+            # Fetched before a write the entry already reflects: keep it at the older version so it is refetched
+            del self._entries[session_id]
+            entry = None
+        if entry is None:
+            now = time.monotonic()
+            # An entry loaded at an unknown version is checked again on its first lookup
+            entry = _Entry(now + self.ttl_seconds, version, now if version != _UNKNOWN_VERSION else float("-inf"))
+            self._entries[session_id] = entry
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+                self._evict("capacity")
+        return entry
+
+    def _hit(self):
+        self.hits += 1
+        _HITS.inc()
+
+    def _miss(self):
+        self.misses += 1
+        _MISSES.inc()
+
+    def _evict(self, reason: str):
+        self.evictions += 1
+        _EVICTIONS[reason].inc()
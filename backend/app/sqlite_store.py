@@ -0,0 +1,336 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    session_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS conversations_by_created ON conversations (created_at, session_id);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_session ON messages (session_id, seq);
+CREATE TABLE IF NOT EXISTS session_versions (
+    session_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    touched_at REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS session_versions_by_touched ON session_versions (touched_at);
+CREATE INDEX IF NOT EXISTS conversations_by_updated ON conversations (updated_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+class SqliteConversationStore:
+    """Conversation store in a SQLite database shared by every worker on the host.
+
+    Drop-in replacement for `LocalConversationStore` when uvicorn runs with
+    several worker processes: WAL mode lets readers proceed while one worker
+    writes, so a session sees the same history whichever worker serves it.
+    Reads are local indexed lookups and commits skip the fsync
+    (`synchronous=NORMAL`). Each thread gets its own connection.
+
+    It also keeps a per-session version counter that workers bump after
+    writing to Appwrite, which lets each worker's session cache detect
+    changes made by the others, and named leases that let one worker run a
+    background job for all of them. Writers can wait up to
+    `busy_timeout_seconds` for each other, so callers on an event loop run
+    them from a worker thread; version reads give up after
+    `read_timeout_seconds` instead.
+
+    Nothing is pruned as writes come in; the owner calls `prune` from a
+    background task to drop idle sessions and version counters.
+    """
+
+    def __init__(self, path: str, busy_timeout_seconds: float = 5.0, read_timeout_seconds: float = 0.05):
+        self.path = path
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self.read_timeout_seconds = read_timeout_seconds
+        self.pruned = 0
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get_conversation(session_id) is not None
+
+    def create_conversation(self, session_id: str) -> Dict[str, Any]:
+        """Return the conversation, creating it if needed"""
+        now = datetime.now().isoformat()
+        with self._write() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO conversations (session_id, created_at, updated_at) VALUES (?, ?, ?)",
+                (session_id, now, now)
+            )
+        return self.get_conversation(session_id)
+
+    def get_conversation(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._db().execute(
+            "SELECT created_at, updated_at, extra FROM conversations WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        conversation = {"session_id": session_id, "created_at": row[0], "updated_at": row[1]}
+        if row[2]:
+            conversation.update(json.loads(row[2]))
+        return conversation
+
+    def update_conversation(self, session_id: str, fields: Dict[str, Any]):
+        """Update conversation fields; timestamps are given as ISO strings"""
+        # The write lock is taken up front so another worker's update cannot interleave
+        with self._write() as db:
+            row = db.execute("SELECT extra FROM conversations WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return
+            extra = json.loads(row[0]) if row[0] else {}
+            extra.update({k: v for k, v in fields.items() if k not in ("session_id", "created_at", "updated_at")})
+            if "updated_at" in fields:
+                db.execute(
+                    "UPDATE conversations SET updated_at = ?, extra = ? WHERE session_id = ?",
+                    (fields["updated_at"], json.dumps(extra) if extra else None, session_id)
+                )
+            else:
+                db.execute(
+                    "UPDATE conversations SET extra = ? WHERE session_id = ?",
+                    (json.dumps(extra) if extra else None, session_id)
+                )
+
+    def add_message(self, message: Dict[str, Any]):
+        """Append a message dict (id, session_id, role, content, timestamp)"""
+        with self._write() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO conversations (session_id, created_at, updated_at) VALUES (?, ?, ?)",
+                (message["session_id"], message["timestamp"], message["timestamp"])
+            )
+            db.execute(
+                "INSERT OR IGNORE INTO messages (id, session_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (message["id"], message["session_id"], message["role"], message["content"], message["timestamp"])
+            )
+            db.execute(
+                "UPDATE conversations SET updated_at = ? WHERE session_id = ?",
+                (message["timestamp"], message["session_id"])
+            )
+
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return the newest `limit` messages (all when None) in chronological order"""
+        rows = self._db().execute(
+            "SELECT id, role, content, timestamp FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, limit or -1)
+        ).fetchall()
+        rows.reverse()
+        return [_message_dict(session_id, row) for row in rows]
+
+    def get_messages_page(self, session_id: str, limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Return up to `limit` messages after the `cursor` message ID"""
+        db = self._db()
+        after = 0
+        if cursor:
+            row = db.execute(
+                "SELECT seq FROM messages WHERE id = ? AND session_id = ?", (cursor, session_id)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Unknown cursor: {cursor}")
+            after = row[0]
+        # One extra row tells us whether another page exists
+        rows = db.execute(
+            "SELECT id, role, content, timestamp FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (session_id, after, limit + 1)
+        ).fetchall()
+        page = [_message_dict(session_id, row) for row in rows[:limit]]
+        return {"messages": page, "next_cursor": page[-1]["id"] if len(rows) > limit else None}
+
+    def list_conversations(self, limit: int, cursor: Optional[str] = None,
+                           updated_after: Optional[str] = None,
+                           updated_before: Optional[str] = None) -> Dict[str, Any]:
+        """Return up to `limit` conversations after the `cursor` session ID, oldest first"""
+        db = self._db()
+        where, params = [], []
+        if cursor:
+            row = db.execute("SELECT created_at FROM conversations WHERE session_id = ?", (cursor,)).fetchone()
+            if row is None:
+                raise ValueError(f"Unknown cursor: {cursor}")
+            where.append("(created_at, session_id) > (?, ?)")
+            params += [row[0], cursor]
+        if updated_after:
+            where.append("updated_at >= ?")
+            params.append(updated_after)
+        if updated_before:
+            where.append("updated_at < ?")
+            params.append(updated_before)
+        rows = db.execute(
+            "SELECT session_id, created_at, updated_at, extra FROM conversations"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY created_at, session_id LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        page = []
+        for row in rows[:limit]:
+            conversation = {"session_id": row[0], "created_at": row[1], "updated_at": row[2]}
+            if row[3]:
+                conversation.update(json.loads(row[3]))
+            page.append(conversation)
+        return {"conversations": page, "next_cursor": page[-1]["session_id"] if len(rows) > limit else None}
+
+    def session_version(self, session_id: str) -> int:
+        """Counter bumped whenever any worker changes the session upstream.
+
+        Raises sqlite3.OperationalError if the database stays locked for
+        longer than `read_timeout_seconds`.
+        """
+        row = self._reader().execute(
+            "SELECT version FROM session_versions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_session_version(self, session_id: str) -> Tuple[int, int]:
+        """Bump the session's counter; returns its value before and after"""
+        with self._write() as db:
+            row = db.execute("SELECT version FROM session_versions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is not None:
+                previous, version = row[0], row[0] + 1
+            else:
+                # Start above every pruned counter so a cache entry from before the prune cannot match again
+                floor = db.execute("SELECT value FROM counters WHERE name = 'pruned_version'").fetchone()
+                previous, version = 0, (floor[0] if floor else 0) + 1
+            db.execute(
+                "INSERT OR REPLACE INTO session_versions (session_id, version, touched_at) VALUES (?, ?, ?)",
+                (session_id, version, time.time())
+            )
+        return previous, version
+
+    def prune(self, idle_seconds: float, batch_size: int = 500) -> int:
+        """Delete up to `batch_size` sessions and version counters idle for `idle_seconds`; returns how many"""
+        cutoff = time.time() - idle_seconds
+        with self._write() as db:
+            sessions = [row[0] for row in db.execute(
+                "SELECT session_id FROM conversations WHERE updated_at < ? LIMIT ?",
+                (datetime.fromtimestamp(cutoff).isoformat(), batch_size)
+            )]
+            for session_id in sessions:
+                db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                db.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
+            versions = db.execute(
+                "SELECT session_id, version FROM session_versions WHERE touched_at < ? LIMIT ?",
+                (cutoff, batch_size)
+            ).fetchall()
+            if versions:
+                db.executemany("DELETE FROM session_versions WHERE session_id = ?", [(row[0],) for row in versions])
+                db.execute(
+                    "INSERT INTO counters (name, value) VALUES ('pruned_version', ?) "
+                    "ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)",
+                    (max(row[1] for row in versions),)
+                )
+        pruned = len(sessions) + len(versions)
+        self.pruned += pruned
+        return pruned
+
+    def acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        """Take or renew the named lease for `ttl_seconds`; False while another holder's lease is live"""
+        now = time.time()
+        with self._write() as db:
+            row = db.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at < ? RETURNING holder",
+                (name, holder, now + ttl_seconds, now)
+            ).fetchone()
+        return row is not None
+
+    def release_lease(self, name: str, holder: str):
+        with self._write() as db:
+            db.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def stats(self) -> Dict[str, Any]:
+        db = self._db()
+        return {
+            "sessions": len(self),
+            "messages": db.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+            "bytes_used": os.path.getsize(self.path),
+            "pruned": self.pruned,
+        }
+
+    def close(self):
+        """Close this thread's connections"""
+        for name in ("connection", "reader"):
+            connection = getattr(self._local, name, None)
+            if connection is not None:
+                connection.close()
+                setattr(self._local, name, None)
+
+    @contextmanager
+    def _write(self):
+        """Run the block as one write transaction"""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _db(self) -> sqlite3.Connection:
+        return self._thread_connection("connection", self.busy_timeout_seconds)
+
+    def _reader(self) -> sqlite3.Connection:
+        self._db()  # Sets up the file and schema
+        return self._thread_connection("reader", self.read_timeout_seconds)
+
+    def _thread_connection(self, name: str, timeout: float) -> sqlite3.Connection:
+        # Connections must not cross a fork or be shared by threads, so each gets its own
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.pid, local.connection, local.reader = os.getpid(), None, None
+        connection = getattr(local, name)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path,
+                timeout=timeout,
+                isolation_level=None,  # Autocommit; writes open their own transactions in _write()
+                check_same_thread=False
+            )
+            if name == "connection":
+                self._set_up(connection)
+            setattr(local, name, connection)
+        return connection
+
+    def _set_up(self, connection: sqlite3.Connection):
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(session_versions)")]
+        if columns and "touched_at" not in columns:
+            # Files created before versions were pruned
+            connection.execute("ALTER TABLE session_versions ADD COLUMN touched_at REAL NOT NULL DEFAULT 0")
+        connection.executescript(_SCHEMA)
+        logger.info(f"Opened SQLite conversation store at {self.path}")
+
+def _message_dict(session_id: str, row) -> Dict[str, Any]:
+    return {"id": row[0], "session_id": session_id, "role": row[1], "content": row[2], "timestamp": row[3]}
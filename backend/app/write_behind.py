@@ -0,0 +1,203 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+FlushCallback = Callable[[List[Dict[str, Any]], Dict[str, Dict[str, Any]]], Awaitable[None]]
+DeadLetterCallback = Callable[[List[Dict[str, Any]], Dict[str, Dict[str, Any]], str], Awaitable[None]]
+
+class PartialFlush(Exception):
+    """Raised by a flush callback when only part of the batch needs another attempt; the rest was handled"""
+
+    def __init__(self, messages: List[Dict[str, Any]], updates: Dict[str, Dict[str, Any]], error: Exception):
+        super().__init__(str(error))
+        self.messages = messages
+        self.updates = updates
+
+class WriteBehindQueue:
+    """Buffers message writes and conversation updates off the request path.
+
+    Messages are kept per session in arrival order and conversation field
+    updates (timestamp bumps, summaries) are merged into one update per session. The buffer is flushed in one
+    batch when it reaches `batch_size` entries or every `flush_interval`
+    seconds, whichever comes first. Until a write is confirmed it stays
+    visible through `pending_messages`, so readers of the same session always
+    see their own writes.
+
+    A failed flush is retried, but each message and conversation update gets
+    at most `max_attempts`; after that, and for whatever is still queued on
+    `close()`, it is handed to `dead_letter` so one bad write cannot hold up
+    the queue forever.
+    """
+
+    def __init__(self, flush_callback: FlushCallback, batch_size: int = 50,
+                 flush_interval: float = 0.5, max_pending: int = 5000,
+                 max_attempts: int = 5, dead_letter: Optional[DeadLetterCallback] = None):
+        self._flush_callback = flush_callback
+        self._dead_letter = dead_letter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._attempts: Dict[str, int] = {}
+        self._messages: Dict[str, List[Dict[str, Any]]] = {}
+        self._conversation_updates: Dict[str, Dict[str, Any]] = {}
+        self._in_flight: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending_count = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Future] = None
+        self.flushes = 0
+        self.flush_errors = 0
+        self.dead_lettered = 0
+
+    @property
+    def pending_count(self) -> int:
+        return self._pending_count + sum(len(m) for m in self._in_flight.values())
+
+    async def add_message(self, session_id: str, message: Dict[str, Any], updated_at: str):
+        """Queue a message document and bump the conversation timestamp"""
+        self._messages.setdefault(session_id, []).append(message)
+        self._pending_count += 1
+        self.touch(session_id, updated_at)
+        if self._pending_count >= self.max_pending:
+            # Upstream is not keeping up; apply backpressure instead of growing without bound
+            await self.flush()
+        elif self._pending_count >= self.batch_size:
+            self._schedule_flush()
+
+    def touch(self, session_id: str, updated_at: str):
+        """Record the latest conversation timestamp, replacing any queued bump"""
+        self.update_conversation(session_id, {"updated_at": updated_at})
+
+    def update_conversation(self, session_id: str, fields: Dict[str, Any]):
+        """Queue conversation field updates, merged with any already queued for the session"""
+        self._conversation_updates.setdefault(session_id, {}).update(fields)
+        self._ensure_timer()
+
+    def pending_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """Messages for a session that may not be readable from Appwrite yet"""
+        return self._in_flight.get(session_id, []) + self._messages.get(session_id, [])
+
+    def pending_conversation_fields(self, session_id: str) -> Dict[str, Any]:
+        return self._conversation_updates.get(session_id, {})
+
+    async def flush(self):
+        """Write everything queued so far in a single batch"""
+        # Flushes run one at a time so in-flight writes retire in order
+        while self._flushing is not None:
+            await asyncio.shield(self._flushing)
+        if not self._messages and not self._conversation_updates:
+            return
+        self._flushing = asyncio.get_running_loop().create_future()
+        try:
+            await self._flush_batch()
+        finally:
+            self._flushing.set_result(None)
+            self._flushing = None
+
+    async def _flush_batch(self):
+        messages_by_session, self._messages = self._messages, {}
+        updates, self._conversation_updates = self._conversation_updates, {}
+        self._pending_count = 0
+        for session_id, messages in messages_by_session.items():
+            self._in_flight.setdefault(session_id, []).extend(messages)
+
+        batch = [m for messages in messages_by_session.values() for m in messages]
+        try:
+            await self._flush_callback(batch, updates)
+            self.flushes += 1
+            self._forget(batch, updates)
+        except Exception as e:
+            self.flush_errors += 1
+            if isinstance(e, PartialFlush):
+                retry, retry_updates = e.messages, e.updates
+                retry_ids = {m["id"] for m in retry}
+                self._forget([m for m in batch if m["id"] not in retry_ids],
+                             {s: f for s, f in updates.items() if s not in retry_updates})
+            else:
+                retry, retry_updates = batch, updates
+            logger.error(f"Write-behind flush of {len(batch)} messages failed, "
+                         f"will retry {len(retry)}: {str(e)}")
+            await self._requeue(retry, retry_updates)
+        finally:
+            for session_id, messages in messages_by_session.items():
+                in_flight = self._in_flight.get(session_id, [])
+                del in_flight[:len(messages)]
+                if not in_flight:
+                    self._in_flight.pop(session_id, None)
+
+    async def _requeue(self, messages: List[Dict[str, Any]], updates: Dict[str, Dict[str, Any]]):
+        """Queue a failed batch again, ahead of anything that arrived meanwhile, within the attempt limit"""
+        exhausted, exhausted_updates = [], {}
+        retry_by_session: Dict[str, List[Dict[str, Any]]] = {}
+        for message in messages:
+            attempts = self._attempts.get(message["id"], 0) + 1
+            self._attempts[message["id"]] = attempts
+            if attempts >= self.max_attempts:
+                exhausted.append(message)
+            else:
+                retry_by_session.setdefault(message["session_id"], []).append(message)
+        for session_id, retry in retry_by_session.items():
+            self._messages[session_id] = retry + self._messages.get(session_id, [])
+            self._pending_count += len(retry)
+        for session_id, fields in updates.items():
+            key = f"conversation:{session_id}"
+            attempts = self._attempts.get(key, 0) + 1
+            self._attempts[key] = attempts
+            if attempts >= self.max_attempts:
+                exhausted_updates[session_id] = fields
+                continue
+            # Fields queued since the failed attempt are newer and win
+            self._conversation_updates[session_id] = {**fields, **self._conversation_updates.get(session_id, {})}
+        if exhausted or exhausted_updates:
+            self._forget(exhausted, exhausted_updates)
+            await self._give_up(exhausted, exhausted_updates, "exhausted")
+
+    def _forget(self, messages: List[Dict[str, Any]], updates: Dict[str, Dict[str, Any]]):
+        for message in messages:
+            self._attempts.pop(message["id"], None)
+        for session_id in updates:
+            self._attempts.pop(f"conversation:{session_id}", None)
+
+    async def _give_up(self, messages: List[Dict[str, Any]], updates: Dict[str, Dict[str, Any]], reason: str):
+        self.dead_lettered += len(messages)
+        logger.error(f"Write-behind gave up on {len(messages)} messages and "
+                     f"{len(updates)} conversation updates ({reason})")
+        if self._dead_letter is not None:
+            await self._dead_letter(messages, updates, reason)
+
+    async def close(self):
+        """Stop the flush timer and drain everything that is still queued"""
+        if self._timer is not None and self._timer_loop is asyncio.get_running_loop():
+            self._timer.cancel()
+        self._timer = None
+        self._timer_loop = None
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self.flush()
+        if self._messages or self._conversation_updates:
+            # The last attempt failed; hand the rest over rather than lose it
+            messages = [m for queued in self._messages.values() for m in queued]
+            updates = self._conversation_updates
+            self._messages, self._conversation_updates, self._pending_count = {}, {}, 0
+            self._forget(messages, updates)
+            await self._give_up(messages, updates, "shutdown")
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    def _ensure_timer(self):
+        # The timer is bound to the loop it was started on, so restart it if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._timer is None or self._timer.done() or self._timer_loop is not loop:
+            self._timer = loop.create_task(self._run_timer())
+            self._timer_loop = loop
+
+    async def _run_timer(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
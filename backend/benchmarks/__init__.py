@@ -0,0 +1 @@
+# Empty __init__.py files to make directories Python packages
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""Compare the SDK's per-call HTTP handling with the pooled keep-alive transport.
+
+Starts the fake Appwrite server from `benchmarks.fake_servers` and sends the
+same document calls from a pool of threads through the stock
+`appwrite.client.Client` (a new connection per call) and through
+`PooledClient`, reporting per-call latency, throughput and how many
+connections each opened. Over loopback this only shows the TCP setup cost;
+against Appwrite Cloud every new connection also pays a TLS handshake.
+
+    python -m benchmarks.bench_appwrite_transport
+    python -m benchmarks.bench_appwrite_transport --threads 32 --calls 5000
+"""
+from appwrite.client import Client
+from appwrite.query import Query
+from appwrite.services.databases import Databases
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from app.http_pool import HttpPool, PooledClient
+from benchmarks.load_test import BACKEND_DIR, free_port, wait_until_up
+
+
+def run_calls(client: Client, calls: int, threads: int) -> dict:
+    databases = Databases(client)
+    latencies = []
+
+    def call(i: int):
+        start = time.perf_counter()
+        if i % 4 == 0:
+            databases.create_document("main", "messages", uuid.uuid4().hex, {"session_id": f"s{i % 50}", "content": "hi"})
+        else:
+            databases.list_documents("main", "messages", [Query.equal("session_id", [f"s{i % 50}"]), Query.limit(20)])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(call, range(calls)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "calls_per_second": round(calls / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def main(args):
+    port = free_port()
+    fakes = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_servers", "--gemini-port", str(free_port()),
+        "--appwrite-port", str(port), "--appwrite-latency", str(args.latency), "--appwrite-jitter", "0",
+    ], cwd=BACKEND_DIR)
+    endpoint = f"http://127.0.0.1:{port}"
+    try:
+        await wait_until_up(endpoint + "/__stats", fakes)
+        results = {}
+        for mode in ("sdk", "pooled"):
+            pool = None
+            if mode == "pooled":
+                pool = HttpPool("bench", pool_size=args.threads, timeout=10)
+                client = PooledClient(pool)
+            else:
+                client = Client()
+            client.set_endpoint(endpoint + "/v1").set_project("bench").set_key("bench")
+            run_calls(client, args.calls // 10, args.threads)  # Warm up
+            results[mode] = await asyncio.to_thread(run_calls, client, args.calls, args.threads)
+            if pool is not None:
+                results[mode]["connections_opened"] = pool.connections_opened()
+                pool.close()
+    finally:
+        fakes.terminate()
+        fakes.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake server latency per call in seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+"""Measure /api/chat throughput as the number of in-flight requests grows.
+
+Runs the real FastAPI app in-process against the fake Gemini model and fake
+Appwrite databases from `benchmarks.fakes`. With the blocking SDK calls moved
+into the worker pools, throughput should scale with concurrency until the pool
+size is reached; `--inline` runs the same calls directly on the event loop to
+show the old, flat behaviour. Event-loop lag is reported alongside, since a
+blocked loop also stalls health checks on the same worker.
+
+    python -m benchmarks.bench_concurrency
+    python -m benchmarks.bench_concurrency --inline --requests 64
+"""
+from httpx import AsyncClient, ASGITransport
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from app.main import app
+from app.appwrite_service import appwrite_service
+from app.gemini_service import gemini_service
+from app.executor import BlockingExecutor
+from benchmarks.fakes import FakeDatabases, FakeGenerativeModel
+
+
+def install_fakes(llm_latency: float, db_latency: float):
+    gemini_service.model = FakeGenerativeModel(latency=llm_latency)
+    gemini_service.use_mock = False
+    appwrite_service.databases = FakeDatabases(latency=db_latency)
+    appwrite_service.use_mock = False
+    # Answers cached by an earlier run would skip the model entirely
+    gemini_service.response_cache.clear()
+
+
+def run_inline():
+    """Restore the pre-pool behaviour: call the SDK directly on the event loop"""
+    async def run(self, func, *args, timeout=None, **kwargs):
+        return func(*args, **kwargs)
+    BlockingExecutor.run = run
+
+
+async def run_level(client: AsyncClient, concurrency: int, total: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    # Unique per level so no answer comes from the response cache
+    run_id = uuid.uuid4().hex[:8]
+    latencies = []
+    loop_lags = []
+    done = False
+
+    async def one_turn(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/chat", json={
+                "message": f"Where is my order #{concurrency}-{i}-{run_id}?",
+                "session_id": str(uuid.uuid4())
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    async def watch_loop():
+        # Any delay beyond the 10ms tick is time the loop spent blocked
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            loop_lags.append(time.perf_counter() - start - 0.01)
+
+    watcher = asyncio.create_task(watch_loop())
+    start = time.perf_counter()
+    await asyncio.gather(*(one_turn(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    done = True
+    await watcher
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 1),
+        "chat_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "loop_lag_max_ms": round(max(loop_lags) * 1000, 1) if loop_lags else None,
+    }
+
+
+async def main(args):
+    install_fakes(args.llm_latency, args.db_latency)
+    if args.inline:
+        run_inline()
+    results = []
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        for concurrency in args.concurrency:
+            results.append(await run_level(client, concurrency, args.requests))
+    if args.json:
+        print(json.dumps({"mode": "inline" if args.inline else "pool", "results": results}, indent=2))
+        return
+    print(f"mode={'inline' if args.inline else 'pool'} llm={args.llm_latency * 1000:.0f}ms db={args.db_latency * 1000:.0f}ms")
+    print(f"{'in-flight':>9} {'rps':>8} {'chat p50':>10} {'loop lag max':>13}")
+    for row in results:
+        print(f"{row['concurrency']:>9} {row['rps']:>8} {row['chat_p50_ms']:>8}ms {row['loop_lag_max_ms']:>11}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--inline", action="store_true", help="call the SDKs on the event loop (old behaviour)")
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    asyncio.run(main(parser.parse_args()))
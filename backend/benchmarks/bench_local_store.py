@@ -0,0 +1,104 @@
+"""Compare the memory footprint of the local conversation store with plain dicts.
+
+Each layout is filled in a fresh subprocess and measured by its peak RSS
+growth. The "dict" row reproduces the original mock_data layout: one dict
+per message holding a UUID string and an ISO timestamp string.
+
+    python -m benchmarks.bench_local_store --sessions 100000 --messages 4
+"""
+from datetime import datetime
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import uuid
+
+from app.local_store import LocalConversationStore
+
+
+def make_messages(session_id: str, count: int):
+    for i in range(count):
+        yield {
+            "id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Message {i} about order {session_id[:8]}",
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+def fill_dicts(session_ids, messages_per_session: int):
+    data = {}
+    for session_id in session_ids:
+        now = datetime.now().isoformat()
+        data[session_id] = {
+            "conversation": {"session_id": session_id, "created_at": now, "updated_at": now},
+            "messages": list(make_messages(session_id, messages_per_session))
+        }
+    return data
+
+
+def fill_store(session_ids, messages_per_session: int, max_mb: int):
+    store = LocalConversationStore(max_bytes=max_mb * 1024 * 1024)
+    for session_id in session_ids:
+        store.create_conversation(session_id)
+        for message in make_messages(session_id, messages_per_session):
+            store.add_message(message)
+    return store
+
+
+def measure_in_process(args) -> dict:
+    session_ids = [str(uuid.uuid4()) for _ in range(args.sessions)]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if args.layout == "dict":
+        result = fill_dicts(session_ids, args.messages)
+    else:
+        result = fill_store(session_ids, args.messages, args.cap_mb)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    row = {"mb": round((peak - baseline) / 1024, 1), "fill_seconds": round(elapsed, 2)}
+    if args.layout == "store":
+        row.update(result.stats())
+    return row
+
+
+def measure(layout: str, args, cap_mb: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_local_store", "--layout", layout,
+         "--sessions", str(args.sessions), "--messages", str(args.messages), "--cap-mb", str(cap_mb)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+
+def main(args):
+    if args.layout:
+        print(json.dumps(measure_in_process(args)))
+        return
+    results = {
+        "sessions": args.sessions,
+        "messages_per_session": args.messages,
+        "dict": measure("dict", args, 0),
+        "store": measure("store", args, 1024 * 1024),
+        "store_capped": dict(measure("store", args, args.cap_mb), cap_mb=args.cap_mb),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.sessions} sessions x {args.messages} messages (peak RSS growth)")
+    for name in ("dict", "store", "store_capped"):
+        row = results[name]
+        print(f"{name:>13}: {row['mb']:>8} MB  fill {row['fill_seconds']}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=4)
+    parser.add_argument("--cap-mb", type=int, default=32, help="memory cap for the capped run")
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    parser.add_argument("--layout", choices=["dict", "store"], help=argparse.SUPPRESS)
+    main(parser.parse_args())
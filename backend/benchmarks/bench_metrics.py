@@ -0,0 +1,104 @@
+"""Measure the cost of the metrics instrumentation per update and per chat turn.
+
+    python -m benchmarks.bench_metrics --rounds 7
+"""
+from httpx import AsyncClient, ASGITransport
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from app.main import app
+from app.appwrite_service import appwrite_service
+from app.metrics import CHAT_STAGE_SECONDS, registry, timed
+from benchmarks.bench_concurrency import install_fakes
+
+
+def per_update_ns(iterations: int) -> dict:
+    child = CHAT_STAGE_SECONDS.labels("bench", "noop")
+    start = time.perf_counter()
+    for _ in range(iterations):
+        CHAT_STAGE_SECONDS.labels("bench", "noop").observe(0.003)
+    observe = (time.perf_counter() - start) / iterations
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with timed(child):
+            pass
+    block = (time.perf_counter() - start) / iterations
+    return {"observe_ns": round(observe * 1e9), "timed_block_ns": round(block * 1e9)}
+
+
+def total_updates() -> int:
+    """Histogram observations plus counter increments recorded so far"""
+    total = 0
+    for metric in registry._metrics:
+        for child in metric._children.values():
+            if metric.kind == "histogram":
+                total += child.count
+            elif metric.kind == "counter":
+                total += int(child.value)
+    return total
+
+
+async def turns_per_second(client: AsyncClient, turns: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_turn(i: int):
+        async with semaphore:
+            response = await client.post("/api/chat", json={
+                "message": f"Question {i}",
+                "session_id": str(uuid.uuid4())
+            })
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_turn(i) for i in range(turns)))
+    return turns / (time.perf_counter() - start)
+
+
+async def main(args):
+    # Zero upstream latency so the instrumentation is as large a share of each turn as possible
+    install_fakes(0.0, 0.0)
+    rates = {True: [], False: []}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        before = total_updates()
+        await turns_per_second(client, args.turns, args.concurrency)  # Warm up and count updates
+        updates_per_turn = (total_updates() - before) / args.turns
+        # Alternate so drift in machine load affects both settings equally
+        for _ in range(args.rounds):
+            for enabled in (True, False):
+                registry.enabled = enabled
+                rates[enabled].append(await turns_per_second(client, args.turns, args.concurrency))
+    registry.enabled = True
+    await appwrite_service.close()
+
+    on, off = statistics.median(rates[True]), statistics.median(rates[False])
+    costs = per_update_ns(args.iterations)
+    # End-to-end rates are noisy at this scale, so also derive the overhead from the update cost
+    estimated = updates_per_turn * costs["timed_block_ns"] / (1e9 / on) * 100
+    result = {
+        **costs,
+        "updates_per_turn": round(updates_per_turn, 1),
+        "turns_per_second_metrics_on": round(on, 1),
+        "turns_per_second_metrics_off": round(off, 1),
+        "measured_overhead_pct": round((off - on) / off * 100, 2),
+        "estimated_overhead_pct": round(estimated, 3),
+        "metrics_body_bytes": len(registry.render()),
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f"{key:>30}: {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,86 @@
+"""Report /api/chat latency with and without the write-behind pipeline.
+
+Each run replays multi-turn sessions against a fake Appwrite with a fixed
+per-call latency, so the difference between the two rows is the persistence
+work taken off the request path.
+
+    python -m benchmarks.bench_persistence --db-latency 0.02
+"""
+from httpx import AsyncClient, ASGITransport
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from app.config import settings
+from app.main import app
+from app.appwrite_service import appwrite_service
+from app.write_behind import WriteBehindQueue
+from benchmarks.bench_concurrency import install_fakes
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(write_behind: bool, args) -> dict:
+    install_fakes(args.llm_latency, args.db_latency)
+    appwrite_service.write_behind = WriteBehindQueue(
+        appwrite_service._flush_writes,
+        batch_size=settings.appwrite_flush_batch_size,
+        flush_interval=settings.appwrite_flush_interval_seconds
+    ) if write_behind else None
+    databases = appwrite_service.databases
+    latencies = []
+
+    async def session(client: AsyncClient):
+        session_id = str(uuid.uuid4())
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            response = await client.post("/api/chat", json={
+                "message": f"Follow-up question number {turn}",
+                "session_id": session_id
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*(session(client) for _ in range(args.sessions)))
+    calls_on_path = databases.total_calls()
+    await appwrite_service.close()
+
+    turns = args.sessions * args.turns
+    return {
+        "write_behind": write_behind,
+        "turns": turns,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "appwrite_calls_per_turn": round(calls_on_path / turns, 2),
+        "appwrite_calls_after_flush": round(databases.total_calls() / turns, 2),
+    }
+
+
+async def main(args):
+    results = [await run(False, args), await run(True, args)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"db={args.db_latency * 1000:.0f}ms llm={args.llm_latency * 1000:.0f}ms "
+          f"sessions={args.sessions} turns={args.turns}")
+    print(f"{'write-behind':>12} {'p50':>9} {'p99':>9} {'calls/turn':>11} {'after flush':>12}")
+    for row in results:
+        print(f"{str(row['write_behind']):>12} {row['p50_ms']:>7}ms {row['p99_ms']:>7}ms "
+              f"{row['appwrite_calls_per_turn']:>11} {row['appwrite_calls_after_flush']:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    asyncio.run(main(parser.parse_args()))
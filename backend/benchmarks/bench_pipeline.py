@@ -0,0 +1,88 @@
+"""Report where a /api/chat turn spends its time, stage by stage.
+
+Replays multi-turn sessions against the fake Gemini model and a fake Appwrite
+with a fixed per-call latency, and prints end-to-end latency next to the mean
+of each `chat_stage_seconds` stage. `context_ready` is the time from the
+start of the turn until generation can begin; with the storage stages run
+sequentially it is roughly their sum. The session cache is off by default,
+as when a session's turns land on different workers; `--session-cache`
+turns it on.
+
+    python -m benchmarks.bench_pipeline --db-latency 0.02
+    python -m benchmarks.bench_pipeline --no-write-behind
+"""
+from httpx import AsyncClient, ASGITransport
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from app.main import app
+from app.appwrite_service import appwrite_service
+from app.metrics import CHAT_STAGE_SECONDS
+from app.session_cache import SessionCache
+from benchmarks.bench_concurrency import install_fakes
+from benchmarks.bench_persistence import percentile
+
+STAGES = ("create_conversation", "fetch_history", "plan_context", "save_user_message",
+          "context_ready", "generate", "save_assistant_message")
+
+
+def stage_totals():
+    totals = {}
+    for stage in STAGES:
+        child = CHAT_STAGE_SECONDS.labels("chat", stage)
+        totals[stage] = (child.sum, child.count)
+    return totals
+
+
+async def main(args):
+    install_fakes(args.llm_latency, args.db_latency)
+    if not args.session_cache:
+        appwrite_service.session_cache = SessionCache(max_sessions=0)
+    if args.no_write_behind:
+        appwrite_service.write_behind = None
+    latencies = []
+
+    async def session(client: AsyncClient):
+        session_id = str(uuid.uuid4())
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            response = await client.post("/api/chat", json={
+                "message": f"Follow-up question number {turn}",
+                "session_id": session_id
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    before = stage_totals()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*(session(client) for _ in range(args.sessions)))
+    after = stage_totals()
+    await appwrite_service.close()
+
+    stages = {}
+    for stage in STAGES:
+        total, count = after[stage][0] - before[stage][0], after[stage][1] - before[stage][1]
+        if count:
+            stages[stage] = round(total / count * 1000, 1)
+    result = {
+        "turns": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "stage_mean_ms": stages,
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--session-cache", action="store_true", help="keep hot sessions in memory")
+    parser.add_argument("--no-write-behind", action="store_true", help="write messages on the request path")
+    asyncio.run(main(parser.parse_args()))
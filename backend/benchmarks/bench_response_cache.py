@@ -0,0 +1,119 @@
+"""Replay a first-turn FAQ trace through /api/chat without caching, with coalescing only and with the cache.
+
+    python -m benchmarks.bench_response_cache --requests 2000 --concurrency 32
+"""
+from httpx import AsyncClient, ASGITransport
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+
+from app.main import app
+from app.appwrite_service import appwrite_service
+from app.gemini_service import gemini_service
+from app.response_cache import ResponseCache
+from benchmarks.bench_concurrency import install_fakes
+from benchmarks.bench_persistence import percentile
+
+FAQS = [
+    "Where is my order?",
+    "How do I reset my password?",
+    "Can I change my shipping address?",
+    "What is your refund policy?",
+    "How do I cancel my subscription?",
+    "My payment was declined",
+    "How long does delivery take?",
+    "Do you ship internationally?",
+    "How do I update my billing details?",
+    "I was charged twice",
+]
+
+
+class UncachedResponses(ResponseCache):
+    """Baseline: every request makes its own upstream call"""
+
+    async def get_or_compute(self, key, compute):
+        self.misses += 1
+        return await compute()
+
+
+def build_trace(requests: int, unique_fraction: float, seed: int):
+    """FAQs drawn with a Zipf-like skew in varied casing/punctuation, mixed with one-off questions"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(FAQS))]
+    trace = []
+    for i in range(requests):
+        if rng.random() < unique_fraction:
+            trace.append(f"I have a question about invoice {i}")
+            continue
+        text = rng.choices(FAQS, weights)[0]
+        variant = rng.randrange(3)
+        if variant == 1:
+            text = text.lower().rstrip("?")
+        elif variant == 2:
+            text = f"  {text.upper()} "
+        trace.append(text)
+    return trace
+
+
+async def run(mode: str, trace, args) -> dict:
+    install_fakes(args.llm_latency, args.db_latency)
+    if mode == "off":
+        gemini_service.response_cache = UncachedResponses(max_entries=0)
+    else:
+        # With no entries kept only concurrent duplicates are coalesced
+        gemini_service.response_cache = ResponseCache(max_entries=args.cache_size if mode == "cache" else 0)
+    model = gemini_service.model
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one_turn(client: AsyncClient, text: str):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/chat", json={"message": text, "session_id": str(uuid.uuid4())})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*(one_turn(client, text) for text in trace))
+    elapsed = time.perf_counter() - start
+    await appwrite_service.close()
+
+    return {
+        "mode": mode,
+        "requests": len(trace),
+        "rps": round(len(trace) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "gemini_calls": model.calls,
+        "cache_stats": gemini_service.response_cache.stats(),
+    }
+
+
+async def main(args):
+    trace = build_trace(args.requests, args.unique_fraction, args.seed)
+    results = [await run(mode, trace, args) for mode in ("off", "coalesce", "cache")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':>8} {'rps':>8} {'p50':>9} {'p99':>9} {'gemini calls':>13} {'hit rate':>9}")
+    for row in results:
+        print(f"{row['mode']:>8} {row['rps']:>8} {row['p50_ms']:>7}ms {row['p99_ms']:>7}ms "
+              f"{row['gemini_calls']:>13} {row['cache_stats']['hit_rate']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--unique-fraction", type=float, default=0.2, help="share of one-off questions")
+    parser.add_argument("--cache-size", type=int, default=1000)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    asyncio.run(main(parser.parse_args()))
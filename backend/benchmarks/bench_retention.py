@@ -0,0 +1,100 @@
+"""Measure chat latency while the retention job compacts a large messages collection.
+
+Seeds the fake Appwrite with `--sessions` old conversations of `--messages`
+messages each, then drives multi-turn chat sessions for `--duration` seconds
+with the job off, paced at `--rate` calls per second, and unpaced. Reports
+chat p50/p99, how many messages the job archived and how many remain in the
+messages collection.
+
+    python -m benchmarks.bench_retention
+    python -m benchmarks.bench_retention --rate 20 --duration 20
+"""
+from httpx import AsyncClient, ASGITransport
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from app.main import app
+from app.appwrite_service import appwrite_service
+from app.retention import RetentionJob
+from benchmarks.bench_concurrency import install_fakes
+from benchmarks.bench_persistence import percentile
+
+
+def seed(sessions: int, messages: int):
+    databases = appwrite_service.databases
+    conversations, stored = databases._collection("conversations"), databases._collection("messages")
+    for s in range(sessions):
+        session_id = f"old-{s}"
+        conversations[session_id] = {"$id": session_id, "session_id": session_id,
+                                     "created_at": "2023-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00"}
+        for m in range(messages):
+            message_id = f"{session_id}-{m}"
+            stored[message_id] = {"$id": message_id, "id": message_id, "session_id": session_id,
+                                  "role": "user" if m % 2 == 0 else "assistant",
+                                  "content": f"Old message {m} " * 10,
+                                  "timestamp": f"2023-01-01T{m // 60:02d}:{m % 60:02d}:00"}
+
+
+async def run_mode(args, rate):
+    install_fakes(args.llm_latency, args.db_latency)
+    seed(args.sessions, args.messages)
+    job = None
+    if rate is not None:
+        # Sessions are old but not idle long enough to be deleted
+        job = RetentionJob(session_inactive_days=3650, sessions_per_run=10, interval_seconds=0, calls_per_second=rate)
+    latencies = []
+    done = False
+
+    async def session(client: AsyncClient):
+        session_id = str(uuid.uuid4())
+        turn = 0
+        while not done:
+            start = time.perf_counter()
+            response = await client.post("/api/chat", json={
+                "message": f"Follow-up question number {turn}",
+                "session_id": session_id
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+            turn += 1
+
+    if job is not None:
+        job.start()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        tasks = [asyncio.ensure_future(session(client)) for _ in range(args.concurrency)]
+        await asyncio.sleep(args.duration)
+        done = True
+        await asyncio.gather(*tasks)
+    if job is not None:
+        await job.stop()
+    await appwrite_service.close()
+    return {
+        "turns": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "archived_messages": job.archived_messages if job else 0,
+        "messages_left": len(appwrite_service.databases._collection("messages")),
+    }
+
+
+async def main(args):
+    results = {}
+    for name, rate in (("off", None), ("paced", args.rate), ("unpaced", 10000.0)):
+        results[name] = await run_mode(args, rate)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rate", type=float, default=5.0, help="retention job Appwrite calls per second")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,112 @@
+"""Measure knowledge-base indexing time and search latency/recall at 100k chunks.
+
+    python -m benchmarks.bench_retrieval --chunks 100000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from app.knowledge_base import KnowledgeBase
+from benchmarks.bench_persistence import percentile
+
+def write_corpus(docs_dir: str, chunks: int, files: int, topics: int, seed: int):
+    """Synthetic support articles: each paragraph (one chunk) mostly uses its topic's vocabulary"""
+    rng = random.Random(seed)
+    syllables = [a + b for a in "bcdfghklmnprstvz" for b in ("a", "e", "i", "o", "u", "an", "or")]
+    common = [rng.choice(syllables) + rng.choice(syllables) for _ in range(300)]
+    vocabularies = [[rng.choice(syllables) + rng.choice(syllables) + rng.choice(syllables) for _ in range(80)]
+                    for _ in range(topics)]
+    per_file = chunks // files
+    paragraphs = []
+    for i in range(files):
+        body = []
+        for _ in range(per_file):
+            vocabulary = vocabularies[rng.randrange(topics)]
+            text = " ".join(rng.choice(vocabulary) if rng.random() < 0.7 else rng.choice(common)
+                            for _ in range(rng.randint(60, 80)))
+            body.append(text.capitalize() + ".")
+            paragraphs.append(text)
+        with open(os.path.join(docs_dir, f"article_{i:05d}.md"), "w") as f:
+            f.write("\n\n".join(body))
+    return paragraphs
+
+
+def timed_searches(knowledge_base: KnowledgeBase, queries, top_k: int):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(knowledge_base.search(query, top_k))
+        latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as docs_dir:
+        paragraphs = write_corpus(docs_dir, args.chunks, args.files, args.topics, args.seed)
+        knowledge_base = KnowledgeBase(docs_dir)
+
+        start = time.perf_counter()
+        knowledge_base.sync()
+        build_seconds = time.perf_counter() - start
+
+        # Edit one article and re-sync: only that file is re-embedded
+        with open(os.path.join(docs_dir, "article_00000.md"), "a") as f:
+            f.write("\n\nRefunds for digital goods are processed within five business days.")
+        start = time.perf_counter()
+        changes = knowledge_base.sync()
+        incremental_seconds = time.perf_counter() - start
+
+        rng = random.Random(args.seed + 1)
+        sources = [rng.choice(paragraphs) for _ in range(args.queries)]
+        queries = [" ".join(source.split()[:8]) for source in sources]
+        latencies, results = timed_searches(knowledge_base, queries, args.top_k)
+        cached_latencies, _ = timed_searches(knowledge_base, queries, args.top_k)
+
+        # Baseline: score every chunk on every dimension
+        dense_latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            scores = knowledge_base._embed_query(query) @ knowledge_base._vectors
+            np.argpartition(-scores, args.top_k - 1)[:args.top_k]
+            dense_latencies.append(time.perf_counter() - start)
+
+        # How often the paragraph a query was taken from is retrieved
+        hit_rate = statistics.mean(
+            any(r["text"].lower().rstrip(".") == source for r in found)
+            for found, source in zip(results, sources)
+        )
+        result = {
+            "chunks": len(knowledge_base),
+            "index_mb": round(os.path.getsize(knowledge_base._vectors_path) / 2 ** 20, 1),
+            "build_seconds": round(build_seconds, 2),
+            "incremental_seconds": round(incremental_seconds, 2),
+            "incremental_changes": changes,
+            "dense_scan_p50_ms": round(statistics.median(dense_latencies) * 1000, 2),
+            "search_p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "search_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "cached_query_p50_ms": round(statistics.median(cached_latencies) * 1000, 2),
+            "source_hit_rate": round(hit_rate, 3),
+        }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f"{key:>22}: {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    main(parser.parse_args())
@@ -0,0 +1,73 @@
+"""Report /api/chat read latency and Appwrite reads with the session cache on and off.
+
+    python -m benchmarks.bench_session_cache --db-latency 0.02
+"""
+from httpx import AsyncClient, ASGITransport
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from app.main import app
+from app.appwrite_service import appwrite_service
+from app.session_cache import SessionCache
+from benchmarks.bench_concurrency import install_fakes
+from benchmarks.bench_persistence import percentile
+
+READ_METHODS = ("get_document", "list_documents")
+
+
+async def run(cache_size: int, args) -> dict:
+    install_fakes(args.llm_latency, args.db_latency)
+    appwrite_service.session_cache = SessionCache(max_sessions=cache_size)
+    databases = appwrite_service.databases
+    latencies = []
+
+    async def session(client: AsyncClient):
+        session_id = str(uuid.uuid4())
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            response = await client.post("/api/chat", json={
+                "message": f"Follow-up question number {turn}",
+                "session_id": session_id
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*(session(client) for _ in range(args.sessions)))
+    await appwrite_service.close()
+
+    turns = args.sessions * args.turns
+    reads = sum(databases.calls.get(method, 0) for method in READ_METHODS)
+    return {
+        "cache": cache_size > 0,
+        "turns": turns,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "appwrite_reads_per_turn": round(reads / turns, 2),
+        "cache_stats": appwrite_service.session_cache.stats(),
+    }
+
+
+async def main(args):
+    results = [await run(0, args), await run(10000, args)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'cache':>6} {'p50':>9} {'p99':>9} {'reads/turn':>11} {'hit rate':>9}")
+    for row in results:
+        print(f"{str(row['cache']):>6} {row['p50_ms']:>7}ms {row['p99_ms']:>7}ms "
+              f"{row['appwrite_reads_per_turn']:>11} {row['cache_stats']['hit_rate']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    asyncio.run(main(parser.parse_args()))
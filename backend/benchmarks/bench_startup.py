@@ -0,0 +1,104 @@
+"""Measure how long a fresh worker takes to import, accept connections and answer a chat.
+
+Each run starts a new process so nothing is cached in memory. The app is
+configured with real-looking keys and pointed at the fakes from
+`benchmarks.fake_servers`, so SDK imports and client set-up are included:
+
+- `import_s`: importing `app.main` in a fresh interpreter;
+- `listening_s`: launching uvicorn until /api/health answers;
+- `first_chat_s`: launching uvicorn until the first /api/chat is answered.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+from httpx import AsyncClient
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.load_test import BACKEND_DIR, free_port, wait_until_up
+
+
+def app_env(gemini_port: int, appwrite_port: int) -> dict:
+    return dict(
+        os.environ,
+        GEMINI_API_KEY="bench-key",
+        GEMINI_API_ENDPOINT=f"http://127.0.0.1:{gemini_port}",
+        APPWRITE_ENDPOINT=f"http://127.0.0.1:{appwrite_port}/v1",
+        APPWRITE_PROJECT_ID="bench",
+        APPWRITE_API_KEY="bench-key",
+        PYTHONWARNINGS="ignore",
+    )
+
+
+def import_seconds(env: dict) -> float:
+    output = subprocess.run([
+        sys.executable, "-c",
+        "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)",
+    ], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+async def serve_seconds(env: dict):
+    port = free_port()
+    start = time.perf_counter()
+    app = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+        "--log-level", "warning", "--no-access-log",
+    ], cwd=BACKEND_DIR, env=env)
+    try:
+        async with AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            while True:
+                if app.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with code {app.returncode}")
+                try:
+                    if (await client.get("/api/health")).status_code == 200:
+                        break
+                except Exception:
+                    pass
+                await asyncio.sleep(0.01)
+            listening = time.perf_counter() - start
+            response = await client.post("/api/chat", json={"message": "How can I track my order?"})
+            response.raise_for_status()
+            first_chat = time.perf_counter() - start
+    finally:
+        app.terminate()
+        app.wait()
+    return listening, first_chat
+
+
+async def main(args):
+    gemini_port, appwrite_port = free_port(), free_port()
+    fakes = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_servers", "--gemini-port", str(gemini_port),
+        "--appwrite-port", str(appwrite_port), "--gemini-latency", "0.2", "--gemini-jitter", "0",
+    ], cwd=BACKEND_DIR)
+    env = app_env(gemini_port, appwrite_port)
+    try:
+        await wait_until_up(f"http://127.0.0.1:{gemini_port}/__stats", fakes)
+        await wait_until_up(f"http://127.0.0.1:{appwrite_port}/__stats", fakes)
+        imports, listening, first_chat = [], [], []
+        for _ in range(args.runs):
+            imports.append(import_seconds(env))
+            up, chat = await serve_seconds(env)
+            listening.append(up)
+            first_chat.append(chat)
+    finally:
+        fakes.terminate()
+        fakes.wait()
+    print(json.dumps({
+        "runs": args.runs,
+        "import_s": round(statistics.median(imports), 3),
+        "listening_s": round(statistics.median(listening), 3),
+        "first_chat_s": round(statistics.median(first_chat), 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
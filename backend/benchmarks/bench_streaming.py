@@ -0,0 +1,74 @@
+"""Compare time-to-first-token of /api/chat and /api/chat/stream.
+
+httpx's ASGI transport buffers whole responses, so this drives the ASGI app
+directly and timestamps each body chunk as the app sends it.
+
+    python -m benchmarks.bench_streaming --llm-latency 1.0
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from app.main import app
+from benchmarks.bench_concurrency import install_fakes
+
+
+async def first_token_latency(path: str, message: str) -> tuple:
+    """Return (time to first token, time to last byte) for one request"""
+    body = json.dumps({"message": message, "session_id": str(uuid.uuid4())}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "server": ("bench", 80), "client": ("bench", 1),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    }
+    received = False
+    first_token = None
+    start = time.perf_counter()
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(event):
+        nonlocal first_token
+        # The first body chunk carrying response text is when the user sees something
+        if event["type"] == "http.response.body" and first_token is None:
+            chunk = event.get("body", b"")
+            if b'"delta"' in chunk or b'"response"' in chunk:
+                first_token = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    return first_token, time.perf_counter() - start
+
+
+async def main(args):
+    install_fakes(args.llm_latency, args.db_latency)
+    results = {}
+    for path in ("/api/chat", "/api/chat/stream"):
+        samples = [await first_token_latency(path, "Where is my order?") for _ in range(args.requests)]
+        results[path] = {
+            "ttft_p50_ms": round(statistics.median(s[0] for s in samples) * 1000, 1),
+            "total_p50_ms": round(statistics.median(s[1] for s in samples) * 1000, 1),
+        }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'endpoint':<18} {'ttft p50':>10} {'total p50':>10}")
+    for path, row in results.items():
+        print(f"{path:<18} {row['ttft_p50_ms']:>8}ms {row['total_p50_ms']:>8}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    asyncio.run(main(parser.parse_args()))
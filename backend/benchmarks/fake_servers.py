@@ -0,0 +1,306 @@
+"""Local HTTP stand-ins for the Gemini REST API and the Appwrite REST API.
+
+Unlike `benchmarks.fakes`, which replaces the SDK objects in-process, these
+servers let the real SDKs run unmodified, so request serialization, HTTP
+connection handling and response parsing are part of what gets measured.
+
+    python -m benchmarks.fake_servers --gemini-port 8701 --appwrite-port 8702 --gemini-latency 0.4
+
+Each server counts calls per operation; GET /__stats returns the counts and
+POST /__reset clears them.
+"""
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from appwrite.exception import AppwriteException
+from typing import Any, Dict
+import argparse
+import asyncio
+import json
+import random
+
+from benchmarks.fakes import FakeDatabases
+
+
+class _Stats:
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+        self.tokens: Dict[str, int] = {}
+
+    def count(self, operation: str):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def count_tokens(self, kind: str, tokens: int):
+        self.tokens[kind] = self.tokens.get(kind, 0) + tokens
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"calls": dict(self.calls), "total": sum(self.calls.values()), "errors": self.errors,
+                "tokens": dict(self.tokens)}
+
+
+class _Behaviour:
+    """Latency, jitter and error injection shared by both servers; adjustable at runtime"""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float,
+                 tail_rate: float = 0.0, tail_latency: float = 0.0, prefill_seconds_per_1k: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # A share of calls is much slower than the rest, like a real model API's long tail
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        # Reading the prompt takes time too, except for the part held in cached content
+        self.prefill_seconds_per_1k = prefill_seconds_per_1k
+
+    def delay(self, fraction: float = 1.0) -> float:
+        if random.random() < self.tail_rate:
+            return self.tail_latency * fraction
+        return max(0.0, (self.latency + random.uniform(-self.jitter, self.jitter)) * fraction)
+
+    def prefill(self, input_tokens: int) -> float:
+        return self.prefill_seconds_per_1k * input_tokens / 1000
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+def _add_control_routes(app: FastAPI, stats: _Stats, behaviour: _Behaviour):
+    @app.get("/__stats")
+    async def get_stats():
+        return stats.as_dict()
+
+    @app.post("/__reset")
+    async def reset(request: Request):
+        stats.calls.clear()
+        stats.errors = 0
+        stats.tokens.clear()
+        # Optionally change the injected behaviour between runs
+        body = await request.body()
+        for key, value in (json.loads(body) if body else {}).items():
+            setattr(behaviour, key, float(value))
+        return stats.as_dict()
+
+
+def create_gemini_app(latency: float = 0.4, jitter: float = 0.1, error_rate: float = 0.0,
+                      response_words: int = 60, tail_rate: float = 0.0, tail_latency: float = 0.0,
+                      prefill_seconds_per_1k: float = 0.0) -> FastAPI:
+    """Serves models/*:generateContent, models/*:streamGenerateContent, models/*:countTokens and cachedContents"""
+    app = FastAPI()
+    stats = _Stats()
+    behaviour = _Behaviour(latency, jitter, error_rate, tail_rate, tail_latency, prefill_seconds_per_1k)
+    _add_control_routes(app, stats, behaviour)
+    # Cached content name -> its token count
+    cached: Dict[str, int] = {}
+
+    def _text(content: Dict[str, Any]) -> str:
+        return "".join(part.get("text", "") for part in content.get("parts", []))
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cached_content(request: Request):
+        stats.count("createCachedContent")
+        body = await request.json()
+        text = _text(body.get("systemInstruction", {})) + "".join(_text(c) for c in body.get("contents", []))
+        name = f"cachedContents/{len(cached) + 1}"
+        cached[name] = len(text) // 4 + 1
+        now = datetime.now(timezone.utc)
+        return {
+            "name": name,
+            "model": body.get("model"),
+            "displayName": body.get("displayName", ""),
+            "createTime": now.isoformat().replace("+00:00", "Z"),
+            "updateTime": now.isoformat().replace("+00:00", "Z"),
+            "expireTime": body.get("expireTime") or now.isoformat().replace("+00:00", "Z"),
+            "usageMetadata": {"totalTokenCount": cached[name]},
+        }
+
+    @app.delete("/v1beta/cachedContents/{cache_id}")
+    async def delete_cached_content(cache_id: str):
+        stats.count("deleteCachedContent")
+        cached.pop(f"cachedContents/{cache_id}", None)
+        return {}
+
+    def _payload(text: str, prompt_tokens: int, response_tokens: int, cached_tokens: int = 0) -> Dict[str, Any]:
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens + cached_tokens,
+                "cachedContentTokenCount": cached_tokens,
+                "candidatesTokenCount": response_tokens,
+                "totalTokenCount": prompt_tokens + cached_tokens + response_tokens
+            }
+        }
+
+    @app.post("/v1beta/models/{model_action}")
+    async def generate(model_action: str, request: Request):
+        _, _, action = model_action.partition(":")
+        stats.count(action)
+        body = await request.json()
+        prompt = "".join(part.get("text", "")
+                         for content in body.get("contents", [])
+                         for part in content.get("parts", []))
+        prompt = _text(body.get("systemInstruction", {})) + prompt
+        prompt_tokens = len(prompt) // 4 + 1
+        if action == "countTokens":
+            return {"totalTokens": prompt_tokens}
+        cached_tokens = cached.get(body.get("cachedContent"), 0)
+        stats.count_tokens("prompt", prompt_tokens)
+        stats.count_tokens("cached", cached_tokens)
+        prefill = behaviour.prefill(prompt_tokens)
+        words = [f"word{i}" for i in range(response_words)]
+
+        if behaviour.fails():
+            stats.errors += 1
+            await asyncio.sleep(behaviour.delay(0.5))
+            return JSONResponse(
+                {"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}},
+                status_code=503
+            )
+
+        if action == "streamGenerateContent":
+            total = behaviour.delay()
+
+            async def chunks():
+                # The first chunk arrives after a fifth of the latency, the rest trickle in
+                await asyncio.sleep(prefill + total / 5)
+                step = max(1, response_words // 10)
+                yield "["
+                for i in range(0, response_words, step):
+                    if i:
+                        await asyncio.sleep(total * 4 / 5 / 10)
+                        yield ",\r\n"
+                    text = " ".join(words[i:i + step]) + " "
+                    yield json.dumps(_payload(text, prompt_tokens, step, cached_tokens))
+                yield "]"
+
+            return StreamingResponse(chunks(), media_type="application/json")
+
+        await asyncio.sleep(prefill + behaviour.delay())
+        return _payload(" ".join(words), prompt_tokens, response_words, cached_tokens)
+
+    return app
+
+
+def create_appwrite_app(latency: float = 0.02, jitter: float = 0.005, error_rate: float = 0.0) -> FastAPI:
+    """Serves the document routes of the Databases API, backed by `FakeDatabases`"""
+    app = FastAPI()
+    stats = _Stats()
+    behaviour = _Behaviour(latency, jitter, error_rate)
+    storage = FakeDatabases(latency=0)
+    _add_control_routes(app, stats, behaviour)
+    prefix = "/v1/databases/{database_id}/collections/{collection_id}/documents"
+
+    def _document(database_id: str, collection_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Newer SDKs validate that these system attributes are present
+        now = datetime.now(timezone.utc).isoformat()
+        return {
+            "$sequence": "0",
+            "$collectionId": collection_id,
+            "$databaseId": database_id,
+            "$createdAt": now,
+            "$updatedAt": now,
+            "$permissions": [],
+            **data
+        }
+
+    async def _handle(operation: str, database_id: str, collection_id: str, call):
+        stats.count(operation)
+        await asyncio.sleep(behaviour.delay())
+        if behaviour.fails():
+            stats.errors += 1
+            return JSONResponse(
+                {"message": "Service unavailable", "code": 503, "type": "general_service_unavailable"},
+                status_code=503
+            )
+        try:
+            result = call()
+        except AppwriteException as e:
+            return JSONResponse({"message": e.message, "code": e.code, "type": "document_error"},
+                                status_code=e.code)
+        if "documents" in result:
+            result["documents"] = [_document(database_id, collection_id, d) for d in result["documents"]]
+        elif "$id" in result:
+            result = _document(database_id, collection_id, result)
+        return result
+
+    @app.post(prefix)
+    async def create(database_id: str, collection_id: str, request: Request):
+        body = await request.json()
+        if "documents" in body:
+            return await _handle("create_documents", database_id, collection_id, lambda: storage.create_documents(
+                database_id, collection_id, body["documents"]))
+        return await _handle("create_document", database_id, collection_id, lambda: storage.create_document(
+            database_id, collection_id, body["documentId"], body.get("data") or {}))
+
+    @app.get(prefix)
+    async def list_documents(database_id: str, collection_id: str, request: Request):
+        queries = [value for key, value in request.query_params.multi_items() if key.startswith("queries")]
+        return await _handle("list_documents", database_id, collection_id, lambda: storage.list_documents(
+            database_id, collection_id, queries))
+
+    @app.delete(prefix)
+    async def delete_documents(database_id: str, collection_id: str, request: Request):
+        body = await request.json()
+        return await _handle("delete_documents", database_id, collection_id, lambda: storage.delete_documents(
+            database_id, collection_id, body.get("queries")))
+
+    @app.get(prefix + "/{document_id}")
+    async def get_document(database_id: str, collection_id: str, document_id: str):
+        return await _handle("get_document", database_id, collection_id, lambda: storage.get_document(
+            database_id, collection_id, document_id))
+
+    @app.patch(prefix + "/{document_id}")
+    async def update_document(database_id: str, collection_id: str, document_id: str, request: Request):
+        body = await request.json()
+        return await _handle("update_document", database_id, collection_id, lambda: storage.update_document(
+            database_id, collection_id, document_id, body.get("data")))
+
+    @app.delete(prefix + "/{document_id}")
+    async def delete_document(database_id: str, collection_id: str, document_id: str):
+        return await _handle("delete_document", database_id, collection_id, lambda: storage.delete_document(
+            database_id, collection_id, document_id))
+
+    return app
+
+
+async def serve(args):
+    import uvicorn
+
+    # Keep idle connections open longer than the SDKs' pools do, like the real services
+    options = dict(host=args.host, log_level="warning", access_log=False, timeout_keep_alive=75)
+    servers = [
+        uvicorn.Server(uvicorn.Config(
+            create_gemini_app(
+                args.gemini_latency, args.gemini_jitter, args.gemini_error_rate,
+                tail_rate=args.gemini_tail_rate, tail_latency=args.gemini_tail_latency,
+                prefill_seconds_per_1k=args.gemini_prefill
+            ),
+            port=args.gemini_port, **options
+        )),
+        uvicorn.Server(uvicorn.Config(
+            create_appwrite_app(args.appwrite_latency, args.appwrite_jitter, args.appwrite_error_rate),
+            port=args.appwrite_port, **options
+        )),
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--gemini-port", type=int, default=8701)
+    parser.add_argument("--appwrite-port", type=int, default=8702)
+    parser.add_argument("--gemini-latency", type=float, default=0.4)
+    parser.add_argument("--gemini-jitter", type=float, default=0.1)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-tail-rate", type=float, default=0.0, help="share of calls that are slow")
+    parser.add_argument("--gemini-tail-latency", type=float, default=3.0, help="latency of the slow calls")
+    parser.add_argument("--gemini-prefill", type=float, default=0.0, help="seconds per 1k uncached prompt tokens")
+    parser.add_argument("--appwrite-latency", type=float, default=0.02)
+    parser.add_argument("--appwrite-jitter", type=float, default=0.005)
+    parser.add_argument("--appwrite-error-rate", type=float, default=0.0)
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,192 @@
+"""In-process stand-ins for the blocking Gemini and Appwrite SDK objects.
+
+Both fakes sleep with `time.sleep` so they block the calling thread exactly
+like the real SDKs do, which is what the benchmarks need to measure.
+"""
+from appwrite.exception import AppwriteException
+from typing import Any, Dict, List, Optional
+import json
+import random
+import threading
+import time
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Mimics `genai.GenerativeModel.generate_content` with configurable latency"""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _sleep(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            failed = random.random() < self.error_rate
+            self.errors += failed
+        if failed:
+            self._sleep()
+            raise RuntimeError("503 The model is overloaded. Please try again later.")
+        text = f"Fake answer to a {len(prompt)} character prompt."
+        if stream:
+            return self._stream(text)
+        self._sleep()
+        return FakeResponse(text)
+
+    def _stream(self, text: str):
+        # The first chunk arrives after a fifth of the total latency, the rest trickle in
+        words = text.split(" ")
+        time.sleep(self.latency / 5)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.latency * 4 / 5 / len(words))
+            yield FakeResponse(word if i == len(words) - 1 else word + " ")
+
+
+class FakeDatabases:
+    """Mimics `appwrite.services.databases.Databases` backed by in-memory collections"""
+
+    def __init__(self, latency: float = 0.005, jitter: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.errors = 0
+        self.calls: Dict[str, int] = {}
+        self.collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _enter(self, method: str):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            failed = random.random() < self.error_rate
+            self.errors += failed
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if failed:
+            raise AppwriteException("Service unavailable", 503)
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _collection(self, collection_id: str) -> Dict[str, Dict[str, Any]]:
+        return self.collections.setdefault(collection_id, {})
+
+    def create_document(self, database_id: str, collection_id: str, document_id: str,
+                        data: Dict[str, Any], permissions: Optional[List[str]] = None) -> Dict[str, Any]:
+        self._enter("create_document")
+        with self._lock:
+            collection = self._collection(collection_id)
+            if document_id in collection:
+                raise AppwriteException("Document with the requested ID already exists.", 409)
+            document = dict(data, **{"$id": document_id})
+            collection[document_id] = document
+            return dict(document)
+
+    def create_documents(self, database_id: str, collection_id: str,
+                         documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self._enter("create_documents")
+        with self._lock:
+            collection = self._collection(collection_id)
+            created = []
+            for data in documents:
+                document = dict(data)
+                collection[document["$id"]] = document
+                created.append(dict(document))
+            return {"total": len(created), "documents": created}
+
+    def get_document(self, database_id: str, collection_id: str, document_id: str,
+                     queries: Optional[List[str]] = None) -> Dict[str, Any]:
+        self._enter("get_document")
+        with self._lock:
+            document = self._collection(collection_id).get(document_id)
+            if document is None:
+                raise AppwriteException("Document with the requested ID could not be found.", 404)
+            return dict(document)
+
+    def update_document(self, database_id: str, collection_id: str, document_id: str,
+                        data: Optional[Dict[str, Any]] = None,
+                        permissions: Optional[List[str]] = None) -> Dict[str, Any]:
+        self._enter("update_document")
+        with self._lock:
+            document = self._collection(collection_id).get(document_id)
+            if document is None:
+                raise AppwriteException("Document with the requested ID could not be found.", 404)
+            document.update(data or {})
+            return dict(document)
+
+    def delete_document(self, database_id: str, collection_id: str, document_id: str) -> Dict[str, Any]:
+        self._enter("delete_document")
+        with self._lock:
+            if self._collection(collection_id).pop(document_id, None) is None:
+                raise AppwriteException("Document with the requested ID could not be found.", 404)
+            return {}
+
+    def delete_documents(self, database_id: str, collection_id: str,
+                         queries: Optional[List[str]] = None) -> Dict[str, Any]:
+        self._enter("delete_documents")
+        with self._lock:
+            collection = self._collection(collection_id)
+            deleted = _apply_queries(list(collection.values()), queries or [])
+            for document in deleted["documents"]:
+                collection.pop(document["$id"], None)
+            return deleted
+
+    def list_documents(self, database_id: str, collection_id: str,
+                       queries: Optional[List[str]] = None) -> Dict[str, Any]:
+        self._enter("list_documents")
+        with self._lock:
+            documents = list(self._collection(collection_id).values())
+        return _apply_queries(documents, queries or [])
+
+
+def _apply_queries(documents: List[Dict[str, Any]], queries: List[str]) -> Dict[str, Any]:
+    """Evaluate the subset of Appwrite query JSON the services actually emit"""
+    parsed = [json.loads(str(query)) for query in queries]
+    limit = 25
+    cursor = None
+    for query in parsed:
+        method = query["method"]
+        attribute = query.get("attribute")
+        values = query.get("values") or []
+        if method == "equal":
+            documents = [d for d in documents if d.get(attribute) in values]
+        elif method == "notEqual":
+            documents = [d for d in documents if d.get(attribute) not in values]
+        elif method == "lessThan":
+            documents = [d for d in documents if d.get(attribute) is not None and d[attribute] < values[0]]
+        elif method == "lessThanEqual":
+            documents = [d for d in documents if d.get(attribute) is not None and d[attribute] <= values[0]]
+        elif method == "greaterThan":
+            documents = [d for d in documents if d.get(attribute) is not None and d[attribute] > values[0]]
+        elif method == "greaterThanEqual":
+            documents = [d for d in documents if d.get(attribute) is not None and d[attribute] >= values[0]]
+        elif method in ("orderAsc", "orderDesc"):
+            # Ties are broken by document ID, mirroring the server's stable ordering
+            documents.sort(key=lambda d: (d.get(attribute) or "", d["$id"]), reverse=method == "orderDesc")
+        elif method == "limit":
+            limit = values[0]
+        elif method in ("cursorAfter", "cursorBefore"):
+            cursor = (method, values[0])
+    total = len(documents)
+    if cursor is not None:
+        ids = [d["$id"] for d in documents]
+        if cursor[1] not in ids:
+            raise AppwriteException("Document with the requested ID could not be found.", 404)
+        index = ids.index(cursor[1])
+        if cursor[0] == "cursorAfter":
+            documents = documents[index + 1:index + 1 + limit]
+        else:
+            documents = documents[max(0, index - limit):index]
+    else:
+        documents = documents[:limit]
+    return {"total": total, "documents": [dict(d) for d in documents]}
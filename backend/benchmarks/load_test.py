@@ -0,0 +1,313 @@
+"""Load-test the running app over HTTP against local fake Gemini and Appwrite servers.
+
+Starts `benchmarks.fake_servers` and the app under uvicorn, then drives
+multi-turn sessions from `--concurrency` closed-loop clients and reports
+throughput, latency percentiles and upstream calls per turn:
+
+    python -m benchmarks.load_test --concurrency 32 --duration 30 --output before.json
+    python -m benchmarks.load_test --concurrency 32 --duration 30 --compare before.json
+
+`--app-env KEY=VALUE` passes settings to the app, e.g. APPWRITE_WRITE_BEHIND=false.
+"""
+from httpx import AsyncClient, HTTPError, Limits, Timeout
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from benchmarks.bench_persistence import percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAQ = [
+    "How do I reset my password?",
+    "What is your refund policy?",
+    "How can I track my order?",
+    "Do you ship internationally?",
+    "How do I cancel my subscription?",
+    "Which payment methods do you accept?",
+    "How do I update my billing address?",
+    "Can I change my order after it was placed?",
+]
+FOLLOW_UPS = [
+    "Thanks, can you explain that in more detail?",
+    "What if that does not work?",
+    "How long does that usually take?",
+    "Is there a fee for that?",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(mix: str):
+    """'1:0.5,3:0.3,8:0.2' -> ([1, 3, 8], [0.5, 0.3, 0.2])"""
+    pairs = [item.split(":") for item in mix.split(",")]
+    return [int(turns) for turns, _ in pairs], [float(weight) for _, weight in pairs]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{' '.join(process.args)} exited with code {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except Exception:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+class Recorder:
+    def __init__(self):
+        self.recording = False
+        self.latencies = {}
+        self.first_chunk = []
+        self.errors = {}
+        self.turns = 0
+        self.requests = 0
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        if not self.recording:
+            return
+        self.requests += 1
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+async def chat_turn(client: AsyncClient, recorder: Recorder, session_id: str, message: str, stream: bool):
+    body = {"message": message, "session_id": session_id}
+    endpoint = "chat_stream" if stream else "chat"
+    start = time.perf_counter()
+    ok = False
+    first_chunk = None
+    try:
+        if not stream:
+            response = await client.post("/api/chat", json=body)
+            ok = response.status_code == 200
+        else:
+            async with client.stream("POST", "/api/chat/stream", json=body) as response:
+                async for line in response.aiter_lines():
+                    if first_chunk is None and line.startswith("data:") and '"delta"' in line:
+                        first_chunk = time.perf_counter() - start
+                    ok = ok or line == "event: done"
+            ok = ok and response.status_code == 200
+    except HTTPError:
+        # Dropped connections count as failed requests rather than ending the run
+        ok = False
+    recorder.record(endpoint, time.perf_counter() - start, ok)
+    if recorder.recording and first_chunk is not None:
+        recorder.first_chunk.append(first_chunk)
+
+
+async def client_loop(client: AsyncClient, recorder: Recorder, args, deadline: float, rng: random.Random):
+    turn_counts, weights = parse_mix(args.session_mix)
+    while time.monotonic() < deadline:
+        session_id = str(uuid.uuid4())
+        for turn in range(rng.choices(turn_counts, weights)[0]):
+            if time.monotonic() >= deadline:
+                return
+            if turn:
+                message = rng.choice(FOLLOW_UPS)
+            elif rng.random() < args.faq_fraction:
+                message = rng.choice(FAQ)
+            else:
+                message = f"I have a question about order {rng.randrange(10 ** 6)}"
+            await chat_turn(client, recorder, session_id, message, rng.random() < args.stream_fraction)
+            if recorder.recording:
+                recorder.turns += 1
+            if args.think_time:
+                await asyncio.sleep(rng.expovariate(1 / args.think_time))
+        if rng.random() < args.history_fraction:
+            start = time.perf_counter()
+            try:
+                ok = (await client.get(f"/api/chat/history/{session_id}")).status_code == 200
+            except HTTPError:
+                ok = False
+            recorder.record("history", time.perf_counter() - start, ok)
+
+
+def summarize(values) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+    }
+
+
+async def run(args) -> dict:
+    gemini_port, appwrite_port, app_port = free_port(), free_port(), free_port()
+    fakes = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_servers",
+        "--gemini-port", str(gemini_port), "--appwrite-port", str(appwrite_port),
+        "--gemini-latency", str(args.gemini_latency), "--gemini-jitter", str(args.gemini_jitter),
+        "--gemini-error-rate", str(args.gemini_error_rate),
+        "--gemini-tail-rate", str(args.gemini_tail_rate), "--gemini-tail-latency", str(args.gemini_tail_latency),
+        "--gemini-prefill", str(args.gemini_prefill),
+        "--appwrite-latency", str(args.appwrite_latency), "--appwrite-jitter", str(args.appwrite_jitter),
+        "--appwrite-error-rate", str(args.appwrite_error_rate),
+    ], cwd=BACKEND_DIR)
+    env = dict(
+        os.environ,
+        GEMINI_API_KEY="load-test-key",
+        GEMINI_API_ENDPOINT=f"http://127.0.0.1:{gemini_port}",
+        APPWRITE_ENDPOINT=f"http://127.0.0.1:{appwrite_port}/v1",
+        APPWRITE_PROJECT_ID="load-test",
+        APPWRITE_API_KEY="load-test-key",
+    )
+    env.update(item.split("=", 1) for item in args.app_env)
+    app = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--port", str(app_port), "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+        "--timeout-keep-alive", "75",
+    ], cwd=BACKEND_DIR, env=env)
+    fake_urls = {"gemini": f"http://127.0.0.1:{gemini_port}", "appwrite": f"http://127.0.0.1:{appwrite_port}"}
+
+    try:
+        await wait_until_up(fake_urls["gemini"] + "/__stats", fakes)
+        await wait_until_up(fake_urls["appwrite"] + "/__stats", fakes)
+        await wait_until_up(f"http://127.0.0.1:{app_port}/api/health", app)
+
+        recorder = Recorder()
+        rng = random.Random(args.seed)
+        limits = Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with AsyncClient(base_url=f"http://127.0.0.1:{app_port}", limits=limits,
+                               timeout=Timeout(120.0)) as client, AsyncClient() as control:
+            deadline = time.monotonic() + args.warmup + args.duration
+            clients = [
+                asyncio.create_task(client_loop(client, recorder, args, deadline, random.Random(rng.random())))
+                for _ in range(args.concurrency)
+            ]
+            await asyncio.sleep(args.warmup)
+            # Only count upstream calls made during the measured window
+            for url in fake_urls.values():
+                await control.post(url + "/__reset")
+            recorder.recording = True
+            start = time.perf_counter()
+            await asyncio.gather(*clients)
+            elapsed = time.perf_counter() - start
+            recorder.recording = False
+            upstream = {name: (await control.get(url + "/__stats")).json() for name, url in fake_urls.items()}
+    finally:
+        # Stop the app first so its final write-behind flush still reaches the fakes
+        for process in (app, fakes):
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    turns = max(recorder.turns, 1)
+    return {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "output", "compare")},
+        "duration_seconds": round(elapsed, 2),
+        "requests": recorder.requests,
+        "turns": recorder.turns,
+        "rps": round(recorder.requests / elapsed, 1),
+        "turns_per_second": round(recorder.turns / elapsed, 1),
+        "errors": recorder.errors,
+        "latency": {endpoint: summarize(values) for endpoint, values in sorted(recorder.latencies.items())},
+        "stream_first_chunk": summarize(recorder.first_chunk) if recorder.first_chunk else None,
+        "upstream_calls_per_turn": {
+            name: {
+                "total": round(stats["total"] / turns, 2),
+                "errors": round(stats["errors"] / turns, 3),
+                **{operation: round(count / turns, 2) for operation, count in sorted(stats["calls"].items())},
+            }
+            for name, stats in upstream.items()
+        },
+        "upstream_tokens_per_turn": {
+            name: {kind: round(count / turns, 1) for kind, count in sorted(stats["tokens"].items())}
+            for name, stats in upstream.items() if stats["tokens"]
+        },
+    }
+
+
+def flatten(result: dict, prefix: str = "") -> dict:
+    """Numeric leaves keyed by dotted path, for comparing two runs"""
+    flat = {}
+    for key, value in result.items():
+        if key == "config":
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def print_comparison(baseline: dict, result: dict):
+    before, after = flatten(baseline), flatten(result)
+    print(f"{'metric':>45} {baseline.get('commit', 'baseline'):>12} {result['commit']:>12} {'change':>9}")
+    for key in sorted(set(before) | set(after)):
+        old, new = before.get(key), after.get(key)
+        change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else ""
+        print(f"{key:>45} {'' if old is None else old:>12} {'' if new is None else new:>12} {change:>9}")
+
+
+async def main(args):
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    result = await run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), result)
+    elif args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in flatten(result).items():
+            print(f"{key:>45}: {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16, help="closed-loop clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before the window")
+    parser.add_argument("--session-mix", default="1:0.5,3:0.3,8:0.2", help="turns:weight pairs per session")
+    parser.add_argument("--stream-fraction", type=float, default=0.3, help="share of turns sent to /chat/stream")
+    parser.add_argument("--history-fraction", type=float, default=0.2, help="share of sessions that fetch history")
+    parser.add_argument("--faq-fraction", type=float, default=0.5, help="share of first turns drawn from a FAQ list")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between turns in seconds")
+    parser.add_argument("--gemini-latency", type=float, default=0.4)
+    parser.add_argument("--gemini-jitter", type=float, default=0.1)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-tail-rate", type=float, default=0.0, help="share of calls that are slow")
+    parser.add_argument("--gemini-tail-latency", type=float, default=3.0, help="latency of the slow calls")
+    parser.add_argument("--gemini-prefill", type=float, default=0.0, help="seconds per 1k uncached prompt tokens")
+    parser.add_argument("--appwrite-latency", type=float, default=0.02)
+    parser.add_argument("--appwrite-jitter", type=float, default=0.005)
+    parser.add_argument("--appwrite-error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the JSON result to this file")
+    parser.add_argument("--compare", help="print deltas against a previous --output file")
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    asyncio.run(main(parser.parse_args()))
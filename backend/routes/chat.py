@@ -1,11 +1,23 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import json
+import time
 import uuid
+import zlib
 from datetime import datetime
 import logging
+from app.config import settings
+from app.deadline import DeadlineExceeded, deadline_var
 from app.gemini_service import gemini_service
 from app.appwrite_service import appwrite_service
+from app.intent_router import intent_router
+from app.idempotency import IdempotencyConflict, idempotency_store, request_fingerprint
+from app.llm_scheduler import AdmissionRejected
+from app.metrics import CHAT_STAGE_SECONDS, timed
 from appwrite.exception import AppwriteException
 
 # Set up logging
@@ -17,75 +29,522 @@ router = APIRouter()
 class ChatMessage(BaseModel):
     message: str
     session_id: Optional[str] = None
+    client_message_id: Optional[str] = None  # Idempotency key for clients that cannot set headers
 
 class ChatResponse(BaseModel):
     response: str
     session_id: str
     timestamp: datetime
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(message: ChatMessage):
-    """
-    Handle chat messages with Gemini AI and Appwrite storage
+class BatchItem(BaseModel):
+    message: str
+    session_id: Optional[str] = None
+    id: Optional[str] = None  # Caller's reference (e.g. ticket ID), echoed in the result
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None  # Sessions processed at once; capped by BATCH_CONCURRENCY
+
+# Writes started by chat turns, referenced until they finish
+_background_writes = set()
+
+def _spawn_write(work: Awaitable[Any]) -> asyncio.Task:
+    task = asyncio.ensure_future(work)
+    _background_writes.add(task)
+    task.add_done_callback(_background_writes.discard)
+    return task
+
+class TurnPipeline:
+    """The storage stages of one chat turn, each started as soon as its inputs are ready.
+
+        create_conversation --+--> save_user_message ------------------------+
+        fetch_history --------+--> plan_context --> generate --> save_assistant_message
+                                        +--> save_summary
+
+    Only the conversation and the history are on the path to generation. The
+    user message and summary writes run alongside it, and their failures are
+    logged without holding up the turn. The assistant message is saved after
+    them so the conversation stays in order.
     """
-    try:
-        # Generate or use existing session ID
-        session_id = message.session_id or str(uuid.uuid4())
-        
-        logger.info(f"Processing chat message for session: {session_id}")
-        
-        # Ensure conversation exists in Appwrite
-        await appwrite_service.create_conversation(session_id)
-        
-        # Get conversation history for context
+
+    def __init__(self, endpoint: str, session_id: str, user_message: str):
+        self.endpoint = endpoint
+        self.session_id = session_id
+        self.user_message = user_message
+        # Known up front so a history read racing the write can leave the message out
+        self.user_message_id = str(uuid.uuid4())
+        self._writes: List[asyncio.Task] = []
+
+    async def context(self) -> Tuple[List[Dict[str, Any]], str]:
+        """Return the history to send verbatim and the summary of older turns"""
+        start = time.perf_counter()
+        conversation_task = asyncio.ensure_future(self._create_conversation())
+        history_task = asyncio.ensure_future(self._fetch_history())
         try:
-            conversation_history = await appwrite_service.get_conversation_messages(session_id)
-        except Exception as e:
-            logger.warning(f"Could not fetch conversation history: {str(e)}")
-            conversation_history = []
+            conversation = await conversation_task
+            # Storing a message bumps the conversation's timestamp, so it must exist first
+            self._writes.append(_spawn_write(self._save_user_message()))
+            conversation_history = await history_task
+        finally:
+            conversation_task.cancel()
+            history_task.cancel()
+        conversation_history = [m for m in conversation_history if m.get("id") != self.user_message_id]
+        
+        with timed(CHAT_STAGE_SECONDS.labels(self.endpoint, "plan_context")):
+            plan = gemini_service.plan_context(self.user_message, conversation_history, conversation)
+        if plan.summary_changed:
+            self._writes.append(_spawn_write(self._save_summary(plan.summary, plan.summarized_through)))
         
-        # Add user message to Appwrite
+        CHAT_STAGE_SECONDS.labels(self.endpoint, "context_ready").observe(time.perf_counter() - start)
+        return plan.history, plan.summary
+
+    async def finish(self, ai_response: str):
+        """Store the assistant reply once the turn's earlier writes are done"""
+        with timed(CHAT_STAGE_SECONDS.labels(self.endpoint, "save_assistant_message")):
+            if self._writes:
+                # Not gather: a cancelled turn must not cancel the writes it started
+                await asyncio.wait(self._writes)
+            try:
+                await appwrite_service.add_message(self.session_id, "assistant", ai_response)
+            except Exception as e:
+                logger.warning(f"Could not save AI response to Appwrite: {str(e)}")
+
+    async def _create_conversation(self) -> Dict[str, Any]:
+        with timed(CHAT_STAGE_SECONDS.labels(self.endpoint, "create_conversation")):
+            return await appwrite_service.create_conversation(self.session_id)
+
+    async def _fetch_history(self) -> List[Dict[str, Any]]:
+        # A few extra messages are fetched so turns are folded into the summary
+        # before they leave the window
+        with timed(CHAT_STAGE_SECONDS.labels(self.endpoint, "fetch_history")):
+            try:
+                return await appwrite_service.get_conversation_messages(
+                    self.session_id,
+                    limit=settings.history_window + settings.summary_fold_margin
+                )
+            except Exception as e:
+                logger.warning(f"Could not fetch conversation history: {str(e)}")
+                return []
+
+    async def _save_user_message(self):
+        with timed(CHAT_STAGE_SECONDS.labels(self.endpoint, "save_user_message")):
+            try:
+                await appwrite_service.add_message(
+                    self.session_id,
+                    "user",
+                    self.user_message,
+                    message_id=self.user_message_id
+                )
+            except Exception as e:
+                logger.warning(f"Could not save user message to Appwrite: {str(e)}")
+
+    async def _save_summary(self, summary: str, summarized_through: Optional[str]):
+        with timed(CHAT_STAGE_SECONDS.labels(self.endpoint, "save_summary")):
+            try:
+                await appwrite_service.update_conversation_summary(self.session_id, summary, summarized_through)
+            except Exception as e:
+                logger.warning(f"Could not save conversation summary: {str(e)}")
+
+async def _fast_path(endpoint: str, session_id: str, user_message: str) -> Optional[str]:
+    """Answer a trivial message from the intent templates and store the turn; None to use the model"""
+    if intent_router is None:
+        return None
+    with timed(CHAT_STAGE_SECONDS.labels(endpoint, "route_intent")):
+        after_question = False
+        if intent_router.depends_on_history(user_message):
+            after_question = await _assistant_asked(session_id)
+        match = intent_router.match(user_message, after_question)
+    if match is None:
+        return None
+    
+    logger.info(f"Answered {match.intent} intent without the model for session: {session_id}")
+    with timed(CHAT_STAGE_SECONDS.labels(endpoint, "fast_path")):
         try:
-            await appwrite_service.add_message(session_id, "user", message.message)
+            await appwrite_service.create_conversation(session_id)
+            await appwrite_service.add_message(session_id, "user", user_message)
+            await appwrite_service.add_message(session_id, "assistant", match.answer)
         except Exception as e:
-            logger.warning(f"Could not save user message to Appwrite: {str(e)}")
-        
-        # Generate AI response using Gemini
+            logger.warning(f"Could not save fast-path turn to Appwrite: {str(e)}")
+    return match.answer
+
+async def _assistant_asked(session_id: str) -> bool:
+    """Whether the session's last message is a question from the assistant"""
+    try:
+        last = await appwrite_service.get_conversation_messages(session_id, limit=1)
+    except Exception as e:
+        logger.warning(f"Could not fetch the last message for intent routing: {str(e)}")
+        return True  # Let the model answer rather than risk a wrong canned reply
+    return bool(last) and last[-1]["role"] == "assistant" and last[-1]["content"].rstrip().endswith("?")
+
+def _busy(rejection: AdmissionRejected) -> HTTPException:
+    """429/503 with Retry-After for a request turned away by LLM admission control"""
+    logger.warning(f"Chat request rejected: {str(rejection)}")
+    return HTTPException(
+        status_code=rejection.status_code,
+        detail="The assistant is busy right now. Please retry shortly.",
+        headers=rejection.headers
+    )
+
+def _timed_out(error: DeadlineExceeded) -> HTTPException:
+    logger.warning(f"Chat request timed out: {str(error)}")
+    return HTTPException(status_code=504, detail="The assistant took too long to respond. Please try again.")
+
+def _deadline_at(requested: Optional[float]) -> Optional[float]:
+    """When the turn must be answered: X-Request-Timeout seconds from now, capped by CHAT_DEADLINE_SECONDS"""
+    seconds = settings.chat_deadline_seconds or None
+    if requested is not None and requested > 0:
+        seconds = min(requested, seconds) if seconds else requested
+    return time.monotonic() + seconds if seconds else None
+
+async def _with_deadline(deadline_at: Optional[float], work: Awaitable[Any]) -> Any:
+    """Await `work` until the deadline; upstream calls made inside it are bounded by it too"""
+    if deadline_at is None:
+        return await work
+    token = deadline_var.set(deadline_at)
+    try:
+        return await asyncio.wait_for(work, deadline_at - time.monotonic())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Chat turn deadline exceeded")
+    finally:
+        deadline_var.reset(token)
+
+def _sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Format a Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+async def _run_turn(endpoint: str, session_id: str, user_message: str) -> str:
+    """Run one full chat turn and return the stored assistant reply.
+
+    Raises AdmissionRejected when Gemini is saturated.
+    """
+    pipeline = TurnPipeline(endpoint, session_id, user_message)
+    conversation_history, summary = await pipeline.context()
+    
+    # Generate AI response using Gemini
+    with timed(CHAT_STAGE_SECONDS.labels(endpoint, "generate")):
         try:
             # If we have conversation history, use it for context
-            if conversation_history:
+            if conversation_history or summary:
                 ai_response = await gemini_service.generate_response(
-                    message.message, 
-                    conversation_history
+                    user_message, 
+                    conversation_history,
+                    summary,
+                    session_id
                 )
             else:
                 # Fallback to simple response if no history
-                ai_response = await gemini_service.generate_simple_response(message.message)
+                ai_response = await gemini_service.generate_simple_response(user_message, session_id)
                 
+        except (AdmissionRejected, DeadlineExceeded):
+            raise
         except Exception as e:
             logger.error(f"Error generating AI response: {str(e)}")
             ai_response = "I apologize, but I'm experiencing technical difficulties. How else can I assist you today?"
+    
+    await pipeline.finish(ai_response)
+    return ai_response
+
+def _idempotency_key(header: Optional[str], message: ChatMessage) -> Optional[str]:
+    key = header or message.client_message_id
+    if key is not None and not 0 < len(key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency key must be 1-255 characters")
+    return key
+
+def _conflict(conflict: IdempotencyConflict) -> HTTPException:
+    logger.warning(f"Chat request rejected: {str(conflict)}")
+    return HTTPException(status_code=422, detail="Idempotency key was already used for a different message")
+
+async def _answer(message: ChatMessage) -> Dict[str, Any]:
+    # Generate or use existing session ID
+    session_id = message.session_id or str(uuid.uuid4())
+    
+    logger.info(f"Processing chat message for session: {session_id}")
+    
+    ai_response = await _fast_path("chat", session_id, message.message)
+    if ai_response is None:
+        # Turn the request away before anything is stored if Gemini is saturated
+        gemini_service.check_admission(session_id)
+        ai_response = await _run_turn("chat", session_id, message.message)
+    
+    return {"response": ai_response, "session_id": session_id, "timestamp": datetime.now()}
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(message: ChatMessage, response: Response, idempotency_key: Optional[str] = Header(None),
+               x_request_timeout: Optional[float] = Header(None)):
+    """
+    Handle chat messages with Gemini AI and Appwrite storage.
+    A retry carrying the same `Idempotency-Key` header (or `client_message_id`)
+    gets the original reply instead of running the turn again.
+    The turn is answered with 504 once `X-Request-Timeout` seconds (at most
+    CHAT_DEADLINE_SECONDS) have passed.
+    """
+    key = _idempotency_key(idempotency_key, message)
+    deadline_at = _deadline_at(x_request_timeout)
+    try:
+        if key is None:
+            return ChatResponse(**await _with_deadline(deadline_at, _answer(message)))
+        
+        result, replayed = await _with_deadline(deadline_at, idempotency_store.run(
+            key,
+            request_fingerprint(message.message, message.session_id),
+            lambda: _answer(message)
+        ))
+        if replayed:
+            logger.info(f"Replaying idempotent chat response for session: {result['session_id']}")
+            response.headers["Idempotent-Replayed"] = "true"
+        return ChatResponse(**result)
         
-        # Add AI response to Appwrite
+    except AdmissionRejected as e:
+        raise _busy(e)
+    except DeadlineExceeded as e:
+        raise _timed_out(e)
+    except IdempotencyConflict as e:
+        raise _conflict(e)
+    except Exception as e:
+        logger.error(f"Unexpected error in chat endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error. Please try again.")
+
+async def _replay_stream(result: Dict[str, Any]) -> AsyncIterator[str]:
+    """The SSE events of an already known reply, sent in one piece"""
+    yield _sse_event({"session_id": result["session_id"]}, event="start")
+    yield _sse_event({"delta": result["response"]})
+    yield _sse_event({
+        "session_id": result["session_id"],
+        "timestamp": result["timestamp"].isoformat()
+    }, event="done")
+
+@router.post("/chat/stream")
+async def chat_stream(message: ChatMessage, idempotency_key: Optional[str] = Header(None),
+                      x_request_timeout: Optional[float] = Header(None)):
+    """
+    Stream the AI response as Server-Sent Events while Gemini generates it.
+    A retry with the same idempotency key receives the original reply as a
+    single chunk once it is complete. A stream still running at the deadline
+    ends with an `error` event.
+    """
+    key = _idempotency_key(idempotency_key, message)
+    deadline_at = _deadline_at(x_request_timeout)
+    session_id = message.session_id or str(uuid.uuid4())
+    
+    try:
+        if key is not None:
+            future, owner = idempotency_store.claim(
+                key,
+                request_fingerprint(message.message, message.session_id)
+            )
+            if not owner:
+                result = await _with_deadline(deadline_at, asyncio.shield(future))
+                logger.info(f"Replaying idempotent chat stream for session: {result['session_id']}")
+                return StreamingResponse(
+                    _replay_stream(result),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "Idempotent-Replayed": "true"}
+                )
+    except AdmissionRejected as e:
+        raise _busy(e)
+    except DeadlineExceeded as e:
+        raise _timed_out(e)
+    except IdempotencyConflict as e:
+        raise _conflict(e)
+    except Exception as e:
+        logger.error(f"Unexpected error in chat stream endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error. Please try again.")
+    
+    logger.info(f"Processing streamed chat message for session: {session_id}")
+    
+    async def prepare():
+        fast_answer = await _fast_path("chat_stream", session_id, message.message)
+        if fast_answer is not None:
+            return fast_answer, None
+        gemini_service.check_admission(session_id)
+        pipeline = TurnPipeline("chat_stream", session_id, message.message)
+        return None, (pipeline, await pipeline.context())
+    
+    try:
+        fast_answer, prepared = await _with_deadline(deadline_at, prepare())
+        if fast_answer is not None:
+            result = {"response": fast_answer, "session_id": session_id, "timestamp": datetime.now()}
+            if key is not None:
+                idempotency_store.complete(key, result)
+            return StreamingResponse(
+                _replay_stream(result),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"}
+            )
+        pipeline, (conversation_history, summary) = prepared
+    except AdmissionRejected as e:
+        if key is not None:
+            idempotency_store.fail(key, e)
+        raise _busy(e)
+    except DeadlineExceeded as e:
+        if key is not None:
+            idempotency_store.fail(key, e)
+        raise _timed_out(e)
+    except Exception as e:
+        if key is not None:
+            idempotency_store.fail(key, e)
+        logger.error(f"Unexpected error in chat stream endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error. Please try again.")
+    
+    async def event_stream():
+        yield _sse_event({"session_id": session_id}, event="start")
+        
+        chunks = []
+        start = time.perf_counter()
+        # Gemini calls made while generating are bounded by the turn's deadline. It is not
+        # reset: a generator closed on disconnect may finalize in another context
+        deadline_var.set(deadline_at)
         try:
-            await appwrite_service.add_message(session_id, "assistant", ai_response)
+            async for chunk in gemini_service.stream_response(message.message, conversation_history, summary, session_id):
+                if not chunks:
+                    CHAT_STAGE_SECONDS.labels("chat_stream", "first_chunk").observe(time.perf_counter() - start)
+                chunks.append(chunk)
+                yield _sse_event({"delta": chunk})
+        except AdmissionRejected as e:
+            # The status line is already sent, so the rejection is reported in-band
+            logger.warning(f"Streamed chat request rejected: {str(e)}")
+            yield _sse_event({
+                "error": "busy",
+                "retry_after": int(e.headers["Retry-After"])
+            }, event="error")
+            return
+        except DeadlineExceeded as e:
+            logger.warning(f"Streamed chat request timed out: {str(e)}")
+            yield _sse_event({"error": "timeout"}, event="error")
+            return
         except Exception as e:
-            logger.warning(f"Could not save AI response to Appwrite: {str(e)}")
+            logger.error(f"Error streaming AI response: {str(e)}")
+            if not chunks:
+                fallback = "I apologize, but I'm experiencing technical difficulties. How else can I assist you today?"
+                chunks.append(fallback)
+                yield _sse_event({"delta": fallback})
         
-        return ChatResponse(
-            response=ai_response,
-            session_id=session_id,
-            timestamp=datetime.now()
-        )
+        ai_response = "".join(chunks).strip()
         
+        CHAT_STAGE_SECONDS.labels("chat_stream", "generate").observe(time.perf_counter() - start)
+        
+        # Persist the assistant message once the full response is known
+        await pipeline.finish(ai_response)
+        
+        timestamp = datetime.now()
+        if key is not None:
+            idempotency_store.complete(key, {"response": ai_response, "session_id": session_id, "timestamp": timestamp})
+        
+        yield _sse_event({
+            "session_id": session_id,
+            "timestamp": timestamp.isoformat()
+        }, event="done")
+    
+    async def owned_event_stream():
+        try:
+            async for event in event_stream():
+                yield event
+        finally:
+            # Rejected or disconnected before completing: let the next retry run again
+            idempotency_store.fail(key, RuntimeError("Streamed reply was not completed"))
+    
+    return StreamingResponse(
+        owned_event_stream() if key is not None else event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _batch_turn(index: int, item: BatchItem, session_id: str) -> Dict[str, Any]:
+    """Run one batch item and describe its outcome; failures are reported, not raised"""
+    result: Dict[str, Any] = {"index": index, "id": item.id, "session_id": session_id}
+    try:
+        fast_answer = await _fast_path("chat_batch", session_id, item.message)
+        if fast_answer is not None:
+            result["response"] = fast_answer
+            result["timestamp"] = datetime.now().isoformat()
+            return result
+        
+        # Offline work waits for Gemini capacity instead of failing on the first rejection
+        for attempt in range(settings.batch_admission_retries + 1):
+            try:
+                gemini_service.check_admission(session_id)
+                break
+            except AdmissionRejected as e:
+                if attempt == settings.batch_admission_retries:
+                    raise
+                await asyncio.sleep(e.retry_after)
+        
+        result["response"] = await _run_turn("chat_batch", session_id, item.message)
+        result["timestamp"] = datetime.now().isoformat()
+    except AdmissionRejected as e:
+        logger.warning(f"Batch item {index} rejected: {str(e)}")
+        result.update(error="busy", status=e.status_code, retry_after=int(e.headers["Retry-After"]))
     except Exception as e:
-        logger.error(f"Unexpected error in chat endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error. Please try again.")
+        logger.error(f"Error processing batch item {index}: {str(e)}")
+        result.update(error="Internal server error", status=500)
+    return result
+
+async def _batch_results(items: List[BatchItem], concurrency: int) -> AsyncIterator[str]:
+    """Process batch items and yield one NDJSON line per item as it completes, then a summary line"""
+    # Items of one session run in order on one worker, so each turn sees the previous
+    # reply and later turns read their history from the session cache
+    sessions: Dict[str, List[Tuple[int, BatchItem]]] = {}
+    for index, item in enumerate(items):
+        sessions.setdefault(item.session_id or str(uuid.uuid4()), []).append((index, item))
+    pending = deque(sessions.items())
+    results: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    
+    async def worker():
+        while pending:
+            session_id, turns = pending.popleft()
+            for index, item in turns:
+                await results.put(await _batch_turn(index, item, session_id))
+    
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(sessions)))]
+    failed = 0
+    try:
+        for _ in range(len(items)):
+            result = await results.get()
+            failed += "error" in result
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"done": True, "total": len(items), "failed": failed}) + "\n"
+    finally:
+        # Stop picking up new items if the client disconnected
+        for task in workers:
+            task.cancel()
+
+@router.post("/chat/batch")
+async def chat_batch(batch: BatchRequest):
+    """
+    Process many chat messages (e.g. a ticket backlog) in one request.
+    Results are streamed as NDJSON in completion order, one line per item,
+    followed by a summary line.
+    """
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="Batch contains no items")
+    if len(batch.items) > settings.batch_max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch exceeds {settings.batch_max_items} items"
+        )
+    
+    concurrency = min(batch.concurrency or settings.batch_concurrency, settings.batch_concurrency)
+    if concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+    
+    logger.info(f"Processing chat batch of {len(batch.items)} items")
+    
+    return StreamingResponse(
+        _batch_results(batch.items, concurrency),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
+async def get_chat_history(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None
+):
     """
-    Retrieve chat history for a session from Appwrite
+    Retrieve one page of chat history for a session from Appwrite.
+    Pass the returned `next_cursor` back as `cursor` to fetch the next page.
     """
     try:
         # Check if conversation exists
@@ -94,12 +553,16 @@ async def get_chat_history(session_id: str):
             raise HTTPException(status_code=404, detail="Session not found")
         
         # Get messages
-        messages = await appwrite_service.get_conversation_messages(session_id)
+        try:
+            page = await appwrite_service.get_messages_page(session_id, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         return {
             "session_id": session_id, 
             "conversation": conversation,
-            "messages": messages
+            "messages": page["messages"],
+            "next_cursor": page["next_cursor"]
         }
         
     except HTTPException:
@@ -108,15 +571,94 @@ async def get_chat_history(session_id: str):
         logger.error(f"Error fetching chat history: {str(e)}")
         raise HTTPException(status_code=500, detail="Could not retrieve chat history")
 
+def _iso_filter(value: Optional[datetime]) -> Optional[str]:
+    """Format a timestamp filter like stored timestamps (naive local time)"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.isoformat()
+
 @router.get("/chat/sessions")
-async def list_chat_sessions():
+async def list_chat_sessions(
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
+    updated_after: Optional[datetime] = None,
+    updated_before: Optional[datetime] = None
+):
     """
-    List all chat sessions (for admin/debugging purposes)
+    List chat sessions oldest first, optionally only those updated in
+    [updated_after, updated_before). Pass the returned `next_cursor` back as
+    `cursor` to fetch the next page.
     """
     try:
-        # This is a simplified implementation
-        # In production, you'd want pagination and user filtering
-        return {"message": "Session listing not implemented yet - use specific session_id"}
+        page = await appwrite_service.list_conversations(
+            limit,
+            cursor,
+            _iso_filter(updated_after),
+            _iso_filter(updated_before)
+        )
+        return {"sessions": page["conversations"], "next_cursor": page["next_cursor"]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error listing sessions: {str(e)}")
-        raise HTTPException(status_code=500, detail="Could not list sessions")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Could not list sessions")
+
+async def _export_lines(updated_after: Optional[str], updated_before: Optional[str]) -> AsyncIterator[bytes]:
+    """NDJSON export records, sent page by page and closed by an `end` record"""
+    conversations = messages = 0
+    lines: List[str] = []
+    try:
+        async for record in appwrite_service.export_conversations(
+                updated_after, updated_before, settings.export_page_size):
+            if record["type"] == "conversation":
+                conversations += 1
+            else:
+                messages += 1
+            lines.append(json.dumps(record))
+            if len(lines) >= settings.export_page_size:
+                yield ("\n".join(lines) + "\n").encode()
+                lines = []
+        lines.append(json.dumps({"type": "end", "conversations": conversations, "messages": messages}))
+    except Exception as e:
+        # The status line is already sent; a missing `end` record marks the export as incomplete
+        logger.error(f"Error exporting conversations: {str(e)}")
+        lines.append(json.dumps({"type": "error", "error": "Export failed"}))
+    yield ("\n".join(lines) + "\n").encode()
+
+async def _gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@router.get("/chat/export")
+async def export_chat_sessions(
+    updated_after: Optional[datetime] = None,
+    updated_before: Optional[datetime] = None,
+    compress: bool = Query(False, alias="gzip")
+):
+    """
+    Stream every session updated in [updated_after, updated_before) with its
+    messages as NDJSON: a `conversation` record followed by its `message`
+    records, and a final `end` record with the counts. Pass `gzip=true` for a
+    gzip-compressed download.
+    """
+    logger.info(f"Exporting sessions updated from {updated_after} to {updated_before}")
+    
+    body = _export_lines(_iso_filter(updated_after), _iso_filter(updated_before))
+    filename = "conversations.ndjson"
+    media_type = "application/x-ndjson"
+    if compress:
+        body = _gzip_stream(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
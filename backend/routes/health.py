@@ -1,7 +1,15 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.readiness import upstream_probe
 
 router = APIRouter()
 
 @router.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "AI Customer Support Agent"}
\ No newline at end of file
+    return {"status": "healthy", "service": "AI Customer Support Agent"}
+
+@router.get("/ready")
+async def readiness_check():
+    """503 while starting or while a dependency is degraded; built from cached probe results only"""
+    ready, report = upstream_probe.report()
+    return JSONResponse(report, status_code=200 if ready else 503)
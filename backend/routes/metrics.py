@@ -0,0 +1,66 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.appwrite_service import appwrite_service
+from app.circuit_breaker import CircuitBreaker
+from app.executor import gemini_executor, appwrite_executor, retrieval_executor
+from app.gemini_service import gemini_service
+from app.idempotency import idempotency_store
+from app.intent_router import intent_router
+from app.lifecycle import startup
+from app.metrics import BREAKER_STATE, MOCK_MODE, registry
+
+router = APIRouter()
+
+_BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+# Gauges are read from the services when scraped, so they cost nothing per request
+MOCK_MODE.labels("gemini").set_function(lambda: gemini_service.use_mock)
+MOCK_MODE.labels("appwrite").set_function(lambda: appwrite_service.use_mock)
+BREAKER_STATE.labels("gemini").set_function(lambda: _BREAKER_STATES[gemini_service.breaker.state])
+BREAKER_STATE.labels("appwrite").set_function(lambda: _BREAKER_STATES[appwrite_service.breaker.state])
+
+_in_flight = registry.gauge("executor_in_flight", "Blocking calls running or queued per worker pool", ["pool"])
+for _executor in (gemini_executor, appwrite_executor, retrieval_executor):
+    _in_flight.labels(_executor.name).set_function(lambda executor=_executor: executor.in_flight)
+
+registry.gauge("llm_queue_depth", "LLM calls waiting for admission").labels().set_function(
+    lambda: gemini_service.scheduler.queued
+)
+registry.gauge("llm_active_calls", "LLM calls admitted and running").labels().set_function(
+    lambda: gemini_service.scheduler.active
+)
+
+_pool_in_use = registry.gauge("http_pool_in_use", "Pooled HTTP connections serving a request", ["client"])
+_pool_in_use.labels("appwrite").set_function(
+    lambda: appwrite_service.http_pool.in_use if appwrite_service.http_pool else 0
+)
+_pool_opened = registry.gauge("http_pool_connections_opened", "HTTP connections opened so far", ["client"])
+_pool_opened.labels("appwrite").set_function(
+    lambda: appwrite_service.http_pool.connections_opened() if appwrite_service.http_pool else 0
+)
+
+registry.gauge("write_behind_pending", "Messages waiting to be written to Appwrite").labels().set_function(
+    lambda: appwrite_service.write_behind.pending_count if appwrite_service.write_behind else 0
+)
+registry.gauge(
+    "idempotent_replays", "Chat retries answered from the idempotency store instead of rerunning"
+).labels().set_function(lambda: idempotency_store.replays + idempotency_store.joins)
+registry.gauge(
+    "fast_path_absorbed_ratio", "Share of routed messages answered by the intent fast path"
+).labels().set_function(lambda: intent_router.absorbed_fraction() if intent_router else 0.0)
+_hit_ratio = registry.gauge("cache_hit_ratio", "Hit ratio of the in-process caches", ["cache"])
+_hit_ratio.labels("session").set_function(lambda: appwrite_service.session_cache.stats()["hit_rate"])
+_hit_ratio.labels("response").set_function(lambda: gemini_service.response_cache.stats()["hit_rate"])
+_hit_ratio.labels("context").set_function(
+    lambda: gemini_service.context_cache.stats()["hit_rate"] if gemini_service.context_cache else 0.0
+)
+
+_startup = registry.gauge("startup_seconds", "Seconds each service took to start, and until all were ready", ["step"])
+for _step in ("gemini", "appwrite"):
+    _startup.labels(_step).set_function(lambda step=_step: startup.durations.get(step, 0.0))
+_startup.labels("ready").set_function(lambda: startup.ready_after or 0.0)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus-style metrics for scraping"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
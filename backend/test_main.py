@@ -3,8 +3,49 @@ import pytest_asyncio
 import asyncio
 from httpx import AsyncClient
 from app.main import app
-from app.appwrite_service import appwrite_service
-from app.gemini_service import gemini_service
+from appwrite.client import Client
+from appwrite.exception import AppwriteException
+from appwrite.models import Document
+from appwrite.query import Query
+from app.appwrite_service import appwrite_service, AppwriteService, _to_plain
+from app.gemini_service import gemini_service, GeminiService
+from app.deadline import DeadlineExceeded, deadline_var
+from app.hedging import HedgePolicy
+from app.idempotency import IdempotencyConflict, IdempotencyStore
+from app.intent_router import DEFAULT_INTENTS, IntentRouter
+from app import lifecycle
+from app.lifecycle import ServiceStartup
+from app.circuit_breaker import CircuitBreaker
+from app.executor import BlockingExecutor
+from app.http_pool import HttpPool, PooledClient
+from app.knowledge_base import KnowledgeBase, chunk_text
+from app.llm_scheduler import AdmissionRejected, LLMScheduler
+from app.local_store import LocalConversationStore
+from app.metrics import CACHE_EVICTIONS, CACHE_LOOKUPS, MetricsRegistry
+from app.request_id import RequestIdFilter, request_id_var
+from app.prompt_builder import PromptBuilder, context_token_limit, estimate_tokens, extract_facts, format_context
+from app.readiness import UpstreamProbe
+from app.retention import RetentionJob
+from app.prompt_cache import ContextCache
+from app.response_cache import ResponseCache, normalize_message
+from app.session_cache import SessionCache
+from app.sqlite_store import SqliteConversationStore
+from app.write_behind import WriteBehindQueue
+from routes.chat import TurnPipeline
+from benchmarks.fake_servers import create_appwrite_app
+from benchmarks.fakes import FakeDatabases, FakeGenerativeModel
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
 import uuid
 
 @pytest.fixture(scope="session")
@@ -140,7 +181,7 @@ async def test_chat_long_message(client):
 def test_appwrite_service_mock_mode():
     """Test that AppwriteService initializes in mock mode."""
     assert appwrite_service.use_mock == True
-    assert isinstance(appwrite_service.mock_data, dict)
+    assert isinstance(appwrite_service.local_store, LocalConversationStore)
 
 def test_gemini_service_mock_mode():
     """Test that GeminiService initializes in mock mode."""
@@ -184,4 +225,1517 @@ async def test_gemini_service_responses():
         {"role": "assistant", "content": "Hello! How can I help?"}
     ]
     response = await gemini_service.generate_response("Tell me about your services", history)
-    assert len(response) > 0
\ No newline at end of file
+    assert len(response) > 0
+
+@pytest.mark.asyncio
+async def test_blocking_executor_timeout():
+    """Test that slow blocking calls are abandoned after the per-call timeout."""
+    executor = BlockingExecutor("test", 2)
+    try:
+        assert await executor.run(lambda: "done", timeout=1) == "done"
+        with pytest.raises(asyncio.TimeoutError):
+            await executor.run(time.sleep, 0.5, timeout=0.05)
+    finally:
+        executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_gemini_calls_do_not_block_event_loop():
+    """Test that concurrent Gemini calls overlap instead of running back to back."""
+    service = GeminiService()
+    service.model = FakeGenerativeModel(latency=0.2)
+    service.use_mock = False
+    
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(service.generate_simple_response(f"Question {i}") for i in range(4)))
+    elapsed = time.perf_counter() - start
+    
+    assert all(r.startswith("Fake answer") for r in responses)
+    assert service.model.calls == 4
+    assert elapsed < 0.6
+
+def _parse_sse(body: str):
+    """Split a Server-Sent Events body into (event, data) pairs."""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        event = "message"
+        data = None
+        for line in frame.splitlines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        events.append((event, data))
+    return events
+
+@pytest.mark.asyncio
+async def test_chat_stream_endpoint(client):
+    """Test that the streaming endpoint emits deltas and persists the full reply."""
+    session_id = str(uuid.uuid4())
+    
+    response = await client.post("/api/chat/stream", json={"message": "Hello there, my parcel arrived damaged", "session_id": session_id})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    
+    events = _parse_sse(response.text)
+    assert events[0] == ("start", {"session_id": session_id})
+    assert events[-1][0] == "done"
+    deltas = [data["delta"] for event, data in events if event == "message"]
+    assert len(deltas) > 1
+    
+    history = await client.get(f"/api/chat/history/{session_id}")
+    messages = history.json()["messages"]
+    assert [m["role"] for m in messages] == ["user", "assistant"]
+    assert messages[1]["content"] == "".join(deltas).strip()
+
+@pytest.mark.asyncio
+async def test_gemini_stream_response_yields_chunks():
+    """Test that streamed Gemini chunks are forwarded as they arrive."""
+    service = GeminiService()
+    service.model = FakeGenerativeModel(latency=0.05)
+    service.use_mock = False
+    
+    chunks = [chunk async for chunk in service.stream_response("Hi")]
+    assert len(chunks) > 1
+    assert "".join(chunks).startswith("Fake answer")
+    assert service.use_mock == False
+
+def _appwrite_with_fake(**kwargs):
+    """Build an AppwriteService that talks to an in-memory fake database."""
+    service = AppwriteService()
+    service.databases = FakeDatabases(latency=0, **kwargs)
+    service.use_mock = False
+    return service
+
+@pytest.mark.asyncio
+async def test_write_behind_coalesces_and_flushes_on_close():
+    """Test that queued messages are batched and timestamp bumps coalesced per session."""
+    service = _appwrite_with_fake()
+    session_id = str(uuid.uuid4())
+    await service.create_conversation(session_id)
+    
+    for i in range(3):
+        await service.add_message(session_id, "user", f"Message {i}")
+    assert service.databases.calls.get("create_documents", 0) == 0
+    
+    await service.close()
+    assert service.databases.calls["create_documents"] == 1
+    assert service.databases.calls["update_document"] == 1
+    stored = service.databases.collections["messages"]
+    assert sorted(m["content"] for m in stored.values()) == ["Message 0", "Message 1", "Message 2"]
+
+@pytest.mark.asyncio
+async def test_write_behind_read_your_writes():
+    """Test that queued messages are visible to reads before they are flushed."""
+    service = _appwrite_with_fake()
+    session_id = str(uuid.uuid4())
+    await service.create_conversation(session_id)
+    await service.add_message(session_id, "user", "Not flushed yet")
+    
+    messages = await service.get_conversation_messages(session_id)
+    assert [m["content"] for m in messages] == ["Not flushed yet"]
+    
+    await service.close()
+    messages = await service.get_conversation_messages(session_id)
+    assert [m["content"] for m in messages] == ["Not flushed yet"]
+
+@pytest.mark.asyncio
+async def test_write_behind_requeues_failed_flush():
+    """Test that a failed flush keeps the batch queued for the next attempt."""
+    attempts = []
+    
+    async def flaky_flush(messages, updates):
+        attempts.append(len(messages))
+        if len(attempts) == 1:
+            raise RuntimeError("upstream unavailable")
+    
+    queue = WriteBehindQueue(flaky_flush, batch_size=100, flush_interval=60)
+    await queue.add_message("s1", {"id": "m1", "session_id": "s1"}, "t1")
+    await queue.flush()
+    assert queue.flush_errors == 1
+    assert [m["id"] for m in queue.pending_messages("s1")] == ["m1"]
+    
+    await queue.close()
+    assert attempts == [1, 1]
+    assert queue.pending_messages("s1") == []
+
+@pytest.mark.asyncio
+async def test_write_behind_dead_letters_rejected_message():
+    """Test that a message Appwrite permanently rejects goes to the local store without blocking the rest."""
+    class RejectingDatabases(FakeDatabases):
+        def create_documents(self, database_id, collection_id, documents):
+            if any(d["content"] == "bad" for d in documents):
+                self._enter("create_documents")
+                raise AppwriteException("Invalid document structure", 400)
+            return super().create_documents(database_id, collection_id, documents)
+        
+        def create_document(self, database_id, collection_id, document_id, data, permissions=None):
+            if data.get("content") == "bad":
+                self._enter("create_document")
+                raise AppwriteException("Invalid document structure", 400)
+            return super().create_document(database_id, collection_id, document_id, data, permissions)
+    
+    service = AppwriteService()
+    service.databases = RejectingDatabases(latency=0)
+    service.use_mock = False
+    session_id = str(uuid.uuid4())
+    await service.create_conversation(session_id)
+    for content in ("good 1", "bad", "good 2"):
+        await service.add_message(session_id, "user", content)
+    
+    await service.write_behind.flush()
+    assert service.write_behind.pending_count == 0
+    assert service.write_behind.flush_errors == 0
+    stored = service.databases.collections["messages"]
+    assert sorted(m["content"] for m in stored.values()) == ["good 1", "good 2"]
+    assert [m["content"] for m in service.local_store.get_messages(session_id)] == ["bad"]
+    assert service.breaker.state == CircuitBreaker.CLOSED
+    
+    # Later batches are not held up behind it
+    await service.add_message(session_id, "user", "good 3")
+    await service.close()
+    assert "good 3" in [m["content"] for m in stored.values()]
+
+@pytest.mark.asyncio
+async def test_write_behind_gives_up_after_max_attempts():
+    """Test that a message that keeps failing is handed to the dead-letter callback."""
+    dead = []
+    
+    async def failing_flush(messages, updates):
+        raise RuntimeError("upstream unavailable")
+    
+    async def dead_letter(messages, updates, reason):
+        dead.append((messages, reason))
+    
+    queue = WriteBehindQueue(failing_flush, batch_size=100, flush_interval=60, max_attempts=3,
+                             dead_letter=dead_letter)
+    await queue.add_message("s1", {"id": "m1", "session_id": "s1"}, "t1")
+    for _ in range(3):
+        await queue.flush()
+    assert dead == [([{"id": "m1", "session_id": "s1"}], "exhausted")]
+    assert queue.pending_count == 0
+
+@pytest.mark.asyncio
+async def test_half_open_write_leaves_probe_to_flush_and_replays_local_writes():
+    """Test that queued writes don't take the half-open probe and degraded writes reach Appwrite after recovery."""
+    service = _appwrite_with_fake()
+    service.breaker.backoff_seconds = service.breaker._current_backoff = 0.05
+    session_id = str(uuid.uuid4())
+    await service.create_conversation(session_id)
+    service.breaker._open()
+    
+    await service.add_message(session_id, "user", "While down")
+    assert service.write_behind.pending_count == 0
+    assert [m["content"] for m in service.local_store.get_messages(session_id)] == ["While down"]
+    
+    await asyncio.sleep(0.06)
+    await service.add_message(session_id, "user", "While probing")
+    assert service.write_behind.pending_count == 1
+    # The flush is the probe: it reaches Appwrite and closes the breaker
+    await service.write_behind.flush()
+    assert service.breaker.state == CircuitBreaker.CLOSED
+    
+    await service.close()
+    stored = service.databases.collections["messages"]
+    assert sorted(m["content"] for m in stored.values()) == ["While down", "While probing"]
+
+@pytest.mark.asyncio
+async def test_chat_history_cursor_pagination(client):
+    """Test that history pages chain through next_cursor until the end."""
+    session_id = str(uuid.uuid4())
+    for i in range(3):
+        await client.post("/api/chat", json={"message": f"Question {i}", "session_id": session_id})
+    
+    contents = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 4}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get(f"/api/chat/history/{session_id}", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["messages"]) <= 4
+        contents.extend(m["content"] for m in data["messages"])
+        pages += 1
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    
+    assert pages == 2
+    assert len(contents) == 6
+    assert contents[0] == "Question 0"
+    
+    response = await client.get(f"/api/chat/history/{session_id}", params={"cursor": "missing"})
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_windowed_history_fetch():
+    """Test that only the newest window is read, including queued writes."""
+    service = _appwrite_with_fake()
+    session_id = str(uuid.uuid4())
+    await service.create_conversation(session_id)
+    for i in range(6):
+        await service.add_message(session_id, "user", f"Stored {i}")
+    await service.close()
+    await service.add_message(session_id, "user", "Queued")
+    
+    window = await service.get_conversation_messages(session_id, limit=3)
+    assert [m["content"] for m in window] == ["Stored 4", "Stored 5", "Queued"]
+    
+    first = await service.get_messages_page(session_id, 5)
+    assert len(first["messages"]) == 5
+    second = await service.get_messages_page(session_id, 5, first["next_cursor"])
+    assert [m["content"] for m in second["messages"]] == ["Stored 5", "Queued"]
+    assert second["next_cursor"] is None
+    await service.close()
+
+def test_session_cache_lru_and_ttl_eviction():
+    """Test that the session cache evicts least recently used and expired sessions."""
+    cache = SessionCache(max_sessions=2, ttl_seconds=60, window=3)
+    cache.put_conversation("a", {"session_id": "a"})
+    cache.put_conversation("b", {"session_id": "b"})
+    assert cache.get_conversation("a") is not None  # "b" is now least recently used
+    cache.put_conversation("c", {"session_id": "c"})
+    
+    assert cache.get_conversation("b") is None
+    assert cache.evictions == 1
+    
+    cache.ttl_seconds = 0
+    cache.put_conversation("d", {"session_id": "d"})
+    assert cache.get_conversation("d") is None
+    assert cache.stats()["evictions"] == 3
+
+def test_session_cache_window_write_through():
+    """Test that appended messages keep the window answerable until it overflows."""
+    cache = SessionCache(window=3)
+    cache.put_messages("s", [], complete=True)
+    for i in range(3):
+        cache.append_message("s", {"content": str(i)})
+    assert [m["content"] for m in cache.get_messages("s", None)] == ["0", "1", "2"]
+    
+    cache.append_message("s", {"content": "3"})
+    assert [m["content"] for m in cache.get_messages("s", 2)] == ["2", "3"]
+    assert cache.get_messages("s", None) is None  # Oldest message fell out of the window
+    assert cache.get_messages("s", 5) is None
+
+@pytest.mark.asyncio
+async def test_session_cache_serves_active_sessions():
+    """Test that repeated turns on one session skip Appwrite reads."""
+    service = _appwrite_with_fake()
+    session_id = str(uuid.uuid4())
+    
+    for turn in range(3):
+        await service.create_conversation(session_id)
+        await service.get_conversation_messages(session_id, limit=10)
+        await service.add_message(session_id, "user", f"Turn {turn}")
+    
+    assert service.databases.calls.get("get_document", 0) == 0
+    assert service.databases.calls.get("list_documents", 0) == 0
+    messages = await service.get_conversation_messages(session_id, limit=10)
+    assert [m["content"] for m in messages] == ["Turn 0", "Turn 1", "Turn 2"]
+    assert service.session_cache.stats()["hits"] >= 6
+    await service.close()
+
+def _local_message(session_id: str, content: str, role: str = "user"):
+    return {
+        "id": str(uuid.uuid4()),
+        "session_id": session_id,
+        "role": role,
+        "content": content,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def test_local_store_round_trips_messages():
+    """Test that compact records read back exactly as they were written."""
+    store = LocalConversationStore()
+    message = _local_message("s", "Where is my order?")
+    store.add_message(message)
+    store.add_message(_local_message("s", "Let me check.", role="assistant"))
+    
+    messages = store.get_messages("s")
+    assert messages[0] == message
+    assert [m["role"] for m in messages] == ["user", "assistant"]
+    assert store.get_conversation("s")["updated_at"] == messages[-1]["timestamp"]
+    
+    page = store.get_messages_page("s", 1)
+    assert page["next_cursor"] == message["id"]
+    assert store.get_messages_page("s", 1, page["next_cursor"])["next_cursor"] is None
+    with pytest.raises(ValueError):
+        store.get_messages_page("s", 1, str(uuid.uuid4()))
+
+def test_local_store_memory_cap_and_idle_eviction():
+    """Test that least recently used and idle sessions are evicted."""
+    store = LocalConversationStore(max_bytes=4000)
+    for i in range(20):
+        store.add_message(_local_message(f"session-{i}", "x" * 100))
+    assert store.bytes_used <= 4000
+    assert store.evictions > 0
+    assert "session-19" in store
+    assert "session-0" not in store
+    
+    store.idle_seconds = 0
+    store.create_conversation("fresh")
+    assert len(store) == 1
+
+def test_local_store_spills_evicted_sessions(tmp_path):
+    """Test that evicted sessions are written to disk and loaded back on access."""
+    store = LocalConversationStore(max_bytes=2000, spill_dir=str(tmp_path))
+    first = _local_message("first", "Remember me")
+    store.add_message(first)
+    for i in range(5):
+        store.add_message(_local_message(f"other-{i}", "y" * 200))
+    assert store.spills > 0
+    
+    assert store.get_messages("first") == [first]
+
+def test_circuit_breaker_opens_probes_and_recovers():
+    """Test the closed -> open -> half-open -> closed cycle with exponential backoff."""
+    changes = []
+    breaker = CircuitBreaker("test", failure_rate=0.5, minimum_calls=4, backoff_seconds=0.05, max_backoff_seconds=1)
+    breaker.add_listener(lambda name, old, new: changes.append(new))
+    
+    for ok in (True, False, True, False):
+        assert breaker.allow_request()
+        breaker.record_success() if ok else breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    
+    time.sleep(0.06)
+    assert breaker.allow_request()  # The half-open probe
+    assert not breaker.allow_request()  # Only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["backoff_seconds"] == 0.1
+    
+    time.sleep(0.11)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert changes == ["open", "half_open", "open", "half_open", "closed"]
+
+@pytest.mark.asyncio
+async def test_appwrite_recovers_after_transient_outage():
+    """Test that Appwrite errors degrade to local storage only until the breaker closes."""
+    service = _appwrite_with_fake(error_rate=1.0)
+    service.write_behind = None
+    service.breaker.minimum_calls = 2
+    service.breaker.backoff_seconds = service.breaker._current_backoff = 0.05
+    
+    for i in range(3):
+        await service.add_message(f"outage-{i}", "user", "Hello")
+    assert service.breaker.state == CircuitBreaker.OPEN
+    assert service.use_mock == False
+    calls_while_open = service.databases.total_calls()
+    await service.add_message("outage-3", "user", "Hello")
+    assert service.databases.total_calls() == calls_while_open  # Served locally without trying upstream
+    
+    service.databases.error_rate = 0.0
+    await asyncio.sleep(0.06)
+    await service.create_conversation("recovered")
+    assert service.breaker.state == CircuitBreaker.CLOSED
+    assert "recovered" in service.databases.collections["conversations"]
+
+@pytest.mark.asyncio
+async def test_gemini_recovers_after_transient_outage():
+    """Test that Gemini errors serve mock replies only until the probe succeeds."""
+    service = GeminiService()
+    service.model = FakeGenerativeModel(latency=0, error_rate=1.0)
+    service.use_mock = False
+    service.breaker.minimum_calls = 2
+    service.breaker.backoff_seconds = service.breaker._current_backoff = 0.05
+    
+    for _ in range(2):
+        response = await service.generate_simple_response("Hi")
+        assert not response.startswith("Fake answer")
+    assert service.breaker.state == CircuitBreaker.OPEN
+    
+    service.model.error_rate = 0.0
+    await asyncio.sleep(0.06)
+    assert (await service.generate_simple_response("Hi")).startswith("Fake answer")
+    assert service.breaker.state == CircuitBreaker.CLOSED
+
+def test_prompt_builder_respects_token_budget():
+    """Test that prompts stay within the token budget and older turns are folded into the summary."""
+    builder = PromptBuilder(token_budget=200, summary_token_budget=40, max_messages=10)
+    history = [_local_message("budget", f"message {i} " + "x" * 80) for i in range(8)]
+    
+    plan = builder.plan("Be helpful.", "Latest question", history)
+    assert plan.summary_changed
+    assert 0 < len(plan.history) < len(history)
+    assert plan.history == history[-len(plan.history):]
+    assert plan.summarized_through == history[-len(plan.history) - 1]["id"]
+    assert estimate_tokens(plan.summary) <= 40
+    
+    prompt = builder.build("Be helpful.", "Latest question", plan.history, plan.summary)
+    assert estimate_tokens(prompt) <= 200 + len(plan.history) + 4
+    assert "Summary of earlier conversation:" in prompt
+    assert prompt.endswith("User: Latest question\nAssistant:")
+
+def test_prompt_builder_plan_leaves_room_for_retrieved_context():
+    """Test that history kept by the plan still fits once the retrieved passages are added."""
+    builder = PromptBuilder(token_budget=600, summary_token_budget=40, max_messages=30)
+    history = [_local_message("context", f"message {i} " + "x" * 80) for i in range(30)]
+    passages = [{"source": "faq.md", "text": "y" * 400}]
+    context = format_context(passages)
+    
+    plan = builder.plan("Be helpful.", "Latest question", history,
+                        context_tokens=context_token_limit(1, chunk_chars=400))
+    prompt = builder.build("Be helpful.", "Latest question", plan.history, plan.summary, context)
+    assert 0 < len(plan.history) < len(history)
+    assert all(m["content"] in prompt for m in plan.history)
+    assert plan.summarized_through == history[-len(plan.history) - 1]["id"]
+
+def test_prompt_builder_folds_incrementally():
+    """Test that already summarized messages are skipped and the summary only grows by new turns."""
+    builder = PromptBuilder(token_budget=10000, max_messages=2)
+    history = [_local_message("fold", f"turn {i}") for i in range(4)]
+    
+    first = builder.plan("System", "Next", history)
+    assert first.summary == "- User: turn 0\n- User: turn 1"
+    assert first.summarized_through == history[1]["id"]
+    
+    history.append(_local_message("fold", "turn 4"))
+    second = builder.plan("System", "Next", history, first.summary, first.summarized_through)
+    assert second.summary == first.summary + "\n- User: turn 2"
+    assert [m["content"] for m in second.history] == ["turn 3", "turn 4"]
+    
+    unchanged = builder.plan("System", "Next", history, second.summary, second.summarized_through)
+    assert not unchanged.summary_changed
+
+def test_prompt_builder_fold_keeps_key_facts():
+    """Test that names and order numbers survive after the turns that mentioned them are dropped."""
+    builder = PromptBuilder(summary_token_budget=60)
+    summary = builder.fold("", [_local_message("facts", "Hi, my name is Jane Doe and order #12345 never arrived")])
+    for i in range(20):
+        summary = builder.fold(summary, [_local_message("facts", f"Follow-up message number {i} about shipping")])
+    assert estimate_tokens(summary) <= 60
+    assert summary.splitlines()[0] == "Key facts: name: Jane Doe; order: 12345"
+    assert "never arrived" not in summary
+    assert summary.splitlines()[-1] == "- User: Follow-up message number 19 about shipping"
+    assert extract_facts("Reach me at jane@example.com, ticket 4521, paid on 2024-01-02") == [
+        "email: jane@example.com", "reference: 4521"
+    ]
+
+@pytest.mark.asyncio
+async def test_conversation_summary_is_persisted():
+    """Test that summaries are written behind and visible before and after the flush."""
+    service = _appwrite_with_fake()
+    await service.create_conversation("summarized")
+    await service.update_conversation_summary("summarized", "- User: hi", "message-1")
+    
+    conversation = await service.get_conversation("summarized")
+    assert conversation["summary"] == "- User: hi"
+    await service.close()
+    stored = service.databases.collections["conversations"]["summarized"]
+    assert stored["summary"] == "- User: hi"
+    assert stored["summarized_through"] == "message-1"
+
+@pytest.mark.asyncio
+async def test_chat_sends_summary_for_long_conversations(client):
+    """Test that long conversations keep a rolling summary instead of dropping old turns."""
+    session_id = f"long-{uuid.uuid4()}"
+    for i in range(10):
+        response = await client.post("/api/chat", json={"message": f"Question {i}", "session_id": session_id})
+        assert response.status_code == 200
+    
+    conversation = await appwrite_service.get_conversation(session_id)
+    assert "- User: Question 0" in conversation["summary"]
+    assert conversation["summarized_through"]
+
+@pytest.mark.asyncio
+async def test_response_cache_ttl_and_lru():
+    """Test response cache expiry, LRU eviction and that None results are not cached."""
+    cache = ResponseCache(max_entries=2, ttl_seconds=0.05)
+    cache.put("a", "answer a")
+    cache.put("b", "answer b")
+    assert cache.get("a") == "answer a"
+    cache.put("c", "answer c")  # Evicts "b", the least recently used
+    assert cache.get("b") is None
+    await asyncio.sleep(0.06)
+    assert cache.get("a") is None
+    
+    async def empty():
+        return None
+    assert await cache.get_or_compute("d", empty) is None
+    assert cache.get("d") is None
+    assert normalize_message("  Where is my ORDER?? ") == normalize_message("where is my order")
+
+@pytest.mark.asyncio
+async def test_response_cache_waiters_keep_their_own_deadlines():
+    """Test that a short-deadline first caller does not fail the callers coalesced onto its computation."""
+    cache = ResponseCache()
+    seen_deadlines = []
+    
+    async def slow():
+        seen_deadlines.append(deadline_var.get())
+        await asyncio.sleep(0.1)
+        return "answer"
+    
+    async def ask(timeout):
+        if timeout is not None:
+            deadline_var.set(time.monotonic() + timeout)
+        return await cache.get_or_compute("q", slow)
+    
+    leader = asyncio.ensure_future(ask(0.02))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(ask(None))
+    with pytest.raises(DeadlineExceeded):
+        await leader
+    assert await follower == "answer"
+    assert seen_deadlines == [None]
+    assert cache.get("q") == "answer"
+
+@pytest.mark.asyncio
+async def test_identical_questions_share_one_gemini_call():
+    """Test that concurrent identical first-turn questions are coalesced and then served from cache."""
+    service = GeminiService()
+    service.model = FakeGenerativeModel(latency=0.05)
+    service.use_mock = False
+    
+    responses = await asyncio.gather(*(
+        service.generate_simple_response(text)
+        for text in ["Reset password", "reset password?", "  RESET   password. "] * 3
+    ))
+    assert len(set(responses)) == 1
+    assert service.model.calls == 1
+    assert service.response_cache.coalesced == 8
+    
+    await service.generate_simple_response("Reset password!")
+    assert service.model.calls == 1
+    assert service.response_cache.hits == 1
+    
+@pytest.mark.asyncio
+async def test_failed_answers_are_not_cached():
+    """Test that upstream errors fall back to mock replies without poisoning the cache."""
+    service = GeminiService()
+    service.model = FakeGenerativeModel(latency=0, error_rate=1.0)
+    service.use_mock = False
+    
+    response = await service.generate_simple_response("Where is my order?")
+    assert not response.startswith("Fake answer")
+    assert len(service.response_cache) == 0
+    
+    service.model.error_rate = 0.0
+    assert (await service.generate_simple_response("Where is my order?")).startswith("Fake answer")
+
+@pytest.mark.asyncio
+async def test_streamed_first_turn_uses_response_cache():
+    """Test that a completed history-less stream is cached for the next identical question."""
+    service = GeminiService()
+    service.model = FakeGenerativeModel(latency=0)
+    service.use_mock = False
+    
+    first = "".join([chunk async for chunk in service.stream_response("Track my parcel")])
+    second = "".join([chunk async for chunk in service.stream_response("track my parcel?")])
+    assert first.strip() == second
+    assert service.model.calls == 1
+
+def _write_article(directory, name: str, text: str):
+    with open(os.path.join(directory, name), "w") as f:
+        f.write(text)
+
+def test_knowledge_base_search_and_incremental_sync(tmp_path):
+    """Test that the index finds relevant passages and only re-embeds changed files."""
+    _write_article(tmp_path, "refunds.md", "Refunds are issued within 14 days of the return being received.")
+    _write_article(tmp_path, "shipping.md", "Standard shipping takes 3 to 5 business days within the country.")
+    knowledge_base = KnowledgeBase(str(tmp_path), dim=128)
+    assert knowledge_base.sync() == {"added": 2, "updated": 0, "removed": 0, "unchanged": 0}
+    
+    results = knowledge_base.search("when are refunds issued", top_k=1)
+    assert results[0]["source"] == "refunds.md"
+    
+    _write_article(tmp_path, "shipping.md", "Express shipping arrives the next business day.")
+    os.remove(tmp_path / "refunds.md")
+    assert knowledge_base.sync() == {"added": 0, "updated": 1, "removed": 1, "unchanged": 0}
+    assert knowledge_base.search("express shipping", top_k=1)[0]["text"].startswith("Express")
+    
+    # A fresh instance reads the persisted index instead of rebuilding it
+    reopened = KnowledgeBase(str(tmp_path), dim=128)
+    assert len(reopened) == 1
+    assert reopened.sync()["unchanged"] == 1
+    assert len(chunk_text("word " * 500, chunk_chars=100)) > 1
+
+@pytest.mark.asyncio
+async def test_relevant_passages_are_added_to_the_prompt(tmp_path):
+    """Test that generate_response sends retrieved knowledge-base passages to Gemini."""
+    _write_article(tmp_path, "warranty.md", "Every device carries a two year warranty covering manufacturing defects.")
+    service = GeminiService()
+    service.knowledge_base = KnowledgeBase(str(tmp_path))
+    service.knowledge_base.sync()
+    
+    prompts = []
+    class RecordingModel(FakeGenerativeModel):
+        def generate_content(self, prompt, **kwargs):
+            prompts.append(prompt)
+            return super().generate_content(prompt, **kwargs)
+    service.model = RecordingModel(latency=0)
+    service.use_mock = False
+    
+    history = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}]
+    await service.generate_response("What does the warranty cover?", history)
+    assert "two year warranty" in prompts[-1]
+    assert prompts[-1].index("two year warranty") < prompts[-1].index("User: What does the warranty cover?")
+
+@pytest.mark.asyncio
+async def test_context_cache_leaves_the_static_prefix_out_of_prompts():
+    """Test that the prefix is sent inline until cached content exists, and is recreated when the prompt changes."""
+    prompts = []
+    class RecordingModel(FakeGenerativeModel):
+        def generate_content(self, prompt, **kwargs):
+            prompts.append(prompt)
+            return super().generate_content(prompt, **kwargs)
+    created, deleted = [], []
+    def create(prefix, ttl_seconds):
+        created.append(prefix.instruction)
+        return RecordingModel(latency=0), prefix.version
+    service = GeminiService()
+    service.model = RecordingModel(latency=0)
+    service.use_mock = False
+    service.context_cache = ContextCache(create, deleted.append)
+
+    await service.generate_response("Where is my order?", [])
+    assert prompts[-1].startswith(f"System: {service.system_prompt}")
+    await service.context_cache.wait_refreshed()
+    await service.generate_response("Where is my order?", [])
+    assert service.system_prompt not in prompts[-1]
+    assert prompts[-1].endswith("User: Where is my order?\nAssistant:")
+
+    service.system_prompt = "You are a terse support agent."
+    await service.generate_response("Where is my order?", [])
+    assert prompts[-1].startswith("System: You are a terse support agent.")
+    await service.context_cache.wait_refreshed()
+    assert created[-1] == "You are a terse support agent."
+    assert len(deleted) == 1
+    assert service.context_cache.stats()["creations"] == 2
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_chat_stages(client):
+    """Test that a chat turn shows up as per-stage histograms on /api/metrics."""
+    await client.post("/api/chat", json={"message": "Where is my order?"})
+    response = await client.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    for stage in ("create_conversation", "fetch_history", "generate", "save_assistant_message"):
+        assert f'chat_stage_seconds_count{{endpoint="chat",stage="{stage}"}}' in body
+    assert 'mock_mode{service="gemini"} 1.0' in body
+    assert 'circuit_breaker_state{service="appwrite"} 0.0' in body
+
+def test_histogram_buckets_are_cumulative():
+    """Test histogram rendering and that a disabled registry records nothing."""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.labels("fetch").observe(value)
+    registry.counter("errors", "Errors").labels().inc()
+    body = registry.render()
+    assert 'latency_seconds_bucket{stage="fetch",le="0.1"} 2' in body
+    assert 'latency_seconds_bucket{stage="fetch",le="1.0"} 3' in body
+    assert 'latency_seconds_bucket{stage="fetch",le="+Inf"} 4' in body
+    assert 'latency_seconds_count{stage="fetch"} 4' in body
+    assert "errors_total 1.0" in body
+    
+    registry.enabled = False
+    histogram.labels("fetch").observe(0.05)
+    assert histogram.labels("fetch").count == 4
+
+@pytest.mark.asyncio
+async def test_request_id_header_and_log_records(client):
+    """Test that request IDs are echoed back and attached to log records."""
+    response = await client.get("/api/health", headers={"X-Request-ID": "trace-42"})
+    assert response.headers["x-request-id"] == "trace-42"
+    generated = (await client.get("/api/health")).headers["x-request-id"]
+    assert len(generated) == 32
+    
+    token = request_id_var.set("trace-43")
+    try:
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "message", None, None)
+        RequestIdFilter().filter(record)
+        assert record.request_id == "trace-43"
+    finally:
+        request_id_var.reset(token)
+
+@pytest.mark.asyncio
+async def test_fake_appwrite_server_serves_sdk_documents():
+    """Test the load-test Appwrite stand-in and normalizing the SDK's response models."""
+    fake = create_appwrite_app(latency=0, jitter=0)
+    prefix = "/v1/databases/main/collections/messages/documents"
+    async with AsyncClient(app=fake, base_url="http://fake") as ac:
+        for i in range(3):
+            response = await ac.post(prefix, json={
+                "documentId": f"m{i}",
+                "data": {"session_id": "s1", "content": f"Message {i}", "timestamp": f"t{i}"}
+            })
+            assert response.status_code == 200
+        listed = (await ac.get(prefix, params=[
+            ("queries[0]", Query.equal("session_id", ["s1"])),
+            ("queries[1]", Query.order_desc("timestamp")),
+            ("queries[2]", Query.limit(2))
+        ])).json()
+        missing = await ac.get(prefix + "/unknown")
+        stats = (await ac.get("/__stats")).json()
+    
+    assert listed["total"] == 3
+    assert [d["$id"] for d in listed["documents"]] == ["m2", "m1"]
+    assert missing.status_code == 404 and missing.json()["code"] == 404
+    assert stats["calls"] == {"create_document": 3, "list_documents": 1, "get_document": 1}
+    
+    # Newer SDKs nest custom attributes under `data`; the service flattens them again
+    document = _to_plain(Document.with_data(listed["documents"][0]))
+    assert document["$id"] == "m2"
+    assert document["content"] == "Message 2"
+    assert _to_plain({"total": 2.0, "documents": [document]})["total"] == 2
+
+def test_pooled_appwrite_client_reuses_connections_and_retries_reads():
+    """Test that the pooled client keeps one connection alive and retries only idempotent requests."""
+    failures = {"GET": 1, "POST": 1}
+    ports = set()
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def _reply(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            ports.add(self.client_address[1])
+            failed = failures[self.command] > 0
+            failures[self.command] -= 1
+            body = json.dumps({"message": "busy", "code": 503} if failed else {"ok": True}).encode()
+            self.send_response(503 if failed else 200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        do_GET = do_POST = _reply
+        def log_message(self, *args):
+            pass
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pool = HttpPool("test", pool_size=2, read_retries=2, backoff_seconds=0.01, timeout=5)
+    client = PooledClient(pool)
+    client.set_endpoint(f"http://127.0.0.1:{server.server_address[1]}")
+    headers = {"content-type": "application/json"}
+    try:
+        assert client.call("get", "/documents", headers) == {"ok": True}
+        with pytest.raises(AppwriteException) as error:
+            client.call("post", "/documents", headers, {"data": {}})
+        assert error.value.code == 503
+        for _ in range(5):
+            assert client.call("get", "/documents", headers) == {"ok": True}
+        stats = pool.stats()
+    finally:
+        pool.close()
+        server.shutdown()
+    assert failures == {"GET": -6, "POST": 0}
+    assert len(ports) == 1
+    assert stats["connections_opened"] == 1 and stats["requests"] == 7
+
+def test_pooled_client_matches_sdk_client_call():
+    """Test the Appwrite SDK still has the call signature and internals PooledClient overrides."""
+    signature = inspect.signature(Client.call)
+    assert [(p.name, p.default) for p in signature.parameters.values()] == [
+        ("self", inspect.Parameter.empty), ("method", inspect.Parameter.empty),
+        ("path", ""), ("headers", None), ("params", None), ("response_type", "json"),
+    ]
+    assert inspect.signature(PooledClient.call) == signature
+    client = Client()
+    for name in ("_global_headers", "_endpoint", "_self_signed"):
+        assert hasattr(client, name)
+    assert callable(getattr(Client, "flatten", None))
+
+@pytest.mark.asyncio
+async def test_llm_scheduler_is_fair_and_bounded():
+    """Test round-robin admission across sessions and the queue limits."""
+    scheduler = LLMScheduler("test", max_concurrency=1, max_queue=3, max_queue_per_session=2)
+    running = await scheduler.acquire("busy", 10)
+    order = []
+    
+    async def call(session_id: str):
+        grant = await scheduler.acquire(session_id, 10)
+        order.append(session_id)
+        scheduler.release(grant)
+    
+    tasks = [asyncio.create_task(call(s)) for s in ("a", "a", "b")]
+    await asyncio.sleep(0)
+    assert scheduler.queued == 3
+    with pytest.raises(AdmissionRejected) as rejected:
+        await scheduler.acquire("c", 10)
+    assert rejected.value.status_code == 503
+    assert int(rejected.value.headers["Retry-After"]) >= 1
+    
+    scheduler.max_queue = 10
+    with pytest.raises(AdmissionRejected) as rejected:
+        await scheduler.acquire("a", 10)
+    assert rejected.value.status_code == 429
+    
+    scheduler.release(running)
+    await asyncio.gather(*tasks)
+    assert order == ["a", "b", "a"]
+    assert scheduler.stats()["rejected"] == {"queue_full": 1, "session_limit": 1}
+
+@pytest.mark.asyncio
+async def test_llm_scheduler_deadline_and_token_budget():
+    """Test that queued calls time out and that the token bucket paces admissions."""
+    scheduler = LLMScheduler("test", max_concurrency=1, max_wait_seconds=0.05)
+    running = await scheduler.acquire("s1", 10)
+    with pytest.raises(AdmissionRejected) as rejected:
+        await scheduler.acquire("s2", 10)
+    assert rejected.value.reason == "deadline"
+    assert scheduler.queued == 0
+    # A shorter caller deadline is the caller's timeout, not an overloaded queue
+    with pytest.raises(DeadlineExceeded):
+        await scheduler.acquire("s2", 10, timeout=0.01)
+    assert scheduler.queued == 0
+    scheduler.release(running)
+    
+    # 6000 tokens per minute refill 100 per second
+    scheduler = LLMScheduler("test", max_concurrency=4, tokens_per_minute=6000)
+    first = await scheduler.acquire("s1", 6000)
+    start = time.perf_counter()
+    second = await scheduler.acquire("s2", 10)
+    assert 0.05 < time.perf_counter() - start < 0.5
+    scheduler.release(first, used_tokens=100)
+    scheduler.release(second, used_tokens=10)
+    assert scheduler.stats()["tokens_available"] > 5000
+
+@pytest.mark.asyncio
+async def test_chat_rejected_with_retry_after_when_llm_saturated(client):
+    """Test that overload returns 503 with Retry-After before the message is stored."""
+    original = gemini_service.scheduler
+    gemini_service.scheduler = LLMScheduler("gemini", max_concurrency=1, max_queue=0)
+    gemini_service.use_mock = False
+    try:
+        await gemini_service.scheduler.acquire("other", 10)
+        session_id = str(uuid.uuid4())
+        response = await client.post("/api/chat", json={"message": "Where is my order?", "session_id": session_id})
+        assert response.status_code == 503
+        assert int(response.headers["retry-after"]) >= 1
+        stream = await client.post("/api/chat/stream", json={"message": "Where is my order?", "session_id": session_id})
+        assert stream.status_code == 503
+        assert (await client.get(f"/api/chat/history/{session_id}")).status_code == 404
+    finally:
+        gemini_service.scheduler = original
+        gemini_service.use_mock = True
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    """Test that two store instances on one file (two workers) see each other's writes."""
+    path = str(tmp_path / "conversations.db")
+    worker_a, worker_b = SqliteConversationStore(path), SqliteConversationStore(path)
+    
+    worker_a.create_conversation("shared")
+    for i in range(5):
+        worker_a.add_message(_local_message("shared", f"message {i}"))
+    worker_a.update_conversation("shared", {"summary": "Earlier turns", "updated_at": "2024-01-01T00:00:00"})
+    
+    conversation = worker_b.get_conversation("shared")
+    assert conversation["summary"] == "Earlier turns"
+    assert [m["content"] for m in worker_b.get_messages("shared", limit=2)] == ["message 3", "message 4"]
+    page = worker_b.get_messages_page("shared", 3)
+    assert [m["content"] for m in page["messages"]] == ["message 0", "message 1", "message 2"]
+    rest = worker_b.get_messages_page("shared", 3, page["next_cursor"])
+    assert len(rest["messages"]) == 2 and rest["next_cursor"] is None
+    with pytest.raises(ValueError):
+        worker_b.get_messages_page("shared", 3, str(uuid.uuid4()))
+    assert "missing" not in worker_b and len(worker_b) == 1
+
+@pytest.mark.asyncio
+async def test_session_cache_sees_writes_from_other_workers(tmp_path):
+    """Test that a write flushed by one worker invalidates another worker's cached session."""
+    versions = SqliteConversationStore(str(tmp_path / "conversations.db"))
+    worker_a, worker_b = _appwrite_with_fake(), _appwrite_with_fake()
+    worker_b.databases = worker_a.databases
+    for worker in (worker_a, worker_b):
+        worker.session_cache.versions = versions
+        worker.session_cache.version_check_seconds = 0.05
+    
+    await worker_a.create_conversation("multi")
+    assert await worker_a.get_conversation_messages("multi", limit=10) == []
+    
+    await worker_b.add_message("multi", "user", "Sent through another worker")
+    await worker_b.write_behind.flush()
+    
+    # Seen once worker A's entry is due for a version check
+    await asyncio.sleep(0.06)
+    messages = await worker_a.get_conversation_messages("multi", limit=10)
+    assert [m["content"] for m in messages] == ["Sent through another worker"]
+    
+    # Worker A's own writes keep its cache entry current
+    await worker_a.add_message("multi", "assistant", "Reply")
+    await worker_a.write_behind.flush()
+    reads = worker_a.databases.calls.get("list_documents", 0)
+    assert len(await worker_a.get_conversation_messages("multi", limit=10)) == 2
+    assert worker_a.databases.calls.get("list_documents", 0) == reads
+
+@pytest.mark.asyncio
+async def test_chat_batch_streams_ndjson_results(client):
+    """Test that batch items are answered in per-session order and summarized."""
+    shared = str(uuid.uuid4())
+    items = [
+        {"id": "t1", "session_id": shared, "message": "My order is late"},
+        {"id": "t2", "message": "How do I reset my password?"},
+        {"id": "t3", "session_id": shared, "message": "It was order 1234"},
+    ]
+    response = await client.post("/api/chat/batch", json={"items": items, "concurrency": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1] == {"done": True, "total": 3, "failed": 0}
+    results = {r["id"]: r for r in lines[:-1]}
+    assert set(results) == {"t1", "t2", "t3"}
+    assert all(r["response"] for r in results.values())
+    assert results["t1"]["session_id"] == results["t3"]["session_id"] == shared
+    assert results["t1"]["index"] < results["t3"]["index"]
+    
+    history = (await client.get(f"/api/chat/history/{shared}")).json()
+    assert [m["content"] for m in history["messages"] if m["role"] == "user"] == [
+        "My order is late", "It was order 1234"
+    ]
+    assert (await client.post("/api/chat/batch", json={"items": []})).status_code == 400
+
+@pytest.mark.asyncio
+async def test_chat_batch_reports_rejected_items(client, monkeypatch):
+    """Test that items turned away by admission control fail individually."""
+    original = gemini_service.scheduler
+    gemini_service.scheduler = LLMScheduler("gemini", max_concurrency=1, max_queue=0)
+    gemini_service.use_mock = False
+    monkeypatch.setattr("app.config.settings.batch_admission_retries", 0)
+    try:
+        await gemini_service.scheduler.acquire("other", 10)
+        response = await client.post("/api/chat/batch", json={"items": [
+            {"message": "My order is late"}, {"message": "I need a refund"}
+        ]})
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines[-1]["failed"] == 2
+        assert all(r["error"] == "busy" and r["status"] == 503 and r["retry_after"] >= 1 for r in lines[:-1])
+    finally:
+        gemini_service.scheduler = original
+        gemini_service.use_mock = True
+
+@pytest.mark.asyncio
+async def test_list_chat_sessions_pages_and_filters(client):
+    """Test cursor pagination and the updated_at filters of the session listing."""
+    since = datetime.now().isoformat()
+    session_ids = []
+    for i in range(3):
+        response = await client.post("/api/chat", json={"message": f"Question {i}"})
+        session_ids.append(response.json()["session_id"])
+    
+    first = (await client.get("/api/chat/sessions", params={"limit": 2, "updated_after": since})).json()
+    rest = (await client.get("/api/chat/sessions", params={
+        "limit": 2, "updated_after": since, "cursor": first["next_cursor"]
+    })).json()
+    assert [s["session_id"] for s in first["sessions"] + rest["sessions"]] == session_ids
+    assert rest["next_cursor"] is None
+    
+    later = (await client.get("/api/chat/sessions", params={"updated_before": since})).json()
+    assert not set(session_ids) & {s["session_id"] for s in later["sessions"]}
+    response = await client.get("/api/chat/sessions", params={"cursor": str(uuid.uuid4())})
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_export_pages_through_appwrite():
+    """Test that the export walks conversations and messages page by page."""
+    service = _appwrite_with_fake()
+    service.write_behind = None
+    for i in range(3):
+        await service.create_conversation(f"session-{i}")
+        for j in range(5):
+            await service.add_message(f"session-{i}", "user", f"Message {i}.{j}")
+    
+    records = [r async for r in service.export_conversations(page_size=2)]
+    assert [r["session_id"] for r in records if r["type"] == "conversation"] == ["session-0", "session-1", "session-2"]
+    assert [r["content"] for r in records[1:6]] == [f"Message 0.{j}" for j in range(5)]
+    assert len(records) == 18
+    # Conversation pages, message pages, and one archive lookup per session
+    assert service.databases.calls["list_documents"] == 2 + 3 * 3 + 3
+
+@pytest.mark.asyncio
+async def test_export_endpoint_streams_gzip_ndjson(client):
+    """Test the NDJSON export and its gzip variant."""
+    since = datetime.now().isoformat()
+    response = await client.post("/api/chat", json={"message": "Export me"})
+    session_id = response.json()["session_id"]
+    
+    plain = await client.get("/api/chat/export", params={"updated_after": since})
+    records = [json.loads(line) for line in plain.text.splitlines()]
+    assert records[0]["type"] == "conversation" and records[0]["session_id"] == session_id
+    assert [r["role"] for r in records[1:3]] == ["user", "assistant"]
+    assert records[-1] == {"type": "end", "conversations": 1, "messages": 2}
+    
+    compressed = await client.get("/api/chat/export", params={"updated_after": since, "gzip": "true"})
+    assert compressed.headers["content-type"] == "application/gzip"
+    assert gzip.decompress(compressed.content).decode() == plain.text
+
+@pytest.mark.asyncio
+async def test_idempotency_store_joins_replays_and_releases():
+    """Test that concurrent and later retries share one computation, and failures are not kept."""
+    store = IdempotencyStore(max_keys=2, ttl_seconds=60)
+    calls = []
+    
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+    
+    results = await asyncio.gather(*(store.run("k1", "fp", compute) for _ in range(3)))
+    assert results == [("answer", False), ("answer", True), ("answer", True)]
+    assert await store.run("k1", "fp", compute) == ("answer", True)
+    assert len(calls) == 1
+    with pytest.raises(IdempotencyConflict):
+        await store.run("k1", "other", compute)
+    
+    async def failing():
+        raise RuntimeError("upstream down")
+    
+    with pytest.raises(RuntimeError):
+        await store.run("k2", "fp", failing)
+    assert await store.run("k2", "fp", compute) == ("answer", False)
+    
+    await store.run("k3", "fp", compute)
+    assert "k1" not in store._records and store.stats()["evictions"] == 1
+
+@pytest.mark.asyncio
+async def test_chat_retry_with_idempotency_key_is_not_rerun(client):
+    """Test that a retried submission returns the stored reply without storing the turn twice."""
+    session_id = str(uuid.uuid4())
+    body = {"message": "Where is my parcel?", "session_id": session_id}
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    
+    first, second = await asyncio.gather(
+        client.post("/api/chat", json=body, headers=headers),
+        client.post("/api/chat", json=body, headers=headers)
+    )
+    third = await client.post("/api/chat", json=body, headers=headers)
+    assert first.json() == second.json() == third.json()
+    assert third.headers["idempotent-replayed"] == "true"
+    history = (await client.get(f"/api/chat/history/{session_id}")).json()
+    assert len(history["messages"]) == 2
+    
+    conflict = await client.post("/api/chat", json=dict(body, message="Something else"), headers=headers)
+    assert conflict.status_code == 422
+    
+    # A streamed submission can be retried through either endpoint
+    key = {"Idempotency-Key": str(uuid.uuid4())}
+    stream = await client.post("/api/chat/stream", json=body, headers=key)
+    replay = await client.post("/api/chat/stream", json=body, headers=key)
+    assert replay.headers["idempotent-replayed"] == "true"
+    delta = "".join(json.loads(line[6:]).get("delta", "") for line in stream.text.splitlines()
+                    if line.startswith("data: "))
+    assert (await client.post("/api/chat", json=body, headers=key)).json()["response"] == delta.strip()
+    history = (await client.get(f"/api/chat/history/{session_id}")).json()
+    assert len(history["messages"]) == 4
+
+def test_intent_router_answers_only_trivial_messages():
+    """Test intent coverage thresholds, templated captures and the absorbed fraction."""
+    router = IntentRouter(DEFAULT_INTENTS + [{
+        "name": "order_status",
+        "patterns": [r"\b(where is|track) my order #?(?P<order_id>\d+)"],
+        "answer": "You can follow order {order_id} at example.com/track/{order_id}.",
+        "min_confidence": 0.6
+    }])
+    assert router.match("Hi there!").intent == "greeting"
+    assert router.match("thanks so much :)").intent == "thanks"
+    assert router.match("Thanks, but my parcel still has not arrived") is None
+    assert router.match("Where is my order #12345 please?").answer == \
+        "You can follow order 12345 at example.com/track/12345."
+    assert router.match("") is None
+    assert router.stats()["absorbed"] == {"greeting": 1, "thanks": 1, "order_status": 1}
+    assert router.absorbed_fraction() == 0.6
+
+def test_intent_router_answers_order_status_questions():
+    """Test the built-in order status intent needs an order number and little else in the message."""
+    router = IntentRouter(DEFAULT_INTENTS)
+    answer = router.match("Where is my order #12345?").answer
+    assert "order 12345" in answer
+    assert router.match("order no. 98765 status").intent == "order_status"
+    assert router.match("Can you track order 4471 for me?").intent == "order_status"
+    assert router.match("Where is my order?") is None
+    assert router.match("Where is my order #12345? It was charged twice and arrived broken") is None
+
+@pytest.mark.asyncio
+async def test_session_cache_counters_are_exported(client):
+    """Test that session cache hits, misses and evictions show up as Prometheus counters."""
+    hits, misses = CACHE_LOOKUPS.labels("session", "hit"), CACHE_LOOKUPS.labels("session", "miss")
+    capacity = CACHE_EVICTIONS.labels("session", "capacity")
+    before = (hits.value, misses.value, capacity.value)
+    cache = SessionCache(max_sessions=1)
+    cache.put_conversation("a", {"session_id": "a"})
+    cache.put_conversation("b", {"session_id": "b"})
+    assert cache.get_conversation("a") is None
+    assert cache.get_conversation("b") == {"session_id": "b"}
+    assert (hits.value, misses.value, capacity.value) == (before[0] + 1, before[1] + 1, before[2] + 1)
+    
+    text = (await client.get("/api/metrics")).text
+    assert 'cache_lookups_total{cache="session",result="hit"}' in text
+    assert 'cache_evictions_total{cache="session",reason="capacity"}' in text
+
+@pytest.mark.asyncio
+async def test_fast_path_skips_the_model(client, monkeypatch):
+    """Test that a greeting is answered and stored without a Gemini call."""
+    async def fail(*args, **kwargs):
+        raise AssertionError("Gemini should not be called")
+    monkeypatch.setattr(gemini_service, "generate_simple_response", fail)
+    monkeypatch.setattr(gemini_service, "generate_response", fail)
+    
+    session_id = str(uuid.uuid4())
+    response = await client.post("/api/chat", json={"message": "Good morning!", "session_id": session_id})
+    assert response.json()["response"] == "Hello! How can I help you today?"
+    stream = await client.post("/api/chat/stream", json={"message": "thank you", "session_id": session_id})
+    assert _parse_sse(stream.text)[-1][0] == "done"
+    history = (await client.get(f"/api/chat/history/{session_id}")).json()
+    assert [m["role"] for m in history["messages"]] == ["user", "assistant"] * 2
+    assert "fast_path_responses" in (await client.get("/api/metrics")).text
+
+@pytest.mark.asyncio
+async def test_fast_path_leaves_replies_to_assistant_questions_to_the_model(client):
+    """Test that "ok" answering the assistant's question mid-conversation is not treated as an acknowledgement."""
+    acknowledgement = "Glad I could help! Let me know if there's anything else you need."
+    session_id = str(uuid.uuid4())
+    await appwrite_service.add_message(session_id, "user", "My card was charged twice")
+    await appwrite_service.add_message(session_id, "assistant", "Should I refund the duplicate charge?")
+    
+    response = await client.post("/api/chat", json={"message": "ok", "session_id": session_id})
+    assert response.json()["response"] != acknowledgement
+    response = await client.post("/api/chat", json={"message": "ok", "session_id": str(uuid.uuid4())})
+    assert response.json()["response"] == acknowledgement
+    
+    router = IntentRouter(DEFAULT_INTENTS)
+    assert router.match("no thanks") is None
+    assert router.match("thanks!", after_question=True) is None
+    assert router.match("Hello!", after_question=True).intent == "greeting"
+
+@pytest.mark.asyncio
+async def test_chat_deadline_returns_504_without_tripping_breaker(client):
+    """Test that X-Request-Timeout bounds the Gemini call and is not counted as an upstream failure."""
+    original_model = getattr(gemini_service, "model", None)
+    gemini_service.model = FakeGenerativeModel(latency=0.5)
+    gemini_service.use_mock = False
+    failures = gemini_service.breaker.failures
+    try:
+        start = time.perf_counter()
+        response = await client.post(
+            "/api/chat",
+            json={"message": "Why was I charged twice?"},
+            headers={"X-Request-Timeout": "0.1"}
+        )
+        assert response.status_code == 504
+        assert time.perf_counter() - start < 0.4
+        assert gemini_service.breaker.failures == failures
+    finally:
+        gemini_service.model = original_model
+        gemini_service.use_mock = True
+
+@pytest.mark.asyncio
+async def test_hedged_generation_beats_slow_calls_within_budget():
+    """Test that a slow call is hedged, the faster answer wins, and the budget caps hedges."""
+    class SlowFirstModel(FakeGenerativeModel):
+        def _sleep(self):
+            self.calls_made = getattr(self, "calls_made", 0) + 1
+            time.sleep(1.0 if self.calls_made % 2 else 0.01)
+    
+    service = GeminiService()
+    service.model = SlowFirstModel(latency=0)
+    service.use_mock = False
+    service.hedge_policy = HedgePolicy(budget_ratio=0.5, min_samples=3, min_delay_seconds=0.02)
+    for _ in range(3):
+        service.hedge_policy.observe(0.02)
+    
+    service.hedge_policy.record_primary()  # Earn a full credit
+    start = time.perf_counter()
+    response = await service._generate_content("Where is my order?", "s1")
+    assert response.text.startswith("Fake answer")
+    assert time.perf_counter() - start < 0.5
+    assert service.hedge_policy.stats()["hedge_wins"] == 1
+    # The losing call still occupies a thread, so its slot stays taken until it returns
+    assert service.scheduler.active == 1
+    await asyncio.sleep(1.0)
+    assert service.scheduler.active == 0
+    
+    # No credit left: the next slow call is not hedged
+    service.model.calls_made = 0
+    start = time.perf_counter()
+    await service._generate_content("Where is my order?", "s1")
+    assert time.perf_counter() - start >= 1.0
+    assert service.hedge_policy.stats()["hedges"] == 1
+
+@pytest.mark.asyncio
+async def test_turn_pipeline_overlaps_storage_stages(monkeypatch):
+    """Test that the conversation and history are read together and the user message is stored alongside."""
+    session_id = str(uuid.uuid4())
+    pipeline = TurnPipeline("chat", session_id, "Where is my order?")
+    stored = []
+    async def create_conversation(session_id):
+        await asyncio.sleep(0.1)
+        return {"session_id": session_id}
+    async def get_conversation_messages(session_id, limit=None):
+        await asyncio.sleep(0.1)
+        # The read raced the user message write and already sees it
+        return [{"id": "m1", "role": "user", "content": "Hi"},
+                {"id": pipeline.user_message_id, "role": "user", "content": "Where is my order?"}]
+    async def add_message(session_id, role, content, message_id=None):
+        await asyncio.sleep(0.1)
+        stored.append(role)
+    monkeypatch.setattr(appwrite_service, "create_conversation", create_conversation)
+    monkeypatch.setattr(appwrite_service, "get_conversation_messages", get_conversation_messages)
+    monkeypatch.setattr(appwrite_service, "add_message", add_message)
+    
+    start = time.perf_counter()
+    history, summary = await pipeline.context()
+    assert time.perf_counter() - start < 0.18
+    assert [m["id"] for m in history] == ["m1"]
+    assert stored == []
+    await pipeline.finish("It ships tomorrow.")
+    assert stored == ["user", "assistant"]
+
+def test_importing_the_app_skips_heavy_modules():
+    """Test that importing the app does not load numpy or the upstream SDK clients."""
+    code = ("import sys, app.main; "
+            "print(sorted(m for m in ('numpy', 'google.generativeai', 'appwrite.client') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    assert result.stdout.strip() == "[]"
+
+@pytest.mark.asyncio
+async def test_chat_waits_for_service_startup(client, monkeypatch):
+    """Test that chat requests are held while the services start, with a 503 if that takes too long."""
+    started = asyncio.Event()
+    calls = []
+    async def slow_start(warmup=True):
+        calls.append(warmup)
+        await started.wait()
+    monkeypatch.setattr(gemini_service, "start", slow_start)
+    monkeypatch.setattr(appwrite_service, "start", slow_start)
+    monkeypatch.setattr("app.config.settings.startup_wait_seconds", 0.05)
+    startup = ServiceStartup(warmup=False)
+    monkeypatch.setattr(lifecycle, "startup", startup)
+    
+    task = startup.begin()
+    assert startup.begin() is task
+    response = await client.post("/api/chat", json={"message": "Where is my order?"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert (await client.get("/api/health")).status_code == 200
+    
+    pending = asyncio.ensure_future(client.post("/api/chat", json={"message": "Where is my order?"}))
+    await asyncio.sleep(0.01)
+    started.set()
+    assert (await pending).status_code == 200
+    assert startup.ready and calls == [False, False]
+    assert set(startup.stats()["durations"]) == {"gemini", "appwrite"}
+
+@pytest.mark.asyncio
+async def test_gemini_start_loads_the_knowledge_base_once(tmp_path, monkeypatch):
+    """Test that the knowledge base is loaded by start() rather than on construction."""
+    _write_article(tmp_path, "returns.md", "Items can be returned within thirty days of delivery.")
+    monkeypatch.setattr("app.config.settings.knowledge_base_dir", str(tmp_path))
+    service = GeminiService()
+    assert service.knowledge_base is None and service.model is None
+    await service.start()
+    knowledge_base = service.knowledge_base
+    assert knowledge_base.stats()["files"] == 1
+    await service.start()
+    assert service.knowledge_base is knowledge_base
+    assert service.use_mock == True
+
+@pytest.mark.asyncio
+async def test_ready_reports_dependencies_from_cached_probes(client, monkeypatch):
+    """Test that /api/ready serves the last background probe results without calling upstream itself."""
+    response = await client.get("/api/ready")
+    assert response.status_code == 200
+    gemini = response.json()["dependencies"]["gemini"]
+    assert gemini["mock"] == True and gemini["fallback"] == False and gemini["probe"] is None
+    
+    probes = []
+    async def failing_probe(timeout=None):
+        probes.append(timeout)
+        raise ConnectionError("connection refused")
+    monkeypatch.setattr(appwrite_service, "use_mock", False)
+    monkeypatch.setattr(appwrite_service, "probe", failing_probe)
+    probe = UpstreamProbe(timeout_seconds=1.0)
+    monkeypatch.setattr("routes.health.upstream_probe", probe)
+    await probe.check()
+    
+    # An upstream outage is reported but does not take the worker out of rotation
+    for _ in range(5):
+        response = await client.get("/api/ready")
+        assert response.status_code == 200
+    assert probes == [1.0]
+    data = response.json()
+    assert data["status"] == "ready"
+    appwrite = data["dependencies"]["appwrite"]
+    assert appwrite["healthy"] == False and appwrite["breaker"] == "closed"
+    assert appwrite["probe"]["error"] == "connection refused"
+    assert appwrite["last_latency_ms"] is not None
+    assert data["dependencies"]["gemini"]["healthy"] == True
+    
+    # A full write-behind queue is this worker's own problem
+    monkeypatch.setattr(appwrite_service.write_behind, "max_pending", 0)
+    response = await client.get("/api/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "degraded"
+    assert response.json()["dependencies"]["appwrite"]["saturated"] == True
+
+@pytest.mark.asyncio
+async def test_retention_archives_old_turns_and_deletes_inactive_sessions(monkeypatch):
+    """Test that old turns move to compressed archives and the summary, and idle sessions are deleted."""
+    service = _appwrite_with_fake()
+    service.write_behind = None
+    monkeypatch.setattr("app.retention.appwrite_service", service)
+    databases = service.databases
+    conversations, messages = databases._collection("conversations"), databases._collection("messages")
+    conversations["active"] = {"$id": "active", "session_id": "active", "created_at": "2020-01-01T00:00:00",
+                               "updated_at": datetime.now().isoformat()}
+    conversations["idle"] = {"$id": "idle", "session_id": "idle", "created_at": "2020-01-02T00:00:00",
+                             "updated_at": "2020-01-02T00:00:00"}
+    for session_id, count in (("active", 60), ("idle", 5)):
+        for i in range(count):
+            message_id = f"{session_id}-{i:02d}"
+            messages[message_id] = {"$id": message_id, "id": message_id, "session_id": session_id,
+                                    "role": "user" if i % 2 == 0 else "assistant",
+                                    "content": f"Turn {i}", "timestamp": f"2020-01-01T00:{i:02d}:00"}
+    await service.create_archive("idle", [messages["idle-00"]])
+    
+    job = RetentionJob(keep_recent=20, batch_size=25, calls_per_second=1000)
+    await job.run_once()
+    assert job.stats() == {"archived_messages": 25, "deleted_sessions": 1, "passes": 1}
+    assert "idle" not in conversations and not any(m["session_id"] == "idle" for m in messages.values())
+    assert not any(a["session_id"] == "idle" for a in databases._collection("archives").values())
+    assert conversations["active"]["summarized_through"] == "active-24"
+    
+    # The next batch stops short of the newest 20 messages
+    await job.run_once()
+    assert sorted(messages) == [f"active-{i:02d}" for i in range(40, 60)]
+    assert conversations["active"]["summarized_through"] == "active-39"
+    assert "- Assistant: Turn 39" in conversations["active"]["summary"]
+    await job.run_once()
+    assert job.archived_messages == 40
+    
+    archived = await service.get_archived_messages("active")
+    assert [m["id"] for m in archived] == [f"active-{i:02d}" for i in range(40)]
+    records = [record async for record in service.export_conversations()]
+    exported = [record["content"] for record in records if record["type"] == "message"]
+    assert exported == [f"Turn {i}" for i in range(60)]
+
+@pytest.mark.asyncio
+async def test_retention_cursor_survives_deleted_session(monkeypatch):
+    """Test that a pass continues after the session at the end of a page was deleted."""
+    service = _appwrite_with_fake()
+    service.write_behind = None
+    monkeypatch.setattr("app.retention.appwrite_service", service)
+    conversations = service.databases._collection("conversations")
+    for i in range(3):
+        session_id = f"idle-{i}"
+        conversations[session_id] = {"$id": session_id, "session_id": session_id,
+                                     "created_at": f"2020-01-0{i + 1}T00:00:00", "updated_at": "2020-01-05T00:00:00"}
+    
+    job = RetentionJob(sessions_per_run=1, calls_per_second=1000)
+    for _ in range(3):
+        await job.run_once()
+    assert job.deleted_sessions == 3 and conversations == {}
+    await job.run_once()
+    assert job.passes == 1
+
+@pytest.mark.asyncio
+async def test_sqlite_local_store_waits_off_the_event_loop_and_degrades(tmp_path):
+    """Test that a local write waiting on another worker's lock neither blocks the event loop nor fails the turn."""
+    path = str(tmp_path / "conversations.db")
+    service = AppwriteService()
+    service.local_store = SqliteConversationStore(path, busy_timeout_seconds=0.3)
+    await service.create_conversation("s")
+    other_worker = sqlite3.connect(path, isolation_level=None)
+    other_worker.execute("BEGIN IMMEDIATE")
+    
+    write = asyncio.ensure_future(service.add_message("s", "user", "Hello"))
+    ticks = 0
+    while not write.done():
+        await asyncio.sleep(0.01)
+        ticks += 1
+    assert ticks >= 10
+    # The lock outlasted the busy timeout: the message is dropped locally instead of raising
+    assert (await write)["content"] == "Hello"
+    other_worker.execute("COMMIT")
+    other_worker.close()
+    assert await service.get_conversation_messages("s") == []
+
+def test_sqlite_lease_has_one_holder(tmp_path):
+    """Test that a lease is held by one worker until it is released or expires."""
+    path = str(tmp_path / "shared.db")
+    worker_a, worker_b = SqliteConversationStore(path), SqliteConversationStore(path)
+    assert worker_a.acquire_lease("retention", "a", 60)
+    assert not worker_b.acquire_lease("retention", "b", 60)
+    assert worker_a.acquire_lease("retention", "a", 60)
+    worker_a.release_lease("retention", "a")
+    assert worker_b.acquire_lease("retention", "b", 0.01)
+    time.sleep(0.02)
+    assert worker_a.acquire_lease("retention", "a", 60)
+
+def test_sqlite_store_prunes_idle_sessions_and_versions(tmp_path):
+    """Test that pruning drops idle sessions and version counters without reusing old versions."""
+    store = SqliteConversationStore(str(tmp_path / "conversations.db"))
+    store.add_message(_local_message("old", "Long ago"))
+    store.update_conversation("old", {"updated_at": "2020-01-01T00:00:00"})
+    store.add_message(_local_message("recent", "Just now"))
+    assert store.bump_session_version("old") == (0, 1)
+    assert store.bump_session_version("old") == (1, 2)
+    
+    store._db().execute("UPDATE session_versions SET touched_at = 0")
+    assert store.prune(idle_seconds=3600) == 2
+    assert "old" not in store and "recent" in store
+    assert store.session_version("old") == 0
+    # A cache entry loaded at version 1 or 2 must not match the restarted counter
+    assert store.bump_session_version("old") == (0, 3)
+
+@pytest.mark.asyncio
+async def test_sqlite_local_store_is_pruned_in_the_background(tmp_path):
+    """Test that writes do not prune the SQLite store inline and the service's background task does."""
+    service = AppwriteService()
+    service.local_store = store = SqliteConversationStore(str(tmp_path / "conversations.db"))
+    store.add_message(_local_message("old", "Long ago"))
+    store.update_conversation("old", {"updated_at": "2020-01-01T00:00:00"})
+    store.add_message(_local_message("recent", "Just now"))
+    assert "old" in store
+    
+    task = asyncio.ensure_future(service._prune_local_store(interval=0.01))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert "old" not in store and "recent" in store
+
+def test_session_cache_checks_versions_once_per_window(tmp_path):
+    """Test that hot lookups skip the version store until the entry is due for a check."""
+    versions = SqliteConversationStore(str(tmp_path / "conversations.db"))
+    reads = []
+    session_version = versions.session_version
+    versions.session_version = lambda session_id: reads.append(session_id) or session_version(session_id)
+    cache = SessionCache(versions=versions, version_check_seconds=0.05)
+    cache.put_conversation("s", {"session_id": "s"}, 0)
+    for _ in range(100):
+        assert cache.get_conversation("s") == {"session_id": "s"}
+    assert reads == []
+    
+    versions.bump_session_version("s")
+    time.sleep(0.06)
+    assert cache.get_conversation("s") is None
+    assert reads == ["s"]
+
+@pytest.mark.asyncio
+async def test_session_cache_bumps_versions_off_the_event_loop(tmp_path):
+    """Test that a version bump waiting on another worker's write lock does not block the event loop."""
+    path = str(tmp_path / "conversations.db")
+    cache = SessionCache(versions=SqliteConversationStore(path, busy_timeout_seconds=2))
+    cache.put_conversation("s", {"session_id": "s"}, cache.current_version("s"))
+    other_worker = sqlite3.connect(path, isolation_level=None)
+    other_worker.execute("BEGIN IMMEDIATE")
+    
+    write = asyncio.ensure_future(cache.record_write("s"))
+    ticks = 0
+    while ticks < 5:
+        await asyncio.sleep(0.01)
+        ticks += 1
+    assert not write.done()
+    # Lookups still answer while the store is locked
+    assert cache.get_conversation("s") == {"session_id": "s"}
+    other_worker.execute("COMMIT")
+    await write
+    assert cache.get_conversation("s") == {"session_id": "s"}
+    other_worker.close()